@@ -9,12 +9,31 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 DB_PATH = DATA_DIR / "portfolio.db"
 
+# Valor de position_cache.stale_since que força recálculo desde a primeira operação
+POSITION_FULL_REFRESH = "0000-00-00"
+
+# Limite conservador de parâmetros por instrução (SQLite antigo aceita até 999)
+SQLITE_MAX_PARAMS = 900
+
 def get_connection():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(DB_PATH, timeout=30.0)
     conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging para melhor concorrência
     return conn
 
+def chunked(items, size: int = SQLITE_MAX_PARAMS):
+    """
+    Divide uma sequência em blocos para uso em cláusulas `IN (...)`.
+    
+    Uso:
+        for chunk in chunked(asset_ids):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"... WHERE asset_id IN ({placeholders})", chunk)
+    """
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 @contextmanager
 def get_db():
     """
@@ -178,6 +197,63 @@ def init_db():
         )
     """)
 
+    # Cache compartilhado entre processos (workers do uvicorn): cada escrita
+    # em quotes incrementa quote_changes.version e grava o novo valor na
+    # linha, então um worker traz para a memória só o que mudou desde a
+    # última versão que viu
+    try:
+        cursor.execute("ALTER TABLE quotes ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        logger.info("Coluna 'version' adicionada à tabela quotes")
+    except sqlite3.OperationalError:
+        logger.debug("Coluna 'version' já existe na tabela quotes")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_quotes_version
+        ON quotes(version)
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quote_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO quote_changes (id, version) VALUES (1, 0)")
+    for event, when in (("insert", "AFTER INSERT"), ("update", "AFTER UPDATE OF price, updated_at")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_quotes_{event}_version
+            {when} ON quotes
+            BEGIN
+                UPDATE quote_changes SET version = version + 1 WHERE id = 1;
+                UPDATE quotes SET version = (SELECT version FROM quote_changes WHERE id = 1)
+                WHERE id = NEW.id;
+            END
+        """)
+
+    # Concessões (leases) com validade entre processos: liderança do
+    # agendador de cotações e reserva de tickers em atualização
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+    # Histórico diário de cotações (OHLCV) por ativo. date é inteiro YYYYMMDD
+    # (compacto e ordenável); WITHOUT ROWID guarda as linhas na própria chave
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quote_history (
+            asset_id INTEGER NOT NULL,
+            date INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL NOT NULL,
+            volume INTEGER,
+            PRIMARY KEY (asset_id, date),
+            FOREIGN KEY (asset_id) REFERENCES assets(id)
+        ) WITHOUT ROWID
+    """)
+
     # Tabela de snapshots de posição (para reconciliação)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS position_snapshots (
@@ -198,6 +274,208 @@ def init_db():
         ON position_snapshots(asset_id, snapshot_date DESC)
     """)
 
+    # Lotes de snapshot: um por arquivo de posição importado. position_snapshots
+    # guarda apenas as quantidades que mudaram em relação ao lote anterior.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            snapshot_date TEXT NOT NULL,
+            source TEXT DEFAULT 'B3',
+            filename TEXT,
+            total_positions INTEGER NOT NULL DEFAULT 0,
+            changed_positions INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_snapshot_batches_date
+        ON snapshot_batches(snapshot_date)
+    """)
+
+    # Migration: Adicionar coluna batch_id em position_snapshots
+    try:
+        cursor.execute("ALTER TABLE position_snapshots ADD COLUMN batch_id INTEGER REFERENCES snapshot_batches(id)")
+        logger.info("Coluna 'batch_id' adicionada à tabela position_snapshots")
+    except sqlite3.OperationalError:
+        logger.debug("Coluna 'batch_id' já existe na tabela position_snapshots")
+
+    # Último snapshot conhecido de cada ativo (mantido na importação): quantidade
+    # e lote/data da última confirmação, mesmo que a quantidade não tenha mudado
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS position_snapshot_latest (
+            asset_id INTEGER PRIMARY KEY,
+            quantity REAL NOT NULL,
+            batch_id INTEGER,
+            snapshot_date TEXT NOT NULL,
+            FOREIGN KEY (asset_id) REFERENCES assets(id),
+            FOREIGN KEY (batch_id) REFERENCES snapshot_batches(id)
+        )
+    """)
+
+    # Migration: snapshots antigos (uma linha por ativo por importação) viram
+    # um lote por snapshot_date, e o ponteiro é preenchido com o mais recente
+    cursor.execute("SELECT COUNT(*) FROM position_snapshots WHERE batch_id IS NULL")
+    if cursor.fetchone()[0] > 0:
+        cursor.execute("""
+            INSERT INTO snapshot_batches (snapshot_date, source, total_positions, changed_positions, created_at)
+            SELECT snapshot_date, MAX(source), COUNT(*), COUNT(*), MIN(created_at)
+            FROM position_snapshots
+            WHERE batch_id IS NULL
+            GROUP BY snapshot_date
+            ORDER BY snapshot_date
+        """)
+        cursor.execute("""
+            UPDATE position_snapshots
+            SET batch_id = (
+                SELECT MAX(b.id) FROM snapshot_batches b
+                WHERE b.snapshot_date = position_snapshots.snapshot_date
+            )
+            WHERE batch_id IS NULL
+        """)
+        cursor.execute("""
+            INSERT OR REPLACE INTO position_snapshot_latest (asset_id, quantity, batch_id, snapshot_date)
+            SELECT asset_id, quantity, batch_id, snapshot_date
+            FROM (
+                SELECT asset_id, quantity, batch_id, snapshot_date,
+                       ROW_NUMBER() OVER (PARTITION BY asset_id ORDER BY snapshot_date DESC, id DESC) as rn
+                FROM position_snapshots
+            )
+            WHERE rn = 1
+        """)
+        logger.info("Snapshots de posição migrados para lotes")
+
+    # Eventos corporativos por razão (desdobro 1:N, grupamento N:1, bonificação
+    # com custo atribuído). cumulative_factor é o produto dos fatores de todos os
+    # eventos do ativo com ex_date <= este (mantido pelo repositório).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS corporate_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            asset_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            ex_date TEXT NOT NULL,
+            ratio_from REAL NOT NULL,
+            ratio_to REAL NOT NULL,
+            cost_basis REAL NOT NULL DEFAULT 0,
+            cumulative_factor REAL NOT NULL DEFAULT 1,
+            notes TEXT,
+            created_at TEXT NOT NULL,
+            UNIQUE (asset_id, event_type, ex_date),
+            FOREIGN KEY (asset_id) REFERENCES assets(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_corporate_events_asset_date
+        ON corporate_events(asset_id, ex_date)
+    """)
+
+    # Execuções de auto-fix da reconciliação por chave de idempotência: uma
+    # repetição da mesma requisição devolve o resultado gravado sem novos ajustes
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reconciliation_fix_requests (
+            idempotency_key TEXT PRIMARY KEY,
+            ticker TEXT,
+            result TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+    # Índice para leituras de operações por ativo em ordem cronológica
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_operations_asset_date
+        ON operations(asset_id, trade_date)
+    """)
+
+    # Cache de posições calculadas pelo engine (derivado, NÃO autoritativo).
+    # stale_since marca a data mais antiga afetada por mudanças em operations;
+    # NULL significa que a posição está atualizada.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS position_cache (
+            asset_id INTEGER PRIMARY KEY,
+            quantity REAL NOT NULL,
+            total_cost REAL NOT NULL,
+            total_bought_value REAL NOT NULL,
+            total_sold_value REAL NOT NULL,
+            timeline_count INTEGER NOT NULL,
+            last_trade_date TEXT,
+            stale_since TEXT,
+            computed_at TEXT NOT NULL,
+            FOREIGN KEY (asset_id) REFERENCES assets(id)
+        )
+    """)
+
+    # Checkpoints mensais do engine: estado após todas as operações com
+    # trade_date <= as_of. Permitem recalcular a partir de uma data.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS position_checkpoints (
+            asset_id INTEGER NOT NULL,
+            as_of TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            total_cost REAL NOT NULL,
+            total_bought_value REAL NOT NULL,
+            total_sold_value REAL NOT NULL,
+            timeline_count INTEGER NOT NULL,
+            PRIMARY KEY (asset_id, as_of),
+            FOREIGN KEY (asset_id) REFERENCES assets(id)
+        )
+    """)
+
+    # Invalidação do cache de posições: qualquer escrita em operations marca
+    # o ativo como desatualizado a partir da menor data afetada
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_operations_insert_position_stale
+        AFTER INSERT ON operations
+        BEGIN
+            UPDATE position_cache
+            SET stale_since = MIN(COALESCE(stale_since, NEW.trade_date), NEW.trade_date)
+            WHERE asset_id = NEW.asset_id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_operations_update_position_stale
+        AFTER UPDATE ON operations
+        BEGIN
+            UPDATE position_cache
+            SET stale_since = MIN(COALESCE(stale_since, OLD.trade_date), OLD.trade_date, NEW.trade_date)
+            WHERE asset_id IN (OLD.asset_id, NEW.asset_id);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_operations_delete_position_stale
+        AFTER DELETE ON operations
+        BEGIN
+            UPDATE position_cache
+            SET stale_since = MIN(COALESCE(stale_since, OLD.trade_date), OLD.trade_date)
+            WHERE asset_id = OLD.asset_id;
+        END
+    """)
+
+    # Eventos corporativos mudam o fator de ajuste de todo o histórico do
+    # ativo: invalida o cache inteiro (recalculo desde o início)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_corporate_events_insert_position_stale
+        AFTER INSERT ON corporate_events
+        BEGIN
+            UPDATE position_cache SET stale_since = '{POSITION_FULL_REFRESH}'
+            WHERE asset_id = NEW.asset_id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_corporate_events_update_position_stale
+        AFTER UPDATE OF asset_id, ex_date, ratio_from, ratio_to, cost_basis ON corporate_events
+        BEGIN
+            UPDATE position_cache SET stale_since = '{POSITION_FULL_REFRESH}'
+            WHERE asset_id IN (OLD.asset_id, NEW.asset_id);
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_corporate_events_delete_position_stale
+        AFTER DELETE ON corporate_events
+        BEGIN
+            UPDATE position_cache SET stale_since = '{POSITION_FULL_REFRESH}'
+            WHERE asset_id = OLD.asset_id;
+        END
+    """)
+
     conn.commit()
     conn.close()
     logger.info("Banco de dados inicializado com sucesso")
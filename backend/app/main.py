@@ -1,6 +1,6 @@
 import os
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from datetime import date
@@ -16,11 +16,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from app.services.importer import import_b3_excel, normalize_ticker
+from app.services.importer import import_b3_excel, preview_b3_import, normalize_ticker
+from app.services.corporate_events import (
+    apply_corporate_events as apply_corporate_events_bulk,
+    register_ratio_event,
+    list_ratio_events,
+    delete_ratio_event
+)
+from app.services.split_detection import suggest_corporate_events
 from app.services.reconciliation import (
     import_position_snapshot,
     get_reconciliation_diagnosis,
-    auto_fix_positions
+    auto_fix_positions,
+    apply_snapshot_retention,
+    SNAPSHOT_RETENTION_DAYS
 )
 from app.db.database import init_db
 from app.repositories.operations_repository import (
@@ -34,6 +43,7 @@ from app.repositories.operations_repository import (
 from app.repositories.assets_repository import (
     create_asset,
     get_asset_by_id,
+    get_assets_by_ids,
     get_asset_with_stats,
     get_asset_by_ticker,
     list_assets,
@@ -44,10 +54,10 @@ from app.repositories.dashboard_repository import (
     get_dashboard_summary
 )
 from app.repositories.quotes_repository import (
-    save_quote,
-    get_quote,
+    get_quotes,
     get_all_quotes,
-    get_tickers_to_update
+    get_tickers_to_update,
+    QUOTED_ASSET_CLASSES
 )
 from app.repositories.fixed_income_repository import (
     create_fixed_income_asset,
@@ -60,9 +70,11 @@ from app.repositories.fixed_income_repository import (
     delete_fixed_income_asset
 )
 from app.services.market_data_service import get_market_data_service
+from app.services.quote_scheduler import QuoteRefreshScheduler
+from app.services.quote_history import backfill_history, load_history, history_to_json, HISTORY_YEARS
 from app.services.position_engine import (
-    compute_asset_position,
     compute_asset_position_by_ticker,
+    refresh_positions,
 )
 
 
@@ -71,6 +83,12 @@ app = FastAPI(title="Portfolio Manager")
 # 🔐 CORS CONFIG - Origens específicas via variável de ambiente
 # Use CORS_ORIGINS="http://localhost:5173,http://localhost:3000" para múltiplas origens
 allowed_origins = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
+
+# Atualização de cotações pelo calendário da B3 dentro da aplicação
+# (QUOTES_SCHEDULER_ENABLED=1); substitui o cron de update_quotes_cron.py.
+# Com vários workers, só o líder eleito no banco consulta o provedor
+QUOTES_SCHEDULER_ENABLED = os.getenv("QUOTES_SCHEDULER_ENABLED", "").lower() in ("1", "true", "yes")
+quote_scheduler: QuoteRefreshScheduler | None = None
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -132,12 +150,33 @@ class PositionAdjustment(BaseModel):
     event_date: date = Field(description="Data do evento corporativo")
     description: str = Field(min_length=1, description="Descrição do ajuste")
 
+class RatioCorporateEventCreate(BaseModel):
+    event_type: str = Field(
+        pattern="^(DESDOBRO|GRUPAMENTO|BONIFICACAO)$",
+        description="Tipo de evento"
+    )
+    ex_date: date = Field(description="Data ex do evento")
+    ratio_from: float = Field(gt=0, description="Quantidade antes (ex.: 1 em desdobro 1:10)")
+    ratio_to: float = Field(gt=0, description="Quantidade depois (ex.: 10 em desdobro 1:10)")
+    cost_basis: float = Field(default=0.0, ge=0, description="Custo atribuído por ação recebida (bonificação)")
+    notes: str | None = Field(default=None, description="Observações")
+
 @app.on_event("startup")
 def startup():
+    global quote_scheduler
     logger.info("🚀 Iniciando Portfolio Manager v2")
     init_db()
+    if QUOTES_SCHEDULER_ENABLED:
+        quote_scheduler = QuoteRefreshScheduler(get_market_data_service())
+        quote_scheduler.start()
     logger.info("✓ Aplicação pronta para receber requisições")
 
+
+@app.on_event("shutdown")
+def shutdown():
+    if quote_scheduler is not None:
+        quote_scheduler.stop()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -169,7 +208,8 @@ def get_dashboard():
 def update_quotes():
     """
     Atualiza cotações de todos os ativos com posição.
-    Busca do yfinance e salva no cache do banco de dados.
+    Busca no provedor em lote; o MarketDataService grava todas no banco
+    em uma única transação.
     """
     try:
         logger.info("🔄 Iniciando atualização de cotações")
@@ -182,27 +222,10 @@ def update_quotes():
         
         logger.info(f"📋 {len(tickers)} tickers para atualizar: {', '.join(tickers[:5])}{'...' if len(tickers) > 5 else ''}")
         
-        # Buscar cotações em lote do yfinance
+        # Buscar cotações em lote (já gravadas no banco pelo serviço)
         market_service = get_market_data_service()
-        quotes = market_service.get_batch_quotes(tickers)
-        
-        # Salvar no banco
-        updated_count = 0
-        for ticker, quote_data in quotes.items():
-            if quote_data:
-                if save_quote(
-                    ticker=ticker,
-                    price=quote_data.get("price"),
-                    change_value=quote_data.get("change_value"),
-                    change_percent=quote_data.get("change_percent"),
-                    volume=quote_data.get("volume"),
-                    open_price=quote_data.get("open_price"),
-                    high_price=quote_data.get("high_price"),
-                    low_price=quote_data.get("low_price"),
-                    previous_close=quote_data.get("previous_close"),
-                    source="yfinance"
-                ):
-                    updated_count += 1
+        quotes = market_service.get_batch_quotes(tickers, force_refresh=True)
+        updated_count = sum(1 for quote_data in quotes.values() if quote_data)
         
         logger.info(f"✅ {updated_count} cotações atualizadas com sucesso")
         
@@ -228,22 +251,6 @@ def list_quotes():
         logger.error(f"Erro ao listar cotações: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro ao listar cotações: {str(e)}")
 
-@app.get("/quotes/{ticker}")
-def get_quote_endpoint(ticker: str):
-    """
-    Busca cotação de um ticker específico do cache.
-    """
-    try:
-        quote = get_quote(ticker.upper())
-        if not quote:
-            raise HTTPException(status_code=404, detail=f"Cotação de {ticker} não encontrada")
-        return quote
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Erro ao buscar cotação de {ticker}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar cotação: {str(e)}")
-
 # ========== ENDPOINTS DE ATIVOS ==========
 
 @app.post("/assets")
@@ -365,6 +372,11 @@ async def import_b3(file: UploadFile = File(...)):
         if summary.get("events_detected", 0) > 0:
             logger.info(f"⚠️  {summary['events_detected']} eventos corporativos detectados")
         
+        summary["recomputed"] = _recompute_after_import(
+            summary["affected_asset_ids"],
+            summary["affected_since"]
+        )
+        
         return {
             "status": "success",
             "summary": summary
@@ -373,9 +385,66 @@ async def import_b3(file: UploadFile = File(...)):
         logger.error(f"Erro na importação: {str(e)}")
         raise
 
+def _recompute_after_import(asset_ids: list, since: str | None) -> dict:
+    """
+    Recalcula downstream apenas o que a importação afetou:
+    - posições e checkpoints do engine dos ativos tocados, a partir de `since`
+    - cotações dos ativos tocados que passaram a ter posição e ainda não têm cache
+    """
+    if not asset_ids:
+        return {"positions": 0, "quotes_scheduled": 0}
+    
+    positions = refresh_positions(asset_ids, since=since)
+    
+    held_ids = [a_id for a_id, pos in positions.items() if pos["quantity"] > 0]
+    tickers_held = [
+        asset["ticker"]
+        for asset in get_assets_by_ids(held_ids).values()
+        if asset["asset_class"] in QUOTED_ASSET_CLASSES
+    ]
+    
+    cached_quotes = get_quotes(tickers_held)
+    missing_quotes = [t for t in tickers_held if t not in cached_quotes]
+    if missing_quotes:
+        get_market_data_service().revalidate(missing_quotes)
+    
+    logger.info(f"Recálculo pós-importação: {len(positions)} posições desde {since}, {len(missing_quotes)} cotações agendadas")
+    return {"positions": len(positions), "since": since, "quotes_scheduled": len(missing_quotes)}
+
+@app.post("/import/b3/preview")
+async def import_b3_preview(
+    file: UploadFile = File(...),
+    page: int = 1,
+    page_size: int = 100,
+    status: str | None = None
+):
+    """
+    Pré-visualiza a importação de um arquivo B3 sem gravar no banco (dry-run).
+    
+    Classifica cada linha como nova, duplicada ou não-operação
+    (Atualização/Rendimento) e lista os ativos que seriam criados.
+    
+    - page/page_size: paginação do detalhamento por linha
+    - status: filtra o detalhamento (new, duplicate, non_operation)
+    """
+    logger.info(f"Recebida requisição de preview de importação: {file.filename}")
+    try:
+        preview = preview_b3_import(file, page=page, page_size=page_size, status=status)
+        return {
+            "status": "success",
+            "preview": preview
+        }
+    except ValueError as e:
+        logger.warning(f"Erro de validação no preview: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erro no preview de importação: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Modelo para aplicar eventos em lote
 class ApplyCorporateEventsRequest(BaseModel):
     events: list[dict] = Field(description="Lista de eventos corporativos a aplicar")
+    atomic: bool = Field(default=False, description="Se verdadeiro, qualquer erro cancela todos os ajustes")
 
 @app.post("/admin/apply-corporate-events")
 async def apply_corporate_events(request: ApplyCorporateEventsRequest):
@@ -388,88 +457,34 @@ async def apply_corporate_events(request: ApplyCorporateEventsRequest):
     - quantity: Quantidade ajustada
     - date: Data do evento
     - description: Descrição
-    """
-    logger.info(f"Aplicando {len(request.events)} eventos corporativos em lote")
-    
-    applied = 0
-    errors = []
-    results = []
-    
-    for event in request.events:
-        try:
-            # Pular eventos marcados para skip (leilões de fração)
-            if event.get("skip"):
-                logger.debug(f"Pulando evento: {event.get('description')}")
-                continue
-            
-            # Buscar asset_id pelo ticker
-            ticker = event.get("ticker")
-            with get_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id FROM assets WHERE ticker = ?", (ticker,))
-                result = cursor.fetchone()
-                
-                if not result:
-                    errors.append(f"Ativo {ticker} não encontrado")
-                    continue
-                
-                asset_id = result[0]
-            
-            # Preparar dados do ajuste
-            adjustment = {
-                "asset_id": asset_id,
-                "movement_type": "COMPRA" if event["quantity"] > 0 else "VENDA",
-                "operation_subtype": event["type"],
-                "quantity": abs(event["quantity"]),
-                "price": 0.0,
-                "value": 0.0,
-                "trade_date": event["date"],
-                "source": "AJUSTE_LOTE",
-                "notes": event["description"],
-                "market": None,
-                "institution": None
-            }
-            
-            # Criar operação
-            create_operation(adjustment)
-            applied += 1
-            
-            results.append({
-                "ticker": ticker,
-                "type": event["type"],
-                "quantity": event["quantity"],
-                "status": "success"
-            })
-            
-            logger.debug(f"Evento aplicado: {ticker} - {event['type']} - {event['quantity']}")
-            
-        except Exception as e:
-            error_msg = f"{event.get('ticker')}: {str(e)}"
-            errors.append(error_msg)
-            logger.error(f"Erro ao aplicar evento: {error_msg}")
-            results.append({
-                "ticker": event.get("ticker"),
-                "type": event.get("type"),
-                "status": "error",
-                "error": str(e)
-            })
     
-    logger.info(f"Eventos aplicados: {applied}/{len(request.events)} - {len(errors)} erros")
+    Todos os eventos são validados antes da gravação e os ajustes são
+    inseridos em uma única transação. Com atomic=true, qualquer erro cancela
+    o lote inteiro; senão, eventos com erro são reportados individualmente.
+    Eventos já aplicados saem como "already_applied" (não duplicam o ajuste).
+    """
+    return apply_corporate_events_bulk(request.events, atomic=request.atomic)
+
+@app.get("/admin/corporate-events/suggestions")
+def get_corporate_event_suggestions():
+    """
+    Sugere desdobros/grupamentos não registrados a partir de saltos de preço.
     
-    return {
-        "status": "success" if applied > 0 else "error",
-        "applied": applied,
-        "total": len(request.events),
-        "errors": errors,
-        "results": results
-    }
+    Os eventos retornados podem ser enviados (após revisão) para
+    /admin/apply-corporate-events.
+    """
+    try:
+        return suggest_corporate_events()
+    except Exception as e:
+        logger.error(f"Erro ao detectar eventos corporativos: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ========== ENDPOINTS DE RECONCILIAÇÃO ==========
 
 @app.post("/admin/import-position")
 async def import_position(file: UploadFile = File(...)):
     """
-    Importa arquivo de posição B3 (posicao-*.xlsx) como fonte de verdade.
+    Importa arquivo de posição B3 (posicao-*.xlsx, .csv ou .parquet) como fonte de verdade.
     Cria snapshots das posições e identifica discrepâncias com o calculado.
     """
     logger.info(f"Importando posição B3: {file.filename}")
@@ -485,18 +500,20 @@ async def import_position(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/admin/reconciliation/diagnosis")
-async def reconciliation_diagnosis():
+async def reconciliation_diagnosis(history: bool = False):
     """
     Retorna diagnóstico completo da reconciliação:
     - Posições conforme snapshots (fonte de verdade B3)
-    - Posições calculadas do sistema
+    - Posições calculadas do sistema na data de cada snapshot
     - Discrepâncias encontradas
     - Análise de causas
     - Sugestões de correção
+    
+    - history=true: reconcilia todos os snapshots históricos, não só o último
     """
     logger.info("Gerando diagnóstico de reconciliação")
     try:
-        diagnosis = get_reconciliation_diagnosis()
+        diagnosis = get_reconciliation_diagnosis(history=history)
         issues_count = len(diagnosis.get('issues', []))
         logger.info(f"Diagnóstico gerado: {issues_count} discrepâncias")
         return {
@@ -507,19 +524,44 @@ async def reconciliation_diagnosis():
         logger.error(f"Erro ao gerar diagnóstico: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/admin/reconciliation/snapshots/retention")
+async def reconciliation_snapshot_retention(keep_days: int = SNAPSHOT_RETENTION_DAYS):
+    """
+    Reduz lotes de snapshot com mais de `keep_days` dias a um lote por mês.
+    
+    Executado automaticamente a cada importação de posição; este endpoint
+    permite aplicar com outro prazo.
+    """
+    logger.info(f"Aplicando retenção de snapshots ({keep_days} dias)")
+    try:
+        result = apply_snapshot_retention(keep_days)
+        return {
+            "status": "success",
+            "result": result
+        }
+    except Exception as e:
+        logger.error(f"Erro ao aplicar retenção de snapshots: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/admin/reconciliation/auto-fix")
-async def reconciliation_auto_fix(ticker: str | None = None):
+async def reconciliation_auto_fix(
+    ticker: str | None = None,
+    dry_run: bool = False,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key")
+):
     """
     Aplica correções automáticas criando operações de ajuste.
     
     - Se ticker=None: corrige todos os ativos com discrepância
     - Se ticker informado: corrige apenas aquele ativo
+    - dry_run=true: apenas retorna os ajustes que seriam criados
+    - Header Idempotency-Key: repetições com a mesma chave não criam novos ajustes
     
     Cria operações do tipo AJUSTE_RECONCILIACAO para zerar diferenças.
     """
     logger.info(f"Aplicando correções automáticas{' para ' + ticker if ticker else ' para todos os ativos'}")
     try:
-        result = auto_fix_positions(ticker)
+        result = auto_fix_positions(ticker, dry_run=dry_run, idempotency_key=idempotency_key)
         fixed_count = result.get('fixed_count', 0)
         logger.info(f"Correções aplicadas: {fixed_count} ajustes")
         return {
@@ -549,21 +591,22 @@ async def recalculate_all_positions():
     """
     Recalcula posição de todos os ativos ativos usando o engine.
     Útil para validação pós-import.
+    
+    Faz replay completo e reconstrói o cache de posições e checkpoints
+    (após importações, o recálculo incremental já é feito automaticamente).
     """
     summary = []
     try:
         assets = list_assets()
+        positions = refresh_positions([a["id"] for a in assets], full=True)
         for a in assets:
-            try:
-                pos = compute_asset_position(a["id"])
-                summary.append({
-                    "ticker": a["ticker"],
-                    "quantity": pos["quantity"],
-                    "avg_price": pos["average_price"],
-                    "invested_value": pos["invested_value"],
-                })
-            except Exception as e:
-                logger.warning(f"Falha ao calcular {a['ticker']}: {e}")
+            pos = positions[a["id"]]
+            summary.append({
+                "ticker": a["ticker"],
+                "quantity": pos["quantity"],
+                "avg_price": pos["average_price"],
+                "invested_value": pos["invested_value"],
+            })
         return {"status": "success", "count": len(summary), "positions": summary}
     except Exception as e:
         logger.error(f"Erro ao recalcular posições: {e}")
@@ -741,6 +784,39 @@ def adjust_position(adjustment: PositionAdjustment):
         logger.error(f"Erro ao registrar ajuste de posição: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro ao registrar ajuste: {str(e)}")
 
+@app.get("/assets/{ticker}/corporate-events")
+def get_corporate_events(ticker: str):
+    """Lista os eventos por razão do ativo (com fator cumulativo)."""
+    try:
+        return list_ratio_events(ticker.upper())
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/assets/{ticker}/corporate-events")
+def create_corporate_event(ticker: str, event: RatioCorporateEventCreate):
+    """
+    Registra desdobro (1:N), grupamento (N:1) ou bonificação por razão.
+    
+    O engine aplica o evento via fator cumulativo, sem criar operações
+    sintéticas; a posição do ativo é recalculada na mesma transação.
+    """
+    logger.info(f"Recebida requisição de evento por razão: {ticker} {event.event_type} {event.ratio_from}:{event.ratio_to}")
+    try:
+        data = event.model_dump()
+        data["ex_date"] = event.ex_date.isoformat()
+        return register_ratio_event(ticker.upper(), data)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        logger.warning(f"Erro de validação ao registrar evento: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/corporate-events/{event_id}")
+def remove_corporate_event(event_id: int):
+    if not delete_ratio_event(event_id):
+        raise HTTPException(status_code=404, detail=f"Evento {event_id} não encontrado")
+    return {"status": "success", "message": "Evento removido"}
+
 # ========== ENDPOINTS DE RENDA FIXA ==========
 
 @app.post("/fixed-income/assets")
@@ -889,12 +965,17 @@ def get_fixed_income_projection_endpoint(
 # ==========================================
 
 @app.get("/quotes/{ticker}")
-def get_quote_endpoint(ticker: str):
+def get_quote_endpoint(ticker: str, fetch: bool = False):
     """
     Busca cotação de um ativo específico.
     
+    Serve a cotação do cache (memória ou banco) mesmo vencida, com
+    `stale`/`age_seconds`, e agenda revalidação em background. Só consulta
+    o provedor na requisição com fetch=true e se não houver cotação alguma.
+    
     Args:
         ticker: Código do ativo (ex: PETR4, VALE3)
+        fetch: Permite buscar no provedor durante a requisição
     
     Returns:
         Dados da cotação ou 404 se não encontrado
@@ -915,7 +996,7 @@ def get_quote_endpoint(ticker: str):
     
     try:
         market_service = get_market_data_service()
-        quote = market_service.get_quote(ticker)
+        quote = market_service.read_quote(ticker, allow_fetch=fetch)
         
         if quote is None:
             raise HTTPException(
@@ -933,12 +1014,17 @@ def get_quote_endpoint(ticker: str):
 
 
 @app.post("/quotes/batch")
-def get_batch_quotes_endpoint(tickers: list[str]):
+def get_batch_quotes_endpoint(tickers: list[str], fetch: bool = False):
     """
     Busca cotações de múltiplos ativos de uma vez.
     
+    Mesma semântica de GET /quotes/{ticker}: cache (mesmo vencido, com
+    `stale`/`age_seconds`) e revalidação em background; o provedor só é
+    consultado na requisição com fetch=true.
+    
     Args:
         tickers: Lista de códigos de ativos
+        fetch: Permite buscar no provedor durante a requisição
     
     Returns:
         Dicionário com ticker -> dados da cotação
@@ -963,7 +1049,7 @@ def get_batch_quotes_endpoint(tickers: list[str]):
     
     try:
         market_service = get_market_data_service()
-        quotes = market_service.get_batch_quotes(tickers)
+        quotes = market_service.read_quotes(tickers, allow_fetch=fetch)
         return quotes
         
     except Exception as e:
@@ -971,83 +1057,109 @@ def get_batch_quotes_endpoint(tickers: list[str]):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/quotes/history")
+def get_quote_history_endpoint(
+    tickers: list[str], start: date | None = None, end: date | None = None, adjusted: bool = True
+):
+    """
+    Histórico diário gravado (quote_history) de vários ativos, em colunas.
+    
+    Preços ajustados pelos eventos corporativos registrados (unidade atual
+    do ativo); adjusted=false devolve os preços como negociados.
+    
+    Returns:
+        ticker -> {"dates": [...], "open": [...], "high": [...], "low": [...],
+        "close": [...], "volume": [...]}; tickers sem histórico ficam de fora
+        
+    Exemplo:
+        POST /quotes/history?start=2025-01-01
+        Body: ["PETR4", "VALE3"]
+    """
+    if not tickers:
+        raise HTTPException(status_code=400, detail="Lista de tickers não pode estar vazia")
+    
+    history = load_history(
+        [ticker.upper().strip() for ticker in tickers],
+        start.isoformat() if start else None,
+        end.isoformat() if end else None,
+        adjusted
+    )
+    return history_to_json(history)
+
+
+@app.get("/quotes/{ticker}/history")
+def get_ticker_history_endpoint(
+    ticker: str, start: date | None = None, end: date | None = None, adjusted: bool = True
+):
+    """Histórico diário gravado de um ativo, em colunas (ver POST /quotes/history)."""
+    ticker = ticker.upper().strip()
+    history = history_to_json(load_history(
+        [ticker],
+        start.isoformat() if start else None,
+        end.isoformat() if end else None,
+        adjusted
+    ))
+    if ticker not in history:
+        raise HTTPException(status_code=404, detail=f"Sem histórico de cotações para {ticker}")
+    return history[ticker]
+
+
+@app.post("/admin/quotes/history/backfill")
+def backfill_quote_history_endpoint(years: int = HISTORY_YEARS, tickers: list[str] | None = None):
+    """
+    Carrega o histórico diário dos ativos com posição (ou dos tickers informados).
+    
+    Incremental: cada ticker é buscado a partir do último pregão gravado;
+    a primeira carga cobre `years` anos.
+    
+    Returns:
+        tickers, batches, rows (pregões gravados) e missing (sem dados no provedor)
+    """
+    try:
+        return backfill_history(
+            [ticker.upper().strip() for ticker in tickers] if tickers else None,
+            years=years
+        )
+    except Exception as e:
+        logger.error(f"Erro na carga do histórico de cotações: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/quotes/portfolio/current")
 def get_portfolio_quotes_endpoint():
     """
     Busca cotações de todos os ativos com posição atual no portfólio.
     
-    IMPORTANTE: Usa cache de cotações quando disponível (atualizado a cada 15 min via cron).
-    Busca cotação em tempo real via yfinance apenas se não houver cache.
+    Serve o cache (memória ou banco) mesmo vencido, com `stale`/`age_seconds`;
+    cotações vencidas ou ausentes são atualizadas em background, sem chamada
+    ao provedor durante a requisição.
     
     Returns:
-        Dicionário com ticker -> cotação para todos os ativos em carteira
+        Dicionário com ticker -> cotação para os ativos em carteira com cotação
     """
     logger.debug("Recebida requisição de cotações do portfólio")
     
     try:
-        # Buscar todos os ativos com posição
-        assets = list_assets()
-        
-        # Filtrar apenas ativos com posição atual > 0
-        tickers_with_position = []
-        for asset in assets:
-            if asset.get('current_position', 0) > 0:
-                tickers_with_position.append(asset['ticker'])
-        
+        tickers_with_position = _tickers_with_position()
         if not tickers_with_position:
             return {}
         
-        # Buscar cotações usando o sistema de cache
-        market_service = get_market_data_service()
-        quotes_result = {}
-        
-        for ticker in tickers_with_position:
-            # 1. Tentar cache primeiro
-            cached_quote = get_quote(ticker)
-            
-            if cached_quote:
-                logger.debug(f"📦 {ticker}: usando cotação do cache")
-                quotes_result[ticker] = {
-                    "price": cached_quote["price"],
-                    "change_percent": cached_quote.get("change_percent"),
-                    "change_value": cached_quote.get("change_value"),
-                    "volume": cached_quote.get("volume"),
-                    "source": "cache"
-                }
-            else:
-                # 2. Se não houver cache, buscar via yfinance
-                logger.debug(f"🌐 {ticker}: buscando cotação via yfinance")
-                try:
-                    quote = market_service.get_quote(ticker)
-                    if quote and quote.get("price"):
-                        quotes_result[ticker] = quote
-                        
-                        # Salvar no cache para próximas requisições
-                        save_quote(
-                            ticker=ticker,
-                            price=quote["price"],
-                            change_value=quote.get("change_value"),
-                            change_percent=quote.get("change_percent"),
-                            volume=quote.get("volume"),
-                            open_price=quote.get("open_price"),
-                            high_price=quote.get("high_price"),
-                            low_price=quote.get("low_price"),
-                            previous_close=quote.get("previous_close"),
-                            source="yfinance"
-                        )
-                        logger.debug(f"💾 {ticker}: cotação salva no cache")
-                except Exception as e:
-                    logger.error(f"Erro ao buscar cotação de {ticker}: {str(e)}")
-                    # Continuar com próximo ticker em caso de erro
-                    continue
-        
-        return quotes_result
+        quotes = get_market_data_service().read_quotes(tickers_with_position)
+        return {ticker: quote for ticker, quote in quotes.items() if quote}
         
     except Exception as e:
         logger.error(f"Erro ao buscar cotações do portfólio: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _tickers_with_position() -> list:
+    """Tickers dos ativos negociados em bolsa com posição atual > 0."""
+    return [
+        asset['ticker'] for asset in list_assets()
+        if asset.get('current_position', 0) > 0 and asset.get('asset_class') in QUOTED_ASSET_CLASSES
+    ]
+
+
 @app.delete("/quotes/cache/{ticker}")
 def clear_quote_cache_endpoint(ticker: str):
     """
@@ -1091,17 +1203,50 @@ def clear_all_quotes_cache_endpoint():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/quotes/cache/stats")
+def get_quotes_cache_stats_endpoint():
+    """
+    Contadores do cache de cotações em memória.
+    
+    Returns:
+        hits, misses, evictions, expirations, coalesced (buscas que
+        aguardaram outra já em andamento), size, maxsize, shared_version,
+        negative (tickers sem cotação em espera) e breaker (estado do
+        circuit breaker do provedor: closed/open/half_open)
+    """
+    return get_market_data_service().cache_stats()
+
+
+@app.get("/quotes/scheduler/status")
+def get_quotes_scheduler_status_endpoint():
+    """
+    Estado do agendador de cotações.
+    
+    Returns:
+        enabled, market_open, liderança entre workers (is_leader/leader),
+        próxima execução (next_run_at/next_mode), behind_seconds e a última
+        execução deste worker (lag_seconds, duração, atualizadas/falhas)
+    """
+    if quote_scheduler is None:
+        market_service = get_market_data_service()
+        return {
+            "enabled": False,
+            "market_open": market_service.calendar.is_open()
+        }
+    return {"enabled": True, **quote_scheduler.status()}
+
+
 @app.get("/quotes/portfolio/fast")
-def get_portfolio_quotes_fast(background_tasks: BackgroundTasks, refresh: bool = False):
+def get_portfolio_quotes_fast(refresh: bool = False):
     """
     Busca cotações do portfólio de forma otimizada.
     
     Estratégia:
-    1. Retorna imediatamente cotações do cache persistente (banco de dados)
-    2. Se refresh=true, dispara atualização em background para próximas consultas
+    1. Retorna imediatamente cotações do cache (memória ou banco), com `stale`/`age_seconds`
+    2. Cotações vencidas ou ausentes são revalidadas em background (uma vez por ticker)
     
     Args:
-        refresh: Se True, atualiza cotações em background após retornar cache
+        refresh: Se True, revalida em background todas as cotações do portfólio
     
     Returns:
         Dicionário com ticker -> cotação do cache
@@ -1109,73 +1254,17 @@ def get_portfolio_quotes_fast(background_tasks: BackgroundTasks, refresh: bool =
     logger.debug(f"Requisição rápida de cotações (refresh={refresh})")
     
     try:
-        # Buscar todos os ativos com posição
-        assets = list_assets()
-        
-        # Filtrar apenas ativos com posição atual > 0
-        tickers_with_position = []
-        for asset in assets:
-            if asset.get('current_position', 0) > 0:
-                tickers_with_position.append(asset['ticker'])
-        
+        tickers_with_position = _tickers_with_position()
         if not tickers_with_position:
             return {}
         
-        # Buscar cotações do cache (banco de dados) - RÁPIDO
-        quotes_result = {}
-        tickers_to_refresh = []
-        
-        for ticker in tickers_with_position:
-            cached_quote = get_quote(ticker)
-            
-            if cached_quote:
-                quotes_result[ticker] = cached_quote
-            else:
-                # Sem cache, adicionar na lista para refresh
-                tickers_to_refresh.append(ticker)
-        
-        # Se refresh=True ou existem tickers sem cache, atualizar em background
-        if refresh or tickers_to_refresh:
-            background_tasks.add_task(
-                _update_quotes_background,
-                tickers_with_position
-            )
-            logger.debug(f"🔄 Atualização em background agendada para {len(tickers_with_position)} tickers")
+        market_service = get_market_data_service()
+        quotes = market_service.read_quotes(tickers_with_position)
+        if refresh:
+            market_service.revalidate(tickers_with_position)
         
-        return quotes_result
+        return {ticker: quote for ticker, quote in quotes.items() if quote}
         
     except Exception as e:
         logger.error(f"Erro ao buscar cotações rápidas: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-
-
-def _update_quotes_background(tickers: list):
-    """
-    Atualiza cotações em background.
-    Executado de forma assíncrona após retornar resposta ao cliente.
-    """
-    logger.info(f"🔄 Iniciando atualização em background de {len(tickers)} cotações")
-    
-    try:
-        market_service = get_market_data_service()
-        updated_count = 0
-        
-        for ticker in tickers:
-            try:
-                # Buscar cotação do yfinance (com force_refresh)
-                quote = market_service.get_quote(ticker, force_refresh=True)
-                
-                if quote and quote.get("price"):
-                    # Salvar no banco
-                    save_quote(ticker, quote)
-                    updated_count += 1
-                    logger.debug(f"✅ {ticker}: cotação atualizada")
-                    
-            except Exception as e:
-                logger.error(f"❌ {ticker}: erro ao atualizar - {str(e)}")
-                continue
-        
-        logger.info(f"✅ Atualização concluída: {updated_count}/{len(tickers)} cotações atualizadas")
-        
-    except Exception as e:
-        logger.error(f"Erro na atualização em background: {str(e)}")
\ No newline at end of file
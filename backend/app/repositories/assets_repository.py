@@ -1,6 +1,7 @@
 import logging
 from datetime import datetime
-from app.db.database import get_db
+from app.db.database import get_db, chunked
+from app.services.position_engine import get_positions
 
 logger = logging.getLogger(__name__)
 
@@ -119,6 +120,42 @@ def get_asset_by_id(asset_id: int) -> dict | None:
         return None
 
 
+def get_assets_by_ids(asset_ids: list[int]) -> dict[int, dict]:
+    """
+    Busca vários ativos pelo ID em uma consulta por bloco.
+    
+    Args:
+        asset_ids: IDs dos ativos
+        
+    Returns:
+        Dicionário asset_id -> dados do ativo (apenas ativos ACTIVE)
+    """
+    assets = {}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        for chunk in chunked(sorted(set(asset_ids))):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(
+                f"""
+                SELECT id, ticker, asset_class, asset_type, product_name, created_at, status
+                FROM assets
+                WHERE id IN ({placeholders}) AND status = 'ACTIVE'
+                """,
+                chunk
+            )
+            for row in cursor.fetchall():
+                assets[row[0]] = {
+                    "id": row[0],
+                    "ticker": row[1],
+                    "asset_class": row[2],
+                    "asset_type": row[3],
+                    "product_name": row[4],
+                    "created_at": row[5],
+                    "status": row[6]
+                }
+    return assets
+
+
 def get_asset_with_stats(asset_id: int) -> dict | None:
     """
     Busca um ativo pelo ID com estatísticas calculadas de operações.
@@ -132,7 +169,8 @@ def get_asset_with_stats(asset_id: int) -> dict | None:
         - total_invested: valor total gasto em compras
         - total_bought: quantidade total comprada
         - total_sold: quantidade total vendida
-        - current_position: posição atual (bought - sold)
+        - current_position: posição atual do engine (unidade atual do ativo,
+          com eventos corporativos)
         - total_bought_value: valor total de compras
         - total_sold_value: valor total de vendas
         - total_operations: número total de operações
@@ -168,6 +206,7 @@ def get_asset_with_stats(asset_id: int) -> dict | None:
         if not row:
             return None
         
+        position = get_positions([asset_id])[asset_id]
         total_bought_qty = row[8] or 0
         total_bought_value = row[11] or 0.0
         
@@ -187,7 +226,7 @@ def get_asset_with_stats(asset_id: int) -> dict | None:
             "total_operations": row[7] or 0,
             "total_bought": total_bought_qty,
             "total_sold": row[9] or 0,
-            "current_position": row[10] or 0,
+            "current_position": position["quantity"],
             "total_bought_value": total_bought_value,
             "total_sold_value": row[12] or 0.0,
             "average_price": average_price,
@@ -206,7 +245,8 @@ def list_assets() -> list[dict]:
         Lista de dicionários com dados dos ativos incluindo:
         - total_bought: soma das quantidades compradas (TODOS os mercados)
         - total_sold: soma das quantidades vendidas (TODOS os mercados)
-        - current_position: diferença (comprado - vendido) CONSOLIDADA
+        - current_position: posição CONSOLIDADA do engine (unidade atual do
+          ativo, com eventos corporativos)
         - total_bought_value: valor total gasto em compras (R$) CONSOLIDADO
         - total_sold_value: valor total recebido em vendas (R$) CONSOLIDADO
     """
@@ -237,6 +277,7 @@ def list_assets() -> list[dict]:
             """
         )
         rows = cursor.fetchall()
+        positions = get_positions([row[0] for row in rows])
         
         return [
             {
@@ -250,7 +291,7 @@ def list_assets() -> list[dict]:
                 "total_operations": row[7] or 0,
                 "total_bought": row[8] or 0,
                 "total_sold": row[9] or 0,
-                "current_position": row[10] or 0,
+                "current_position": positions[row[0]]["quantity"],
                 "total_bought_value": row[11] or 0.0,
                 "total_sold_value": row[12] or 0.0
             }
@@ -0,0 +1,169 @@
+"""
+Repositório de eventos corporativos por razão (desdobro, grupamento, bonificação).
+
+Cada evento guarda a razão `ratio_from:ratio_to` (ex.: desdobro 1:10,
+grupamento 10:1, bonificação de 10% = 10:11) e o fator cumulativo do ativo
+até a sua ex_date. Com os fatores cumulativos, a quantidade/preço ajustados
+de qualquer data saem de uma busca binária (ver AdjustmentFactors), sem
+replay de linhas sintéticas em operations.
+
+Todas as funções recebem um cursor para participar da transação do chamador.
+"""
+
+import logging
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from app.db.database import chunked
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("DESDOBRO", "GRUPAMENTO", "BONIFICACAO")
+
+
+class AdjustmentFactors(NamedTuple):
+    """
+    Fatores cumulativos de um ativo, ordenados por ex_date.
+
+    `cumulative[i]` é o produto dos fatores dos eventos com ex_date <= dates[i].
+    Quantidades "ajustadas" estão na unidade atual do ativo (após todos os
+    eventos); preços ajustados são divididos pelo mesmo multiplicador.
+    """
+    dates: List[str]
+    cumulative: List[float]
+    # (ex_date, fator, custo atribuído por ação nova) de cada evento
+    events: List[Tuple[str, float, float]]
+
+    @property
+    def total(self) -> float:
+        return self.cumulative[-1] if self.cumulative else 1.0
+
+    def factor_at(self, date: str) -> float:
+        """Fator cumulativo dos eventos com ex_date <= date."""
+        index = bisect_right(self.dates, date)
+        return self.cumulative[index - 1] if index else 1.0
+
+    def multiplier(self, date: str) -> float:
+        """Converte quantidade na data `date` para a unidade atual."""
+        return self.total / self.factor_at(date)
+
+    def adjust_price(self, date: str, price: float) -> float:
+        """Preço em `date` expresso na unidade atual do ativo."""
+        return price / self.multiplier(date)
+
+
+NO_ADJUSTMENT = AdjustmentFactors([], [], [])
+
+
+def event_factor(ratio_from: float, ratio_to: float) -> float:
+    return ratio_to / ratio_from
+
+
+def get_adjustment_factors(cursor, asset_ids: Iterable[int]) -> Dict[int, AdjustmentFactors]:
+    """
+    Carrega os fatores cumulativos dos ativos informados (uma consulta por bloco).
+
+    Returns:
+        Dicionário asset_id -> AdjustmentFactors (só ativos com eventos)
+    """
+    factors = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, ex_date, ratio_from, ratio_to, cost_basis, cumulative_factor
+            FROM corporate_events
+            WHERE asset_id IN ({placeholders})
+            ORDER BY asset_id, ex_date, id
+        """, chunk)
+        for asset_id, ex_date, ratio_from, ratio_to, cost_basis, cumulative in cursor.fetchall():
+            entry = factors.setdefault(asset_id, AdjustmentFactors([], [], []))
+            factor = event_factor(ratio_from, ratio_to)
+            # Vários eventos na mesma data: mantém só o último cumulativo da data
+            if entry.dates and entry.dates[-1] == ex_date:
+                entry.cumulative[-1] = cumulative
+            else:
+                entry.dates.append(ex_date)
+                entry.cumulative.append(cumulative)
+            entry.events.append((ex_date, factor, cost_basis or 0.0))
+    return factors
+
+
+def _recompute_cumulative(cursor, asset_id: int) -> None:
+    """Recalcula cumulative_factor dos eventos do ativo em ordem de ex_date."""
+    cursor.execute("""
+        SELECT id, ratio_from, ratio_to FROM corporate_events
+        WHERE asset_id = ? ORDER BY ex_date, id
+    """, (asset_id,))
+    cumulative = 1.0
+    updates = []
+    for event_id, ratio_from, ratio_to in cursor.fetchall():
+        cumulative *= event_factor(ratio_from, ratio_to)
+        updates.append((cumulative, event_id))
+    cursor.executemany("UPDATE corporate_events SET cumulative_factor = ? WHERE id = ?", updates)
+
+
+def create_event(cursor, data: dict) -> int:
+    """
+    Registra um evento por razão e atualiza os fatores cumulativos do ativo.
+
+    Args:
+        data: asset_id, event_type, ex_date, ratio_from, ratio_to,
+              cost_basis (opcional), notes (opcional)
+    """
+    cursor.execute("""
+        INSERT INTO corporate_events (
+            asset_id, event_type, ex_date, ratio_from, ratio_to, cost_basis, notes, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        data["asset_id"],
+        data["event_type"],
+        data["ex_date"],
+        data["ratio_from"],
+        data["ratio_to"],
+        data.get("cost_basis") or 0.0,
+        data.get("notes"),
+        datetime.utcnow().isoformat(),
+    ))
+    event_id = cursor.lastrowid
+    _recompute_cumulative(cursor, data["asset_id"])
+    logger.info(
+        f"Evento corporativo registrado: ativo {data['asset_id']} {data['event_type']} "
+        f"{data['ratio_from']}:{data['ratio_to']} em {data['ex_date']}"
+    )
+    return event_id
+
+
+def delete_event(cursor, event_id: int) -> bool:
+    """Remove um evento e atualiza os fatores do ativo. Retorna False se não existir."""
+    cursor.execute("SELECT asset_id FROM corporate_events WHERE id = ?", (event_id,))
+    row = cursor.fetchone()
+    if not row:
+        return False
+    cursor.execute("DELETE FROM corporate_events WHERE id = ?", (event_id,))
+    _recompute_cumulative(cursor, row[0])
+    return True
+
+
+def list_events(cursor, asset_id: int) -> List[Dict]:
+    cursor.execute("""
+        SELECT id, event_type, ex_date, ratio_from, ratio_to, cost_basis,
+               cumulative_factor, notes, created_at
+        FROM corporate_events
+        WHERE asset_id = ?
+        ORDER BY ex_date, id
+    """, (asset_id,))
+    return [
+        {
+            "id": row[0],
+            "event_type": row[1],
+            "ex_date": row[2],
+            "ratio_from": row[3],
+            "ratio_to": row[4],
+            "cost_basis": row[5],
+            "cumulative_factor": row[6],
+            "notes": row[7],
+            "created_at": row[8],
+        }
+        for row in cursor.fetchall()
+    ]
@@ -1,10 +1,10 @@
 import logging
 from app.db.database import get_db
-from app.services.market_data_service import MarketDataService
-from app.repositories import quotes_repository
+from app.repositories.quotes_repository import QUOTED_ASSET_CLASSES
+from app.services.market_data_service import get_market_data_service
+from app.services.position_engine import get_positions
 
 logger = logging.getLogger(__name__)
-market_service = MarketDataService()
 
 
 def get_dashboard_summary() -> dict:
@@ -42,25 +42,22 @@ def get_dashboard_summary() -> dict:
         total_sold_value = row[2] if row else 0
         total_invested = total_bought_value - total_sold_value
 
-        # 2. Top posições via engine
+        # 2. Posições via engine (cache de posições; quantidades na unidade
+        # atual do ativo, já com desdobros/grupamentos de corporate_events)
         cursor.execute("""
             SELECT a.id, a.ticker, a.asset_class, a.product_name
             FROM assets a
             WHERE a.status = 'ACTIVE'
         """)
         assets = cursor.fetchall()
+        positions = get_positions([row[0] for row in assets])
 
-        from app.services.position_engine import compute_asset_position
-        top_positions = []
-        for row in assets:
-            a_id, a_ticker, a_class, a_name = row
-            try:
-                pos = compute_asset_position(a_id)
-            except Exception:
+        held_positions = []
+        for a_id, a_ticker, a_class, a_name in assets:
+            pos = positions.get(a_id)
+            if not pos or pos["quantity"] <= 0:
                 continue
-            if pos["quantity"] <= 0:
-                continue
-            top_positions.append({
+            held_positions.append({
                 "id": a_id,
                 "ticker": a_ticker,
                 "asset_class": a_class,
@@ -70,8 +67,7 @@ def get_dashboard_summary() -> dict:
                 "average_price": pos["average_price"],
             })
         # ordenar por investido
-        top_positions.sort(key=lambda x: x["invested_value"], reverse=True)
-        top_positions = top_positions[:5]
+        top_positions = sorted(held_positions, key=lambda x: x["invested_value"], reverse=True)[:5]
         
         # 3. Operações recentes (últimas 10)
         cursor.execute("""
@@ -141,61 +137,42 @@ def get_dashboard_summary() -> dict:
         
         # 5. Calcular valor atual da carteira com cotações
         current_value = 0
-        tickers_with_positions = []
         
         logger.info("💰 Calculando valor atual da carteira...")
         
-        # Buscar TODOS os ativos com posição (Ações, ETFs, FIIs, etc)
-        cursor.execute("""
-            SELECT 
-                a.ticker,
-                a.asset_class,
-                COALESCE(SUM(CASE WHEN UPPER(o.movement_type) = 'COMPRA' THEN o.quantity ELSE 0 END), 0) as total_bought,
-                COALESCE(SUM(CASE WHEN UPPER(o.movement_type) = 'VENDA' THEN o.quantity ELSE 0 END), 0) as total_sold,
-                COALESCE(SUM(CASE WHEN UPPER(o.movement_type) = 'COMPRA' THEN o.value ELSE 0 END), 0) as bought_value,
-                COALESCE(SUM(CASE WHEN UPPER(o.movement_type) = 'VENDA' THEN o.value ELSE 0 END), 0) as sold_value
-            FROM assets a
-            LEFT JOIN operations o ON a.id = o.asset_id AND o.status = 'ACTIVE'
-            WHERE a.status = 'ACTIVE'
-            GROUP BY a.ticker, a.asset_class
-            HAVING (total_bought - total_sold) > 0
-        """)
-        
-        for row in cursor.fetchall():
-            ticker = row[0]
-            asset_class = row[1]
-            current_position = row[2] - row[3]
-            invested_value = row[4] - row[5]
-            tickers_with_positions.append((ticker, asset_class, current_position, invested_value))
+        # TODOS os ativos com posição (Ações, ETFs, FIIs, etc), com a
+        # quantidade do engine: a cotação atual vale para a unidade atual
+        tickers_with_positions = [
+            (pos["ticker"], pos["asset_class"], pos["quantity"], pos["invested_value"])
+            for pos in held_positions
+        ]
         
         logger.info(f"📈 Encontrados {len(tickers_with_positions)} ativos com posição")
         
-        # Buscar cotações (primeiro do cache, depois do yfinance)
+        # Buscar cotações (memória/banco, mesmo vencidas; vencidas são
+        # revalidadas em background, sem chamada ao provedor aqui). Ativos
+        # fora de bolsa (renda fixa) não têm cotação: valem o investido.
+        stale_quotes = 0
         if tickers_with_positions:
+            quotes = get_market_data_service().read_quotes([
+                ticker for ticker, asset_class, _, _ in tickers_with_positions
+                if asset_class in QUOTED_ASSET_CLASSES
+            ])
             for ticker, asset_class, position, invested in tickers_with_positions:
-                # Tentar buscar do cache primeiro
-                quote = quotes_repository.get_quote(ticker)
+                quote = quotes.get(ticker)
                 
                 if quote and quote.get('price'):
-                    # Usar cotação do cache
                     market_value = position * quote['price']
                     current_value += market_value
-                    logger.info(f"  📊 {ticker}: {position} x R$ {quote['price']:.2f} = R$ {market_value:.2f} (cache)")
+                    stale = " (vencida)" if quote.get('stale') else ""
+                    stale_quotes += 1 if quote.get('stale') else 0
+                    logger.info(f"  📊 {ticker}: {position} x R$ {quote['price']:.2f} = R$ {market_value:.2f}{stale}")
+                elif asset_class not in QUOTED_ASSET_CLASSES:
+                    current_value += invested
                 else:
-                    # Fallback: buscar do yfinance
-                    logger.info(f"  🔍 Buscando cotação de {ticker} no yfinance...")
-                    quote = market_service.get_quote(ticker)
-                    
-                    if quote and quote.get('price'):
-                        market_value = position * quote['price']
-                        current_value += market_value
-                        logger.info(f"  📊 {ticker}: {position} x R$ {quote['price']:.2f} = R$ {market_value:.2f}")
-                        # Salvar no cache
-                        quotes_repository.save_quote(ticker, quote)
-                    else:
-                        # Sem cotação: usar valor investido
-                        current_value += invested
-                        logger.warning(f"  ⚠️  {ticker} ({asset_class}): sem cotação, usando valor investido R$ {invested:.2f}")
+                    # Sem cotação: usar valor investido
+                    current_value += invested
+                    logger.warning(f"  ⚠️  {ticker} ({asset_class}): sem cotação, usando valor investido R$ {invested:.2f}")
         
         # Se não calculou nada, usar valor investido total
         if current_value == 0:
@@ -213,6 +190,7 @@ def get_dashboard_summary() -> dict:
             "current_value": current_value,
             "total_bought_value": total_bought_value,
             "total_sold_value": total_sold_value,
+            "stale_quotes": stale_quotes,
             "positions": top_positions,
             "recent_operations": recent_operations,
             "asset_allocation": asset_allocation,
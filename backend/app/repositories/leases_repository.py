@@ -0,0 +1,62 @@
+"""
+Repositório de concessões (leases) entre processos (tabela leases).
+
+Uma concessão pertence a um `holder` até `expires_at` (epoch, segundos).
+Adquirir é um upsert condicional: só toma a concessão se ela não existe,
+já é do mesmo holder (renovação) ou expirou. O SQLite serializa as
+escritas, então dois processos nunca ficam com a mesma concessão.
+
+Todas as funções recebem um cursor para participar da transação do chamador.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from app.db.database import chunked
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(cursor, names: Iterable[str], holder: str, ttl_seconds: float, now: float) -> List[str]:
+    """
+    Adquire (ou renova) as concessões livres ou vencidas.
+
+    Returns:
+        Nomes que ficaram com `holder`
+    """
+    names = list(dict.fromkeys(names))
+    cursor.executemany("""
+        INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET
+            holder = excluded.holder,
+            expires_at = excluded.expires_at
+        WHERE leases.holder = excluded.holder OR leases.expires_at <= ?
+    """, [(name, holder, now + ttl_seconds, now) for name in names])
+
+    acquired = []
+    for chunk in chunked(names):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT name FROM leases
+            WHERE holder = ? AND name IN ({placeholders})
+        """, (holder, *chunk))
+        acquired.extend(row[0] for row in cursor.fetchall())
+    return acquired
+
+
+def release(cursor, names: Iterable[str], holder: str) -> None:
+    """Libera as concessões de `holder` (as de outros holders ficam)."""
+    for chunk in chunked(names):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            DELETE FROM leases
+            WHERE holder = ? AND name IN ({placeholders})
+        """, (holder, *chunk))
+
+
+def get_lease(cursor, name: str) -> Optional[Dict]:
+    cursor.execute("SELECT name, holder, expires_at FROM leases WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {"name": row[0], "holder": row[1], "expires_at": row[2]}
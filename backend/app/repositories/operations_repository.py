@@ -4,51 +4,61 @@ from app.db.database import get_db
 
 logger = logging.getLogger(__name__)
 
-def create_operation(data: dict):
-    """
-    Cria uma nova operação vinculada a um ativo.
-    
-    Args:
-        data: Dicionário com dados da operação (deve conter asset_id)
-    """
-    logger.info(f"Criando operação: Asset ID {data.get('asset_id')} - {data['movement_type']} - {data['source']}")
-    
-    with get_db() as conn:
-        cursor = conn.cursor()
+OPERATION_INSERT_SQL = """
+    INSERT INTO operations (
+        asset_id, movement_type, quantity, price, value, trade_date,
+        created_at, source, market, institution, operation_subtype, notes
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-        cursor.execute("""
-        INSERT INTO operations (
-            asset_id,
-            movement_type,
-            quantity,
-            price,
-            value,
-            trade_date,
-            created_at,
-            source,
-            market,
-            institution,
-            operation_subtype,
-            notes
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+
+def _operation_params(data: dict, created_at: str) -> tuple:
+    return (
         data["asset_id"],
         data["movement_type"],
         data["quantity"],
         data["price"],
         data.get("value", data["quantity"] * data["price"]),
         data["trade_date"],
-        datetime.utcnow().isoformat(),
+        created_at,
         data["source"],
         data.get("market"),
         data.get("institution"),
         data.get("operation_subtype"),
         data.get("notes"),
-        ))
+    )
+
+
+def create_operation(data: dict):
+    """
+    Cria uma nova operação vinculada a um ativo.
+    
+    Args:
+        data: Dicionário com dados da operação (deve conter asset_id)
+    """
+    logger.info(f"Criando operação: Asset ID {data.get('asset_id')} - {data['movement_type']} - {data['source']}")
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(OPERATION_INSERT_SQL, _operation_params(data, datetime.utcnow().isoformat()))
         
         operation_id = cursor.lastrowid
         logger.debug(f"Operação criada com sucesso: ID {operation_id}")
 
+def create_operations_bulk(cursor, operations: list[dict]) -> None:
+    """
+    Insere várias operações com executemany na transação do chamador.
+    
+    Args:
+        cursor: Cursor da transação
+        operations: Lista de dicts no formato de create_operation
+    """
+    created_at = datetime.utcnow().isoformat()
+    cursor.executemany(OPERATION_INSERT_SQL, [_operation_params(op, created_at) for op in operations])
+    logger.info(f"{len(operations)} operações criadas em lote")
+
+
 def list_operations():
     """Lista todas as operações ativas com dados do ativo."""
     logger.debug("Listando todas as operações ativas")
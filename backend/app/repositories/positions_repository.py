@@ -0,0 +1,203 @@
+"""
+Repositório do cache de posições calculadas pelo engine.
+
+As posições continuam sendo derivadas das operações (fonte da verdade);
+estas tabelas apenas evitam replays completos:
+- position_cache: última posição calculada por ativo
+- position_checkpoints: estado do engine ao fim de cada mês com operações
+
+Invalidação é feita por triggers em `operations` (ver init_db), que preenchem
+`position_cache.stale_since` com a menor data afetada.
+
+Todas as funções recebem um cursor para participar da transação do chamador.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from app.db.database import SQLITE_MAX_PARAMS, chunked
+
+logger = logging.getLogger(__name__)
+
+STATE_COLUMNS = [
+    "quantity",
+    "total_cost",
+    "total_bought_value",
+    "total_sold_value",
+    "timeline_count",
+]
+
+
+def get_cached_positions(cursor, asset_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Busca as posições em cache dos ativos informados.
+
+    Returns:
+        Dicionário asset_id -> linha do cache (inclui stale_since)
+    """
+    cached = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, quantity, total_cost, total_bought_value,
+                   total_sold_value, timeline_count, last_trade_date,
+                   stale_since, computed_at
+            FROM position_cache
+            WHERE asset_id IN ({placeholders})
+        """, chunk)
+        for row in cursor.fetchall():
+            cached[row[0]] = {
+                "asset_id": row[0],
+                "quantity": row[1],
+                "total_cost": row[2],
+                "total_bought_value": row[3],
+                "total_sold_value": row[4],
+                "timeline_count": row[5],
+                "last_trade_date": row[6],
+                "stale_since": row[7],
+                "computed_at": row[8],
+            }
+    return cached
+
+
+def save_cached_positions(cursor, positions: List[Dict]) -> None:
+    """
+    Grava (upsert) posições recalculadas, marcando-as como atualizadas.
+
+    Args:
+        positions: Lista de dicts com asset_id, last_trade_date e STATE_COLUMNS
+    """
+    if not positions:
+        return
+
+    now = datetime.utcnow().isoformat()
+    cursor.executemany("""
+        INSERT INTO position_cache (
+            asset_id, quantity, total_cost, total_bought_value,
+            total_sold_value, timeline_count, last_trade_date,
+            stale_since, computed_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?)
+        ON CONFLICT(asset_id) DO UPDATE SET
+            quantity = excluded.quantity,
+            total_cost = excluded.total_cost,
+            total_bought_value = excluded.total_bought_value,
+            total_sold_value = excluded.total_sold_value,
+            timeline_count = excluded.timeline_count,
+            last_trade_date = excluded.last_trade_date,
+            stale_since = NULL,
+            computed_at = excluded.computed_at
+    """, [
+        (
+            p["asset_id"],
+            p["quantity"],
+            p["total_cost"],
+            p["total_bought_value"],
+            p["total_sold_value"],
+            p["timeline_count"],
+            p.get("last_trade_date"),
+            now,
+        )
+        for p in positions
+    ])
+    logger.debug(f"{len(positions)} posições gravadas no cache")
+
+
+def discard_checkpoints(cursor, asset_id: int, since: Optional[str] = None) -> None:
+    """
+    Remove checkpoints invalidados de um ativo.
+
+    Args:
+        since: Remove checkpoints com as_of >= since. Se None, remove todos.
+    """
+    if since is None:
+        cursor.execute("DELETE FROM position_checkpoints WHERE asset_id = ?", (asset_id,))
+    else:
+        cursor.execute(
+            "DELETE FROM position_checkpoints WHERE asset_id = ? AND as_of >= ?",
+            (asset_id, since)
+        )
+
+
+def get_latest_checkpoints(cursor, asset_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Busca o checkpoint mais recente de cada ativo.
+
+    Returns:
+        Dicionário asset_id -> {"as_of": ..., **STATE_COLUMNS}
+    """
+    checkpoints = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT c.asset_id, c.as_of, c.quantity, c.total_cost,
+                   c.total_bought_value, c.total_sold_value, c.timeline_count
+            FROM position_checkpoints c
+            INNER JOIN (
+                SELECT asset_id, MAX(as_of) AS as_of
+                FROM position_checkpoints
+                WHERE asset_id IN ({placeholders})
+                GROUP BY asset_id
+            ) latest ON latest.asset_id = c.asset_id AND latest.as_of = c.as_of
+        """, chunk)
+        for row in cursor.fetchall():
+            checkpoints[row[0]] = {
+                "as_of": row[1],
+                **dict(zip(STATE_COLUMNS, row[2:])),
+            }
+    return checkpoints
+
+
+def save_checkpoints(cursor, asset_id: int, checkpoints: List[Dict]) -> None:
+    """
+    Grava checkpoints de um ativo (substitui checkpoints na mesma data).
+
+    Args:
+        checkpoints: Lista de dicts com as_of e STATE_COLUMNS
+    """
+    if not checkpoints:
+        return
+
+    cursor.executemany("""
+        INSERT OR REPLACE INTO position_checkpoints (
+            asset_id, as_of, quantity, total_cost,
+            total_bought_value, total_sold_value, timeline_count
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (asset_id, c["as_of"], *(c[col] for col in STATE_COLUMNS))
+        for c in checkpoints
+    ])
+
+
+def get_checkpoints_as_of(cursor, targets: Dict[int, str]) -> Dict[int, Dict]:
+    """
+    Busca, para cada ativo, o checkpoint mais recente com as_of <= data alvo.
+
+    Args:
+        targets: Dicionário asset_id -> data (YYYY-MM-DD)
+
+    Returns:
+        Dicionário asset_id -> {"as_of": ..., **STATE_COLUMNS}
+        (ativos sem checkpoint anterior à data ficam de fora)
+    """
+    checkpoints = {}
+    for chunk in chunked(list(targets.items()), SQLITE_MAX_PARAMS // 2):
+        values = ",".join("(?, ?)" for _ in chunk)
+        params = [value for pair in chunk for value in pair]
+        cursor.execute(f"""
+            WITH targets(asset_id, as_of) AS (VALUES {values})
+            SELECT c.asset_id, c.as_of, c.quantity, c.total_cost,
+                   c.total_bought_value, c.total_sold_value, c.timeline_count
+            FROM targets t
+            INNER JOIN position_checkpoints c ON c.asset_id = t.asset_id
+            WHERE c.as_of = (
+                SELECT MAX(as_of) FROM position_checkpoints
+                WHERE asset_id = t.asset_id AND as_of <= t.as_of
+            )
+        """, params)
+        for row in cursor.fetchall():
+            checkpoints[row[0]] = {
+                "as_of": row[1],
+                **dict(zip(STATE_COLUMNS, row[2:])),
+            }
+    return checkpoints
@@ -0,0 +1,106 @@
+"""
+Repositório do histórico diário de cotações (tabela quote_history).
+
+Datas são gravadas como inteiros YYYYMMDD. Leituras de intervalo devolvem
+arrays numpy por coluna (formato colunar), prontos para análises.
+
+Todas as funções recebem um cursor para participar da transação do chamador.
+"""
+
+import logging
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from app.db.database import chunked
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = ("open", "high", "low", "close", "volume")
+
+# (asset_id, date YYYYMMDD, open, high, low, close, volume)
+HistoryRow = Tuple[int, int, float, float, float, float, int]
+
+
+def encode_date(value: str) -> int:
+    """'2026-01-05' -> 20260105"""
+    return int(value[:10].replace("-", ""))
+
+
+def decode_date(value: int) -> str:
+    """20260105 -> '2026-01-05'"""
+    value = int(value)
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+def upsert_bars(cursor, rows: Iterable[HistoryRow]) -> int:
+    """
+    Grava pregões em lote; um pregão já existente (asset_id, date) é substituído.
+
+    Returns:
+        Número de linhas gravadas
+    """
+    rows = list(rows)
+    cursor.executemany("""
+        INSERT INTO quote_history (asset_id, date, open, high, low, close, volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (asset_id, date) DO UPDATE SET
+            open = excluded.open,
+            high = excluded.high,
+            low = excluded.low,
+            close = excluded.close,
+            volume = excluded.volume
+    """, rows)
+    return len(rows)
+
+
+def get_last_dates(cursor, asset_ids: Iterable[int]) -> Dict[int, int]:
+    """Último pregão gravado de cada ativo (só ativos com histórico)."""
+    last_dates = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, MAX(date)
+            FROM quote_history
+            WHERE asset_id IN ({placeholders})
+            GROUP BY asset_id
+        """, chunk)
+        last_dates.update(cursor.fetchall())
+    return last_dates
+
+
+def get_range(cursor, asset_ids: Iterable[int], start: int, end: int) -> Dict[int, Dict[str, np.ndarray]]:
+    """
+    Pregões de cada ativo com start <= date <= end, em ordem de data.
+
+    Returns:
+        asset_id -> {"date": int64[], "open": float64[], ..., "volume": int64[]}
+        (só ativos com pregões no intervalo)
+    """
+    history = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, date, open, high, low, close, volume
+            FROM quote_history
+            WHERE asset_id IN ({placeholders}) AND date BETWEEN ? AND ?
+            ORDER BY asset_id, date
+        """, (*chunk, start, end))
+        rows = cursor.fetchall()
+        if not rows:
+            continue
+
+        columns = np.array(rows, dtype=np.float64).T
+        ids = columns[0].astype(np.int64)
+        # Linhas vêm agrupadas por ativo: corta nos pontos em que o id muda
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        for segment in np.split(np.arange(len(ids)), bounds):
+            history[int(ids[segment[0]])] = {
+                "date": columns[1, segment].astype(np.int64),
+                "open": columns[2, segment],
+                "high": columns[3, segment],
+                "low": columns[4, segment],
+                "close": columns[5, segment],
+                "volume": np.nan_to_num(columns[6, segment]).astype(np.int64),
+            }
+    return history
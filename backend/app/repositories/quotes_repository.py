@@ -9,11 +9,15 @@ Armazena cotações no banco de dados para:
 
 import logging
 from datetime import datetime
-from typing import Optional, List, Dict
-from app.db.database import get_db
+from typing import Optional, List, Dict, Tuple
+from app.db.database import get_db, chunked
 
 logger = logging.getLogger(__name__)
 
+# Classes de ativos negociados em bolsa (com cotação no provedor); renda
+# fixa e demais instrumentos fora de bolsa nunca são consultados
+QUOTED_ASSET_CLASSES = ("AÇÕES", "ETF", "FUNDO IMOBILIÁRIO")
+
 
 def save_quote(ticker: str, quote_data: dict) -> bool:
     """
@@ -26,11 +30,45 @@ def save_quote(ticker: str, quote_data: dict) -> bool:
     Returns:
         True se salvou com sucesso
     """
+    return save_quotes_bulk({ticker: quote_data}) == 1
+
+
+def save_quotes_bulk(quotes: Dict[str, dict]) -> int:
+    """
+    Salva ou atualiza várias cotações em uma única transação (um commit).
+    
+    Args:
+        quotes: Dicionário ticker -> dados da cotação (valores None são ignorados)
+        
+    Returns:
+        Número de cotações gravadas (0 em caso de erro)
+    """
+    now = datetime.now().isoformat()
+    rows = [
+        (
+            ticker,
+            quote_data.get('price', 0),
+            quote_data.get('change', 0),
+            quote_data.get('change_percent', 0),
+            quote_data.get('volume', 0),
+            quote_data.get('open', 0),
+            quote_data.get('high', 0),
+            quote_data.get('low', 0),
+            quote_data.get('previous_close', 0),
+            quote_data.get('source', 'yfinance'),
+            quote_data.get('updated_at', now)
+        )
+        for ticker, quote_data in quotes.items()
+        if quote_data
+    ]
+    if not rows:
+        return 0
+    
     try:
         with get_db() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
+            cursor.executemany("""
                 INSERT INTO quotes (
                     ticker, price, change_value, change_percent,
                     volume, open_price, high_price, low_price,
@@ -47,26 +85,14 @@ def save_quote(ticker: str, quote_data: dict) -> bool:
                     previous_close = excluded.previous_close,
                     source = excluded.source,
                     updated_at = excluded.updated_at
-            """, (
-                ticker,
-                quote_data.get('price', 0),
-                quote_data.get('change', 0),
-                quote_data.get('change_percent', 0),
-                quote_data.get('volume', 0),
-                quote_data.get('open', 0),
-                quote_data.get('high', 0),
-                quote_data.get('low', 0),
-                quote_data.get('previous_close', 0),
-                quote_data.get('source', 'yfinance'),
-                quote_data.get('updated_at', datetime.now().isoformat())
-            ))
-            
-            logger.info(f"Cotação salva: {ticker} = R$ {quote_data.get('price', 0):.2f}")
-            return True
+            """, rows)
+            
+            logger.info(f"{len(rows)} cotações salvas")
+            return len(rows)
             
     except Exception as e:
-        logger.error(f"Erro ao salvar cotação de {ticker}: {e}")
-        return False
+        logger.error(f"Erro ao salvar {len(rows)} cotações: {e}")
+        return 0
 
 
 def get_quote(ticker: str) -> Optional[Dict]:
@@ -115,6 +141,110 @@ def get_quote(ticker: str) -> Optional[Dict]:
         return None
 
 
+def get_quotes(tickers: List[str]) -> Dict[str, Dict]:
+    """
+    Busca cotações de vários tickers do banco em uma única consulta por bloco.
+    
+    Args:
+        tickers: Lista de códigos de ativos
+        
+    Returns:
+        Dicionário ticker -> cotação (tickers sem cotação ficam de fora)
+    """
+    quotes = {}
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            for chunk in chunked(sorted(set(tickers))):
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"""
+                    SELECT 
+                        ticker, price, change_value, change_percent,
+                        volume, open_price, high_price, low_price,
+                        previous_close, source, updated_at
+                    FROM quotes
+                    WHERE ticker IN ({placeholders})
+                """, chunk)
+                
+                for row in cursor.fetchall():
+                    quotes[row[0]] = {
+                        'ticker': row[0],
+                        'price': row[1],
+                        'change': row[2],
+                        'change_percent': row[3],
+                        'volume': row[4],
+                        'open': row[5],
+                        'high': row[6],
+                        'low': row[7],
+                        'previous_close': row[8],
+                        'source': row[9],
+                        'updated_at': row[10]
+                    }
+            
+            return quotes
+            
+    except Exception as e:
+        logger.error(f"Erro ao buscar cotações em lote: {e}")
+        return quotes
+
+
+def get_quotes_changed_since(version: int) -> Tuple[int, Dict[str, Dict]]:
+    """
+    Cotações gravadas (por qualquer processo) após a versão informada.
+    
+    Cada escrita em quotes incrementa o contador quote_changes.version;
+    quando ele não mudou, a consulta lê uma única linha.
+    
+    Args:
+        version: Última versão já vista (0 = todas)
+        
+    Returns:
+        (nova versão vista, ticker -> cotação alterada)
+    """
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT version FROM quote_changes WHERE id = 1")
+            row = cursor.fetchone()
+            if not row or row[0] <= version:
+                return version, {}
+            
+            cursor.execute("""
+                SELECT 
+                    ticker, price, change_value, change_percent,
+                    volume, open_price, high_price, low_price,
+                    previous_close, source, updated_at, version
+                FROM quotes
+                WHERE version > ?
+            """, (version,))
+            
+            quotes = {}
+            latest = version
+            for row in cursor.fetchall():
+                latest = max(latest, row[11])
+                quotes[row[0]] = {
+                    'ticker': row[0],
+                    'price': row[1],
+                    'change': row[2],
+                    'change_percent': row[3],
+                    'volume': row[4],
+                    'open': row[5],
+                    'high': row[6],
+                    'low': row[7],
+                    'previous_close': row[8],
+                    'source': row[9],
+                    'updated_at': row[10]
+                }
+            
+            return latest, quotes
+            
+    except Exception as e:
+        logger.error(f"Erro ao buscar cotações alteradas: {e}")
+        return version, {}
+
+
 def get_all_quotes() -> List[Dict]:
     """
     Busca todas as cotações do banco.
@@ -161,7 +291,7 @@ def get_all_quotes() -> List[Dict]:
 def get_tickers_to_update() -> List[str]:
     """
     Busca lista de tickers que precisam ser atualizados.
-    Retorna todos os tickers de ativos ativos (AÇÕES e ETF).
+    Retorna os tickers com posição das classes em QUOTED_ASSET_CLASSES.
     
     Returns:
         Lista de tickers
@@ -170,19 +300,20 @@ def get_tickers_to_update() -> List[str]:
         with get_db() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
+            placeholders = ",".join("?" * len(QUOTED_ASSET_CLASSES))
+            cursor.execute(f"""
                 SELECT DISTINCT a.ticker
                 FROM assets a
                 LEFT JOIN operations o ON a.id = o.asset_id AND o.status = 'ACTIVE'
                 WHERE a.status = 'ACTIVE' 
-                  AND (a.asset_class = 'AÇÕES' OR a.asset_class = 'ETF')
+                  AND a.asset_class IN ({placeholders})
                 GROUP BY a.ticker
                 HAVING (
                     COALESCE(SUM(CASE WHEN UPPER(o.movement_type) = 'COMPRA' THEN o.quantity ELSE 0 END), 0) -
                     COALESCE(SUM(CASE WHEN UPPER(o.movement_type) = 'VENDA' THEN o.quantity ELSE 0 END), 0)
                 ) > 0
                 ORDER BY a.ticker
-            """)
+            """, QUOTED_ASSET_CLASSES)
             
             return [row[0] for row in cursor.fetchall()]
             
@@ -0,0 +1,200 @@
+"""
+Repositório de snapshots de posição B3 (fonte de verdade da reconciliação).
+
+Armazenamento:
+- snapshot_batches: um lote por arquivo de posição importado
+- position_snapshots: apenas as quantidades que mudaram em relação ao
+  último snapshot do ativo (delta)
+- position_snapshot_latest: último snapshot de cada ativo (quantidade e
+  lote/data da última confirmação), mantido a cada importação
+
+Todas as funções recebem um cursor para participar da transação do chamador.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from app.db.database import chunked
+
+logger = logging.getLogger(__name__)
+
+# Tolerância para considerar uma quantidade inalterada entre lotes
+QUANTITY_TOLERANCE = 1e-9
+
+
+def get_latest_snapshots(cursor, asset_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Busca o último snapshot conhecido dos ativos informados.
+
+    Returns:
+        Dicionário asset_id -> {"quantity", "batch_id", "snapshot_date"}
+    """
+    latest = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, quantity, batch_id, snapshot_date
+            FROM position_snapshot_latest
+            WHERE asset_id IN ({placeholders})
+        """, chunk)
+        for asset_id, quantity, batch_id, snapshot_date in cursor.fetchall():
+            latest[asset_id] = {
+                "quantity": quantity,
+                "batch_id": batch_id,
+                "snapshot_date": snapshot_date,
+            }
+    return latest
+
+
+def save_snapshot_batch(
+    cursor,
+    quantities: Dict[int, float],
+    snapshot_date: str,
+    filename: str = None,
+    source: str = "B3"
+) -> Dict:
+    """
+    Grava um lote de snapshot: cabeçalho, deltas e ponteiro do último snapshot.
+
+    Args:
+        quantities: Dicionário asset_id -> quantidade informada pela B3
+        snapshot_date: Data/hora do snapshot (ISO)
+
+    Returns:
+        Dicionário com batch_id, total_positions e changed_positions
+    """
+    now = datetime.utcnow().isoformat()
+    latest = get_latest_snapshots(cursor, quantities)
+
+    changed = [
+        (asset_id, quantity)
+        for asset_id, quantity in quantities.items()
+        if asset_id not in latest
+        or abs(latest[asset_id]["quantity"] - quantity) > QUANTITY_TOLERANCE
+    ]
+
+    cursor.execute("""
+        INSERT INTO snapshot_batches (
+            snapshot_date, source, filename, total_positions, changed_positions, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    """, (snapshot_date, source, filename, len(quantities), len(changed), now))
+    batch_id = cursor.lastrowid
+
+    cursor.executemany("""
+        INSERT INTO position_snapshots (asset_id, quantity, snapshot_date, source, created_at, batch_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(asset_id, quantity, snapshot_date, source, now, batch_id) for asset_id, quantity in changed])
+
+    cursor.executemany("""
+        INSERT INTO position_snapshot_latest (asset_id, quantity, batch_id, snapshot_date)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(asset_id) DO UPDATE SET
+            quantity = excluded.quantity,
+            batch_id = excluded.batch_id,
+            snapshot_date = excluded.snapshot_date
+    """, [(asset_id, quantity, batch_id, snapshot_date) for asset_id, quantity in quantities.items()])
+
+    logger.debug(f"Lote de snapshot {batch_id}: {len(quantities)} posições, {len(changed)} alteradas")
+    return {
+        "batch_id": batch_id,
+        "total_positions": len(quantities),
+        "changed_positions": len(changed),
+    }
+
+
+def downsample_snapshot_batches(cursor, before: str) -> Dict:
+    """
+    Reduz lotes anteriores a `before` a um lote por mês (o último do mês).
+
+    Deltas dos lotes descartados não se perdem: a alteração mais recente de
+    cada ativo no mês é movida para o lote mantido, caso ele não tenha uma
+    própria. O ponteiro de último snapshot é redirecionado para o lote mantido.
+    Linhas movidas e ponteiros mantêm a própria snapshot_date: a quantidade
+    continua comparada com a posição na data em que foi observada.
+
+    Args:
+        before: Data (ISO) limite; lotes a partir dela não são alterados
+
+    Returns:
+        Dicionário com batches_removed, rows_moved e rows_removed
+    """
+    cursor.execute("""
+        SELECT id, snapshot_date FROM snapshot_batches
+        WHERE snapshot_date < ?
+        ORDER BY snapshot_date, id
+    """, (before,))
+
+    batches_by_month: Dict[str, List] = {}
+    for batch_id, snapshot_date in cursor.fetchall():
+        batches_by_month.setdefault(snapshot_date[:7], []).append((batch_id, snapshot_date))
+
+    removed_batches = []
+    kept_batches = []
+    moves = []
+    deletes = []
+    redirects = []
+
+    for batches in batches_by_month.values():
+        if len(batches) < 2:
+            continue
+
+        kept_id = batches[-1][0]
+        order = {batch_id: position for position, (batch_id, _) in enumerate(batches)}
+        dropped = [batch_id for batch_id, _ in batches[:-1]]
+
+        placeholders = ",".join("?" * len(batches))
+        cursor.execute(f"""
+            SELECT id, asset_id, batch_id FROM position_snapshots
+            WHERE batch_id IN ({placeholders})
+        """, [batch_id for batch_id, _ in batches])
+
+        # Linha mais recente de cada ativo no mês
+        latest_row = {}
+        rows = cursor.fetchall()
+        for row_id, asset_id, batch_id in rows:
+            current = latest_row.get(asset_id)
+            if current is None or (order[batch_id], row_id) > (order[current[1]], current[0]):
+                latest_row[asset_id] = (row_id, batch_id)
+
+        for row_id, asset_id, batch_id in rows:
+            if batch_id == kept_id:
+                continue
+            if latest_row[asset_id][0] == row_id:
+                moves.append((kept_id, row_id))
+            else:
+                deletes.append((row_id,))
+
+        removed_batches.extend(dropped)
+        kept_batches.append((kept_id,))
+        redirects.extend((kept_id, batch_id) for batch_id in dropped)
+
+    if not removed_batches:
+        return {"batches_removed": 0, "rows_moved": 0, "rows_removed": 0}
+
+    cursor.executemany(
+        "UPDATE position_snapshots SET batch_id = ? WHERE id = ?", moves
+    )
+    cursor.executemany("DELETE FROM position_snapshots WHERE id = ?", deletes)
+    cursor.executemany(
+        "UPDATE position_snapshot_latest SET batch_id = ? WHERE batch_id = ?",
+        redirects
+    )
+    cursor.executemany("""
+        UPDATE snapshot_batches
+        SET changed_positions = (SELECT COUNT(*) FROM position_snapshots WHERE batch_id = snapshot_batches.id)
+        WHERE id = ?
+    """, kept_batches)
+    for chunk in chunked(removed_batches):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"DELETE FROM snapshot_batches WHERE id IN ({placeholders})", chunk)
+
+    logger.info(
+        f"Retenção de snapshots: {len(removed_batches)} lotes removidos, "
+        f"{len(moves)} alterações movidas, {len(deletes)} linhas removidas"
+    )
+    return {
+        "batches_removed": len(removed_batches),
+        "rows_moved": len(moves),
+        "rows_removed": len(deletes),
+    }
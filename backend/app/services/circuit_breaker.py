@@ -0,0 +1,92 @@
+"""
+Circuit breaker para provedores externos (cotações).
+
+- closed: requisições passam; falhas consecutivas são contadas
+- open: após `failure_threshold` falhas seguidas, requisições são recusadas
+  na hora (sem esperar timeouts/retentativas) por `reset_timeout` segundos
+- half_open: passado o tempo, uma única requisição de teste passa; sucesso
+  fecha o circuito, falha o reabre
+"""
+
+import logging
+import threading
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold deve ser >= 1")
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._counters = {"rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """True se a requisição pode ser feita agora."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._counters["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuito '{self.name}' fechado: provedor respondeu")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._counters["opened"] += 1
+                    logger.warning(
+                        f"Circuito '{self.name}' aberto após {self._failures} falhas; "
+                        f"novas tentativas em {self.reset_timeout:.0f}s"
+                    )
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            state = self._current_state()
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic() if state == OPEN else 0.0
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in_seconds": round(max(retry_in, 0.0), 1),
+                **self._counters
+            }
@@ -0,0 +1,334 @@
+"""
+Serviço de Eventos Corporativos
+
+Responsável por:
+- Validar eventos detectados na importação (bonificações, desdobros, etc.)
+- Aplicar os ajustes de quantidade em lote, em uma única transação
+- Atualizar incrementalmente as posições dos ativos afetados
+- Registrar eventos por razão (desdobro 1:N, grupamento N:1, bonificação),
+  aplicados pelo engine via fatores cumulativos
+"""
+
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.db.database import get_db, chunked
+from app.repositories import corporate_events_repository
+from app.repositories.corporate_events_repository import EVENT_TYPES
+from app.repositories.operations_repository import create_operations_bulk
+from app.services.position_engine import refresh_positions
+
+logger = logging.getLogger(__name__)
+
+
+def _validate_event(event: Dict, asset_ids: Dict[str, int]) -> Optional[str]:
+    """Retorna a mensagem de erro do evento, ou None se for válido."""
+    ticker = event.get("ticker")
+    if not ticker:
+        return "Ticker ausente"
+    if ticker not in asset_ids:
+        return f"Ativo {ticker} não encontrado"
+    if not event.get("type"):
+        return "Tipo do evento ausente"
+
+    quantity = event.get("quantity")
+    if isinstance(quantity, bool) or not isinstance(quantity, (int, float)) or quantity != quantity:
+        return f"Quantidade inválida: {quantity}"
+    if quantity == 0:
+        return "Quantidade zero"
+
+    try:
+        datetime.strptime(str(event.get("date")), "%Y-%m-%d")
+    except ValueError:
+        return f"Data inválida: {event.get('date')}"
+
+    return None
+
+
+def _build_adjustment(event: Dict, asset_id: int) -> Dict:
+    return {
+        "asset_id": asset_id,
+        "movement_type": "COMPRA" if event["quantity"] > 0 else "VENDA",
+        "operation_subtype": event["type"],
+        "quantity": abs(event["quantity"]),
+        "price": 0.0,
+        "value": 0.0,
+        "trade_date": event["date"],
+        "source": "AJUSTE_LOTE",
+        "notes": event.get("description"),
+        # O UNIQUE de operations não inclui operation_subtype: o tipo do
+        # evento vai em market para que eventos distintos com mesma data e
+        # quantidade (ex.: BONIFICACAO e DESDOBRO) não colidam. Institution
+        # vazia, não NULL: o UNIQUE trata NULLs como distintos
+        "market": event["type"],
+        "institution": ""
+    }
+
+
+def _adjustment_key(adjustment: Dict) -> tuple:
+    return (
+        adjustment["asset_id"], adjustment["trade_date"], adjustment["movement_type"],
+        adjustment["quantity"], adjustment["operation_subtype"]
+    )
+
+
+def _applied_adjustment_keys(cursor, asset_ids: List[int]) -> set:
+    """Chaves (ativo, data, direção, quantidade, subtipo) dos ajustes em lote já gravados."""
+    keys = set()
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, trade_date, movement_type, quantity, operation_subtype
+            FROM operations
+            WHERE asset_id IN ({placeholders}) AND source = 'AJUSTE_LOTE' AND status = 'ACTIVE'
+        """, chunk)
+        keys.update(cursor.fetchall())
+    return keys
+
+
+def apply_corporate_events(events: List[Dict], atomic: bool = False) -> Dict:
+    """
+    Aplica eventos corporativos em lote.
+
+    Resolve todos os tickers com uma consulta, valida todos os eventos antes
+    de gravar e insere os ajustes com executemany em uma única transação.
+
+    Args:
+        events: Eventos no formato de `detect_corporate_events`
+                (type, ticker, quantity, date, description, skip opcional)
+        atomic: Se True, qualquer erro (validação ou gravação) cancela todos
+                os ajustes. Se False, eventos com erro são reportados e os
+                demais são aplicados.
+
+    Reaplicar o mesmo evento é idempotente: ajuste já gravado com mesmo
+    ativo, data, quantidade e tipo de evento não é gravado de novo e o evento
+    sai como "already_applied".
+
+    Returns:
+        Resumo com applied, already_applied, skipped, errors e resultado por evento
+    """
+    logger.info(f"Aplicando {len(events)} eventos corporativos em lote{' (atômico)' if atomic else ''}")
+
+    # Eventos marcados para skip (leilões de fração) não geram ajuste
+    pending = [event for event in events if not event.get("skip")]
+    skipped = len(events) - len(pending)
+
+    results = []
+    errors = []
+    applied = []
+    already_applied = 0
+
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+
+        tickers = sorted({e.get("ticker") for e in pending if e.get("ticker")})
+        asset_ids = {}
+        for chunk in chunked(tickers):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT ticker, id FROM assets WHERE ticker IN ({placeholders})", chunk)
+            asset_ids.update(cursor.fetchall())
+
+        valid = []
+        for event in pending:
+            error = _validate_event(event, asset_ids)
+            if error:
+                errors.append(f"{event.get('ticker')}: {error}")
+                results.append({
+                    "ticker": event.get("ticker"),
+                    "type": event.get("type"),
+                    "status": "error",
+                    "error": error
+                })
+            else:
+                valid.append((event, _build_adjustment(event, asset_ids[event["ticker"]])))
+
+        if atomic and errors:
+            logger.warning(f"Aplicação atômica cancelada: {len(errors)} eventos inválidos")
+            return _summary(events, [], 0, skipped, errors, results)
+
+        existing = _applied_adjustment_keys(cursor, sorted({adjustment["asset_id"] for _, adjustment in valid}))
+        repeated = [(event, adjustment) for event, adjustment in valid if _adjustment_key(adjustment) in existing]
+        if atomic and repeated:
+            errors.append(f"Ajuste já aplicado: {len(repeated)} eventos")
+            logger.error(f"Aplicação atômica cancelada: {len(repeated)} ajustes já aplicados")
+            return _summary(events, [], 0, skipped, errors, results)
+        for event, _ in repeated:
+            already_applied += 1
+            results.append({
+                "ticker": event["ticker"],
+                "type": event["type"],
+                "quantity": event["quantity"],
+                "status": "already_applied"
+            })
+        valid = [(event, adjustment) for event, adjustment in valid if _adjustment_key(adjustment) not in existing]
+
+        cursor.execute("SAVEPOINT corporate_events")
+        try:
+            create_operations_bulk(cursor, [adjustment for _, adjustment in valid])
+            applied = valid
+        except sqlite3.IntegrityError as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT corporate_events")
+            if atomic:
+                errors.append(f"Ajuste já aplicado: {e}")
+                logger.error(f"Aplicação atômica cancelada: {e}")
+                return _summary(events, [], 0, skipped, errors, results)
+
+            # Lote rejeitado (evento repetido no próprio lote): grava evento a
+            # evento para aplicar só o primeiro
+            for event, adjustment in valid:
+                try:
+                    create_operations_bulk(cursor, [adjustment])
+                    applied.append((event, adjustment))
+                except sqlite3.IntegrityError:
+                    already_applied += 1
+                    results.append({
+                        "ticker": event["ticker"],
+                        "type": event["type"],
+                        "quantity": event["quantity"],
+                        "status": "already_applied"
+                    })
+        cursor.execute("RELEASE SAVEPOINT corporate_events")
+
+    for event, _ in applied:
+        results.append({
+            "ticker": event["ticker"],
+            "type": event["type"],
+            "quantity": event["quantity"],
+            "status": "success"
+        })
+
+    # Triggers já marcaram o cache dos ativos afetados; recalcula só eles
+    # a partir da data do evento mais antigo
+    recomputed = 0
+    if applied:
+        touched = {adjustment["asset_id"] for _, adjustment in applied}
+        since = min(adjustment["trade_date"] for _, adjustment in applied)
+        recomputed = len(refresh_positions(touched, since=since))
+
+    summary = _summary(events, applied, already_applied, skipped, errors, results)
+    summary["recomputed"] = recomputed
+    return summary
+
+
+def _summary(
+    events: List[Dict], applied: List, already_applied: int, skipped: int, errors: List[str], results: List[Dict]
+) -> Dict:
+    logger.info(
+        f"Eventos aplicados: {len(applied)}/{len(events)} - {already_applied} já aplicados, {len(errors)} erros"
+    )
+    return {
+        "status": "success" if applied or (already_applied and not errors) else "error",
+        "applied": len(applied),
+        "already_applied": already_applied,
+        "skipped": skipped,
+        "total": len(events),
+        "errors": errors,
+        "results": results
+    }
+
+
+# ========== EVENTOS POR RAZÃO (corporate_events) ==========
+
+def _asset_id_by_ticker(cursor, ticker: str) -> int:
+    cursor.execute("SELECT id FROM assets WHERE ticker = ?", (ticker,))
+    row = cursor.fetchone()
+    if not row:
+        raise LookupError(f"Ativo {ticker} não encontrado")
+    return row[0]
+
+
+def _validate_ratio_event(data: Dict) -> None:
+    if data.get("event_type") not in EVENT_TYPES:
+        raise ValueError(f"Tipo de evento inválido: {data.get('event_type')}. Use {', '.join(EVENT_TYPES)}")
+    try:
+        datetime.strptime(str(data.get("ex_date")), "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Data inválida: {data.get('ex_date')}")
+
+    ratio_from, ratio_to = data.get("ratio_from"), data.get("ratio_to")
+    if not all(isinstance(r, (int, float)) and not isinstance(r, bool) and r > 0 for r in (ratio_from, ratio_to)):
+        raise ValueError(f"Razão inválida: {ratio_from}:{ratio_to}")
+    if ratio_from == ratio_to:
+        raise ValueError("Razão 1:1 não altera a posição")
+    if data["event_type"] == "GRUPAMENTO" and ratio_to > ratio_from:
+        raise ValueError("Grupamento deve reduzir a quantidade (ex.: 10:1)")
+    if data["event_type"] != "GRUPAMENTO" and ratio_to < ratio_from:
+        raise ValueError(f"{data['event_type']} deve aumentar a quantidade (ex.: 1:10)")
+    if (data.get("cost_basis") or 0) < 0:
+        raise ValueError("Custo atribuído não pode ser negativo")
+
+
+def register_ratio_event(ticker: str, data: Dict) -> Dict:
+    """
+    Registra um evento por razão e recalcula a posição do ativo.
+
+    O evento substitui as linhas sintéticas de ajuste (DESDOBRO/GRUPAMENTO/
+    BONIFICACAO em operations): se já existir uma na mesma data, o registro
+    é recusado para não contar o evento duas vezes.
+
+    Args:
+        data: event_type, ex_date (YYYY-MM-DD), ratio_from, ratio_to,
+              cost_basis (opcional, bonificação), notes (opcional)
+
+    Returns:
+        Evento criado e posição recalculada
+
+    Raises:
+        LookupError: Ativo não encontrado
+        ValueError: Evento inválido ou em conflito
+    """
+    _validate_ratio_event(data)
+
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        asset_id = _asset_id_by_ticker(cursor, ticker)
+
+        cursor.execute("""
+            SELECT COUNT(*) FROM operations
+            WHERE asset_id = ? AND trade_date = ? AND status = 'ACTIVE'
+              AND operation_subtype IN ('DESDOBRO', 'GRUPAMENTO', 'BONIFICACAO')
+        """, (asset_id, data["ex_date"]))
+        if cursor.fetchone()[0]:
+            raise ValueError(
+                f"Já existe ajuste de quantidade para {ticker} em {data['ex_date']}; "
+                "cancele a operação sintética antes de registrar o evento"
+            )
+
+        try:
+            event_id = corporate_events_repository.create_event(cursor, {**data, "asset_id": asset_id})
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Evento {data['event_type']} de {ticker} em {data['ex_date']} já registrado")
+
+        # Triggers marcaram o cache do ativo para replay completo
+        position = refresh_positions([asset_id], cursor=cursor)[asset_id]
+        events = corporate_events_repository.list_events(cursor, asset_id)
+
+    return {
+        "status": "success",
+        "event": next(e for e in events if e["id"] == event_id),
+        "position": position
+    }
+
+
+def list_ratio_events(ticker: str) -> List[Dict]:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        return corporate_events_repository.list_events(cursor, _asset_id_by_ticker(cursor, ticker))
+
+
+def delete_ratio_event(event_id: int) -> bool:
+    """Remove um evento por razão e recalcula a posição do ativo."""
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        cursor.execute("SELECT asset_id FROM corporate_events WHERE id = ?", (event_id,))
+        row = cursor.fetchone()
+        if not row or not corporate_events_repository.delete_event(cursor, event_id):
+            return False
+        refresh_positions([row[0]], cursor=cursor)
+    logger.info(f"Evento corporativo {event_id} removido")
+    return True
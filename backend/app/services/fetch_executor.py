@@ -0,0 +1,112 @@
+"""
+Execução concorrente de requisições a provedores externos (cotações).
+
+- TokenBucket: limita a taxa de requisições (com rajada) entre threads
+- ConcurrentFetcher: pool de threads com limite de requisições simultâneas,
+  rate limiting e retentativas com backoff exponencial e jitter
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Iterable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+R = TypeVar("R")
+
+
+class TokenBucket:
+    """
+    Limitador de taxa por balde de fichas (thread-safe).
+
+    Repõe `rate` fichas por segundo até `capacity`; cada requisição consome
+    uma ficha e espera se o balde estiver vazio.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate deve ser > 0 e capacity >= 1")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Consome uma ficha, esperando até `timeout` segundos (None = sem limite)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class ConcurrentFetcher:
+    """
+    Executa uma função sobre vários itens em paralelo, respeitando:
+    - max_in_flight: requisições simultâneas
+    - limiter: taxa máxima de requisições (cada tentativa consome uma ficha)
+    - max_retries: retentativas por item em caso de exceção, com espera
+      exponencial (backoff_base * 2^tentativa, até backoff_max) e jitter total
+
+    Itens que falham em todas as tentativas ficam com resultado None.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 4,
+        limiter: Optional[TokenBucket] = None,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.limiter = limiter
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": espera uniforme entre 0 e o teto exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _call(self, fn: Callable[[K], R], item: K) -> Optional[R]:
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                return fn(item)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Requisição falhou após {attempt + 1} tentativas: {e}")
+                    return None
+                delay = self._backoff(attempt)
+                logger.warning(f"Requisição falhou ({e}); nova tentativa em {delay:.2f}s")
+                time.sleep(delay)
+        return None
+
+    def map(self, fn: Callable[[K], R], items: Iterable[K]) -> Dict[K, Optional[R]]:
+        """Aplica `fn` a cada item; retorna item -> resultado (None se falhou)."""
+        items = list(items)
+        if len(items) <= 1 or self.max_in_flight == 1:
+            return {item: self._call(fn, item) for item in items}
+
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(items))) as pool:
+            futures = {item: pool.submit(self._call, fn, item) for item in items}
+            return {item: future.result() for item, future in futures.items()}
@@ -1,8 +1,13 @@
 import pandas as pd
 import sqlite3
 import logging
+import math
+import os
+import re
 from datetime import datetime
-from app.db.database import get_db
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from app.db.database import get_db, chunked
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +33,55 @@ MOVIMENTACAO_COLUMNS = [
     "Valor da Operação",
 ]
 
+# Eventos corporativos detectáveis pela coluna "Movimentação", na ordem em que
+# são reportados. Mesma semântica de `str.contains(pattern, case=False)`.
+CORPORATE_EVENT_PATTERNS = [
+    ("BONIFICACAO", re.compile("Bonificação", re.IGNORECASE)),
+    ("DESDOBRO", re.compile("Desdobro", re.IGNORECASE)),
+    ("ATUALIZACAO", re.compile("Atualização", re.IGNORECASE)),
+    ("LEILAO_FRACAO", re.compile("Leilão de Fração", re.IGNORECASE)),
+    ("SUBSCRICAO", re.compile("Direito de Subscrição|Subscrição", re.IGNORECASE)),
+]
+
+
+class MovimentacaoInfo(NamedTuple):
+    """Classificação de um texto de movimentação B3 (calculada uma vez por texto)."""
+    events: Tuple[str, ...]
+    is_update: bool
+    is_income: bool
+    is_bonus: bool
+    is_split: bool
+    is_transfer: bool
+
+
+@lru_cache(maxsize=1024)
+def classify_movimentacao(movimentacao: str) -> MovimentacaoInfo:
+    """
+    Classifica um texto da coluna "Movimentação" em categorias de evento e de
+    operação. O resultado é cacheado por texto distinto, já que um extrato
+    costuma ter poucas dezenas de movimentações diferentes.
+    
+    Args:
+        movimentacao: Texto da movimentação (ex: "Transferência - Liquidação")
+    
+    Returns:
+        MovimentacaoInfo com eventos corporativos (case-insensitive) e flags
+        usadas por `is_real_operation` (case-sensitive)
+    """
+    events = tuple(
+        event_type for event_type, pattern in CORPORATE_EVENT_PATTERNS
+        if pattern.search(movimentacao)
+    )
+    text = movimentacao.strip()
+    return MovimentacaoInfo(
+        events=events,
+        is_update='Atualização' in text or 'Atualizacao' in text,
+        is_income='Rendimento' in text,
+        is_bonus='Bonificação' in text or 'Bonificacao' in text,
+        is_split='Desdobro' in text,
+        is_transfer=any(x in text for x in ['Transferência', 'Transferencia', 'Subscri']),
+    )
+
 def is_real_operation(row: pd.Series) -> bool:
     """
     Determina se um registro do arquivo de movimentação é uma operação real
@@ -43,28 +97,28 @@ def is_real_operation(row: pd.Series) -> bool:
         True se é operação real (deve ser importada)
         False se é snapshot/informativo (deve ser ignorado)
     """
-    movimentacao = str(row.get('Movimentação', '')).strip()
+    info = classify_movimentacao(str(row.get('Movimentação', '')))
     
     # Atualização de saldo = snapshot após evento corporativo
     # NÃO É OPERAÇÃO REAL, apenas registro informativo!
-    if 'Atualização' in movimentacao or 'Atualizacao' in movimentacao:
+    if info.is_update:
         return False
     
     # Rendimento de dividendos/JCP sem movimentação de quantidade
     # (apenas crédito em conta, não altera posição de ações)
-    if 'Rendimento' in movimentacao:
+    if info.is_income:
         quantidade = row.get('Quantidade', 0)
         if quantidade == 0 or pd.isna(quantidade):
             return False
     
     # Bonificação com quantidade > 0 É operação real (adiciona ações)
-    if 'Bonificação' in movimentacao or 'Bonificacao' in movimentacao:
+    if info.is_bonus:
         quantidade = row.get('Quantidade', 0)
         if quantidade > 0:
             return True
     
     # Desdobro é operação real
-    if 'Desdobro' in movimentacao:
+    if info.is_split:
         return True
     
     # Compra/Venda tradicionais (Credito/Debito)
@@ -73,7 +127,7 @@ def is_real_operation(row: pd.Series) -> bool:
         return True
     
     # Transferências e subscrições
-    if any(x in movimentacao for x in ['Transferência', 'Transferencia', 'Subscri']):
+    if info.is_transfer:
         return True
     
     # Default: se não identificou, não importar (seguro)
@@ -88,6 +142,11 @@ def detect_corporate_events(df: pd.DataFrame) -> list:
     - Desdobros (quantidade exata duplicada)
     - Atualizações de saldo
     - Leilões de fração
+    - Subscrições
+    
+    A coluna de movimentação é classificada em uma única passada sobre os
+    valores distintos (`classify_movimentacao`); os eventos são emitidos
+    agrupados por tipo, na ordem de CORPORATE_EVENT_PATTERNS.
     
     Args:
         df: DataFrame com dados do Excel B3
@@ -110,75 +169,56 @@ def detect_corporate_events(df: pd.DataFrame) -> list:
     
     logger.info(f"Detectando eventos corporativos em {len(df)} registros")
     
-    # 1. Detectar Bonificações
-    bonificacoes = df[df[movimentacao_col].str.contains('Bonificação', case=False, na=False)]
-    for idx, row in bonificacoes.iterrows():
-        ticker = row.get("Código de Negociação", "")
-        events.append({
-            "type": "BONIFICACAO",
-            "ticker": ticker,
-            "quantity": float(row.get("Quantidade", 0)),
-            "date": row.get("Data do Negócio", ""),
-            "description": f"Bonificação detectada: {row.get(movimentacao_col, '')}",
-            "original_row": idx
-        })
-    
-    # 2. Detectar Desdobros
-    desdobros = df[df[movimentacao_col].str.contains('Desdobro', case=False, na=False)]
-    for idx, row in desdobros.iterrows():
-        ticker = row.get("Código de Negociação", "")
-        events.append({
-            "type": "DESDOBRO",
-            "ticker": ticker,
-            "quantity": float(row.get("Quantidade", 0)),
-            "date": row.get("Data do Negócio", ""),
-            "description": f"Desdobro detectado: {row.get(movimentacao_col, '')}",
-            "original_row": idx
-        })
-    
-    # 3. Detectar Atualizações (eventos externos)
-    atualizacoes = df[df[movimentacao_col].str.contains('Atualização', case=False, na=False)]
-    for idx, row in atualizacoes.iterrows():
-        ticker = row.get("Código de Negociação", "")
-        events.append({
-            "type": "CORRECAO",
-            "ticker": ticker,
-            "quantity": float(row.get("Quantidade", 0)),
-            "date": row.get("Data do Negócio", ""),
-            "description": f"Atualização de saldo: {row.get(movimentacao_col, '')}",
-            "original_row": idx
-        })
-    
-    # 4. Detectar Leilões de Fração
-    leiloes = df[df[movimentacao_col].str.contains('Leilão de Fração', case=False, na=False)]
-    for idx, row in leiloes.iterrows():
-        ticker = row.get("Código de Negociação", "")
-        # Leilões são vendas, geralmente quantidade negativa
-        qty = float(row.get("Quantidade", 0))
-        events.append({
-            "type": "CORRECAO",  # Tratamos como correção pois não altera PM
-            "ticker": ticker,
-            "quantity": qty,
-            "date": row.get("Data do Negócio", ""),
-            "description": f"Leilão de fração: venda de {abs(qty)} fracionárias",
-            "original_row": idx,
-            "skip": True  # Flag para não criar ajuste (já é operação normal)
-        })
-    
-    # 5. Detectar Subscrições
-    subscricoes = df[df[movimentacao_col].str.contains('Direito de Subscrição|Subscrição', case=False, na=False)]
-    for idx, row in subscricoes.iterrows():
-        ticker = row.get("Código de Negociação", "")
-        events.append({
-            "type": "SUBSCRICAO",
-            "ticker": ticker,
-            "quantity": float(row.get("Quantidade", 0)),
-            "date": row.get("Data do Negócio", ""),
-            "description": f"Subscrição detectada: {row.get(movimentacao_col, '')}",
-            "original_row": idx
-        })
+    # Passada única: classificar cada texto distinto e mapear tipo -> textos
+    movimentacoes = df[movimentacao_col]
+    values_by_event = {event_type: [] for event_type, _ in CORPORATE_EVENT_PATTERNS}
+    for value in movimentacoes.dropna().unique():
+        if not isinstance(value, str):
+            continue
+        for event_type in classify_movimentacao(value).events:
+            values_by_event[event_type].append(value)
+    
+    counts = {}
+    for event_type, values in values_by_event.items():
+        if not values:
+            counts[event_type] = 0
+            continue
+        
+        matched = df[movimentacoes.isin(values)]
+        counts[event_type] = len(matched)
+        
+        for idx, row in zip(matched.index, matched.to_dict("records")):
+            movimentacao = row.get(movimentacao_col, '')
+            qty = float(row.get("Quantidade", 0))
+            
+            if event_type == "BONIFICACAO":
+                kind, description = "BONIFICACAO", f"Bonificação detectada: {movimentacao}"
+            elif event_type == "DESDOBRO":
+                kind, description = "DESDOBRO", f"Desdobro detectado: {movimentacao}"
+            elif event_type == "ATUALIZACAO":
+                # Atualizações (eventos externos)
+                kind, description = "CORRECAO", f"Atualização de saldo: {movimentacao}"
+            elif event_type == "LEILAO_FRACAO":
+                # Leilões são vendas, geralmente quantidade negativa.
+                # Tratamos como correção pois não altera PM
+                kind, description = "CORRECAO", f"Leilão de fração: venda de {abs(qty)} fracionárias"
+            else:
+                kind, description = "SUBSCRICAO", f"Subscrição detectada: {movimentacao}"
+            
+            event = {
+                "type": kind,
+                "ticker": row.get("Código de Negociação", ""),
+                "quantity": qty,
+                "date": row.get("Data do Negócio", ""),
+                "description": description,
+                "original_row": idx
+            }
+            if event_type == "LEILAO_FRACAO":
+                event["skip"] = True  # Flag para não criar ajuste (já é operação normal)
+            
+            events.append(event)
     
-    logger.info(f"Eventos detectados: {len(events)} ({len(bonificacoes)} bonificações, {len(desdobros)} desdobros, {len(atualizacoes)} atualizações)")
+    logger.info(f"Eventos detectados: {len(events)} ({counts['BONIFICACAO']} bonificações, {counts['DESDOBRO']} desdobros, {counts['ATUALIZACAO']} atualizações)")
     
     return events
 
@@ -286,16 +326,214 @@ def classify_asset(ticker: str, product_name: str = None) -> tuple[str, str]:
     # Padrão: ação ordinária
     return ("AÇÕES", "ON")
 
-def import_b3_excel(file):
-    logger.info(f"Iniciando importação de arquivo B3: {file.filename}")
+# Colunas usadas na importação (demais colunas do arquivo são ignoradas)
+B3_KNOWN_COLUMNS = list(dict.fromkeys(
+    REQUIRED_COLUMNS + MOVIMENTACAO_COLUMNS + ["Entrada/Saída"]
+))
+
+# Colunas numéricas: no CSV são lidas como texto e convertidas explicitamente
+# para aceitar vírgula decimal e o traço ("-") usado pela B3 para "sem valor"
+B3_NUMERIC_COLUMNS = ["Quantidade", "Preço", "Valor", "Preço unitário", "Valor da Operação"]
+
+CSV_CHUNK_ROWS = 50_000
+
+FORMAT_LABELS = {"excel": "Excel", "csv": "CSV", "parquet": "Parquet"}
+
+def detect_file_format(file) -> str:
+    """
+    Detecta o formato do arquivo enviado: "excel", "csv" ou "parquet".
+    
+    Usa a assinatura binária (PAR1, ZIP/XLSX, OLE/XLS) e, na falta dela,
+    a extensão do nome do arquivo.
+    """
+    head = file.file.read(8)
+    file.file.seek(0)
+    
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    if head.startswith(b"PK") or head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "excel"
+    
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext in (".csv", ".txt"):
+        return "csv"
+    if ext == ".parquet":
+        return "parquet"
+    return "excel"
+
+# Marca decimal evidente em um valor numérico: as duas marcas (a última é a
+# decimal), marca repetida (é a de milhar) ou marca seguida de 1-2 ou 4+
+# dígitos (não é agrupamento de milhar). "1.000" e "1,000" são ambíguos.
+DECIMAL_EVIDENCE = {
+    ",": r"\..*,|\..*\.|,(?:\d{1,2}|\d{4,})$",
+    ".": r",.*\.|,.*,|\.(?:\d{1,2}|\d{4,})$",
+}
+
+NUMBER_PATTERNS = {
+    ",": re.compile(r"^[-+]?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?$"),
+    ".": re.compile(r"^[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?$"),
+}
+
+def _infer_decimal_mark(columns: List[pd.Series]) -> Optional[str]:
+    """
+    Infere a marca decimal ("," ou ".") pelos valores das colunas numéricas.
+    
+    Returns:
+        A marca, ou None se nenhum valor a evidencia (ex.: só inteiros)
+    
+    Raises:
+        ValueError: valores com marcas decimais diferentes no mesmo arquivo
+    """
+    found = {}
+    for values in columns:
+        text = values.dropna().str.strip()
+        for mark, pattern in DECIMAL_EVIDENCE.items():
+            matches = text[text.str.contains(pattern, regex=True)]
+            if not matches.empty:
+                found.setdefault(mark, matches.iloc[0])
+    if len(found) > 1:
+        raise ValueError(
+            f"Números com vírgula e com ponto decimal no mesmo arquivo "
+            f"(ex.: {found[',']!r} e {found['.']!r})"
+        )
+    return next(iter(found), None)
+
+def _parse_number_column(values: pd.Series, decimal: str, column: str = "") -> pd.Series:
+    """
+    Converte coluna numérica lida como texto. Mantém "-" (sem valor) como
+    está, igual ao que o Excel entrega; célula vazia vira NaN.
+    
+    Raises:
+        ValueError: valor que não é número no formato da marca decimal
+    """
+    text = values.str.strip()
+    filled = text.notna() & (text != "-")
+    invalid = text[filled & ~text.str.match(NUMBER_PATTERNS[decimal]).fillna(False).astype(bool)]
+    if not invalid.empty:
+        examples = ", ".join(repr(v) for v in invalid.unique()[:3])
+        raise ValueError(
+            f"Coluna '{column}': {len(invalid)} valor(es) não numérico(s) com "
+            f"decimal '{decimal}' (ex.: {examples})"
+        )
+    
+    thousands = "." if decimal == "," else ","
+    text = text.str.replace(thousands, "", regex=False)
+    if decimal == ",":
+        text = text.str.replace(",", ".", regex=False)
+    numbers = pd.to_numeric(text.where(filled), errors="coerce")
+    if (text == "-").any():
+        return numbers.astype(object).where(text != "-", "-")
+    return numbers
+
+def _read_b3_csv(stream, decimal: Optional[str] = None) -> pd.DataFrame:
+    """
+    Lê CSV B3 em blocos (streaming), com todas as colunas como texto e
+    conversão explícita das colunas numéricas.
+    
+    Detecta codificação (UTF-8 ou Latin-1) e separador (; , ou tab). A marca
+    decimal, se não informada, é inferida dos valores; sem evidência (só
+    inteiros ou milhares ambíguos como "1.000"), vale vírgula com separador
+    ';' (padrão pt-BR) e ponto nos demais.
+    
+    Raises:
+        ValueError: marcas decimais misturadas ou valores não numéricos
+    """
+    sample = stream.read(64 * 1024)
+    stream.seek(0)
+    
+    try:
+        sample.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Corte no meio de um caractere multibyte no fim da amostra é aceitável
+        encoding = "utf-8-sig" if e.start >= len(sample) - 3 else "latin-1"
+    
+    first_line = sample.decode(encoding, errors="ignore").splitlines()[0] if sample else ""
+    sep = max([";", ",", "\t"], key=first_line.count)
+    default_decimal = "," if sep == ";" else "."
+    
+    chunks = []
+    reader = pd.read_csv(
+        stream,
+        sep=sep,
+        encoding=encoding,
+        dtype=str,
+        chunksize=CSV_CHUNK_ROWS,
+    )
+    for chunk in reader:
+        chunk.columns = [c.strip() for c in chunk.columns]
+        numeric = [col for col in B3_NUMERIC_COLUMNS if col in chunk.columns]
+        inferred = _infer_decimal_mark([chunk[col] for col in numeric])
+        if decimal and inferred and inferred != decimal:
+            raise ValueError(f"Números com decimal '{inferred}' após linhas com decimal '{decimal}'")
+        decimal = decimal or inferred
+        chunks.append(chunk)
+    
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True)
+    
+    # Conversão após ler todos os blocos: a marca decimal pode só aparecer
+    # em um bloco posterior
+    for col in B3_NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = _parse_number_column(df[col], decimal or default_decimal, col)
+    return df
+
+def _read_b3_parquet(stream, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Lê Parquet B3. Com `columns`, carrega apenas essas colunas (leitura
+    colunar). Colunas numéricas gravadas como texto (ex.: "-") são
+    convertidas como no CSV.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Leitura de arquivos Parquet requer o pacote 'pyarrow'")
+    
+    parquet_file = pq.ParquetFile(stream)
+    if columns is not None:
+        columns = [c for c in parquet_file.schema_arrow.names if c in columns]
+    df = parquet_file.read(columns=columns).to_pandas()
+    
+    for col in B3_NUMERIC_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = _parse_number_column(df[col].where(df[col].isna(), df[col].astype(str)), ".", col)
+    return df
+
+def read_b3_file(file, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Lê o arquivo enviado (UploadFile) e retorna o DataFrame bruto.
+    
+    Formatos aceitos (detectados automaticamente): Excel (.xlsx/.xls),
+    CSV e Parquet. Todos alimentam a mesma validação e normalização.
+    
+    Args:
+        columns: Colunas necessárias; permite ao Parquet ler só essas
+    """
+    file_format = detect_file_format(file)
     
     try:
-        df = pd.read_excel(file.file)
-        logger.debug(f"Arquivo lido com sucesso: {len(df)} linhas")
+        if file_format == "csv":
+            df = _read_b3_csv(file.file)
+        elif file_format == "parquet":
+            df = _read_b3_parquet(file.file, columns)
+        else:
+            df = pd.read_excel(file.file)
+        logger.debug(f"Arquivo {file_format} lido com sucesso: {len(df)} linhas")
     except Exception as e:
-        logger.error(f"Erro ao ler arquivo Excel: {e}")
-        raise ValueError(f"Arquivo Excel inválido: {e}")
+        logger.error(f"Erro ao ler arquivo {file_format}: {e}")
+        raise ValueError(f"Arquivo {FORMAT_LABELS[file_format]} inválido: {e}")
+    return df
 
+def _normalize_b3_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Valida e normaliza um DataFrame B3 (Negociação ou Movimentação) para o
+    formato padrão de colunas usado na importação.
+    
+    Raises:
+        ValueError: Se o arquivo não for reconhecido ou faltarem colunas
+    """
     # 1. Detectar tipo de arquivo e normalizar colunas
     is_movimentacao = "Movimentação" in df.columns
     is_negociacao = "Data do Negócio" in df.columns
@@ -376,10 +614,42 @@ def import_b3_excel(file):
     ).dt.date.astype(str)
     logger.debug("Normalização de datas: OK")
 
+
+    return df
+
+def _build_ticker_map(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    Cria mapeamento ticker_original -> ticker_normalizado (fracionário -> à vista).
+    
+    Considera apenas os pares (ticker, mercado) distintos do arquivo.
+    """
+    pairs = df[["Código de Negociação", "Mercado"]].drop_duplicates(keep="last")
+    ticker_map = {}
+    for ticker_raw, market in pairs.itertuples(index=False, name=None):
+        ticker_map[ticker_raw] = normalize_ticker(ticker_raw, market)
+    return ticker_map
+
+def import_b3_excel(file):
+    """
+    Importa arquivo B3 (Negociação ou Movimentação) de forma idempotente.
+    
+    Além dos contadores, o resumo informa os ativos que tiveram operações
+    inseridas (`affected_asset_ids`) e a menor trade_date inserida
+    (`affected_since`), para que posições e cotações sejam recalculadas
+    apenas onde necessário.
+    """
+    logger.info(f"Iniciando importação de arquivo B3: {file.filename}")
+    
+    df = _normalize_b3_dataframe(read_b3_file(file, B3_KNOWN_COLUMNS))
+
     inserted = 0
     duplicated = 0
     assets_created = set()
     
+    # Ativos afetados pela importação (para recálculo incremental downstream)
+    affected_asset_ids = set()
+    affected_since = None
+    
     # Cache de ativos para evitar múltiplas consultas
     asset_cache = {}
     
@@ -389,17 +659,11 @@ def import_b3_excel(file):
         # Primeiro passo: criar todos os ativos únicos necessários
         # IMPORTANTE: normalizar tickers antes de processar
         unique_tickers_raw = df["Código de Negociação"].unique()
-        unique_tickers_normalized = set()
-        
+
         # Criar mapeamento ticker_original -> ticker_normalizado
-        ticker_normalization_map = {}
-        for idx, row in df.iterrows():
-            ticker_raw = row["Código de Negociação"]
-            market = row["Mercado"]
-            ticker_normalized = normalize_ticker(ticker_raw, market)
-            ticker_normalization_map[ticker_raw] = ticker_normalized
-            unique_tickers_normalized.add(ticker_normalized)
-        
+        ticker_normalization_map = _build_ticker_map(df)
+        unique_tickers_normalized = set(ticker_normalization_map.values())
+
         logger.info(f"Tickers únicos (antes normalização): {len(unique_tickers_raw)}")
         logger.info(f"Tickers únicos (após normalização): {len(unique_tickers_normalized)}")
         
@@ -475,6 +739,10 @@ def import_b3_excel(file):
                 ))
 
                 inserted += 1
+                affected_asset_ids.add(asset_id)
+                trade_date = row["Data do Negócio"]
+                if affected_since is None or trade_date < affected_since:
+                    affected_since = trade_date
 
             except sqlite3.IntegrityError:
                 # Violação de UNIQUE → duplicata identificada
@@ -501,5 +769,173 @@ def import_b3_excel(file):
         "unique_assets": int(df["Código de Negociação"].nunique()),
         "imported_at": datetime.utcnow().isoformat(),
         "corporate_events": corporate_events,
-        "events_detected": len(corporate_events)
+        "events_detected": len(corporate_events),
+        "affected_asset_ids": sorted(affected_asset_ids),
+        "affected_since": affected_since
+    }
+
+
+PREVIEW_STATUSES = ("new", "duplicate", "non_operation")
+
+def _json_value(value):
+    """Converte valores do pandas/numpy (NaN, int64...) para tipos serializáveis."""
+    if value is None:
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+def _operation_key(ticker: str, row: dict) -> Optional[tuple]:
+    """
+    Monta a chave lógica de deduplicação de uma linha normalizada.
+    
+    Espelha a constraint UNIQUE de `operations` (source = 'B3').
+    Retorna None se mercado/instituição forem nulos: no SQLite, NULL nunca
+    colide em UNIQUE, então a linha sempre seria inserida.
+    """
+    market = row["Mercado"]
+    institution = row["Instituição"]
+    if market is None or institution is None or pd.isna(market) or pd.isna(institution):
+        return None
+    return (
+        ticker,
+        row["Data do Negócio"],
+        str(row["Tipo de Movimentação"]).upper(),
+        market,
+        institution,
+        int(row["Quantidade"]),
+        float(row["Preço"]),
+    )
+
+def preview_b3_import(file, page: int = 1, page_size: int = 100, status: Optional[str] = None) -> Dict:
+    """
+    Simula a importação de um arquivo B3 sem gravar nada no banco (dry-run).
+    
+    Carrega as chaves de operações existentes dos tickers afetados, dentro do
+    intervalo de datas do arquivo, em uma única consulta e classifica cada
+    linha em memória:
+    - new: seria inserida
+    - duplicate: já existe no banco (ou repetida no próprio arquivo)
+    - non_operation: Atualização/Rendimento etc., seria ignorada
+    
+    Args:
+        file: UploadFile com arquivo B3
+        page: Página do detalhamento (1-based)
+        page_size: Linhas por página
+        status: Filtra o detalhamento por status (new, duplicate, non_operation)
+    
+    Returns:
+        Dicionário com resumo, ativos que seriam criados e detalhamento paginado
+    """
+    logger.info(f"Pré-visualizando importação de arquivo B3: {file.filename}")
+    
+    if status is not None and status not in PREVIEW_STATUSES:
+        raise ValueError(f"Status inválido: {status}. Use um de {list(PREVIEW_STATUSES)}")
+    if page < 1 or page_size < 1:
+        raise ValueError("page e page_size devem ser maiores que zero")
+    
+    df = _normalize_b3_dataframe(read_b3_file(file, B3_KNOWN_COLUMNS))
+    
+    ticker_map = _build_ticker_map(df)
+    tickers = sorted(set(ticker_map.values()))
+    dates = df["Data do Negócio"]
+    date_min, date_max = (dates.min(), dates.max()) if len(df) else (None, None)
+    
+    existing_assets = set()
+    existing_keys = set()
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        for chunk in chunked(tickers):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(
+                f"SELECT ticker FROM assets WHERE ticker IN ({placeholders})",
+                chunk
+            )
+            existing_assets.update(r[0] for r in cursor.fetchall())
+        
+        # Uma única consulta por bloco de tickers: chaves existentes no intervalo
+        for chunk in chunked(sorted(existing_assets)):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"""
+                SELECT a.ticker, o.trade_date, o.movement_type, o.market,
+                       o.institution, o.quantity, o.price
+                FROM operations o
+                INNER JOIN assets a ON a.id = o.asset_id
+                WHERE a.ticker IN ({placeholders})
+                  AND o.source = 'B3'
+                  AND o.trade_date BETWEEN ? AND ?
+            """, (*chunk, date_min, date_max))
+            existing_keys.update(
+                (t, d, m, mk, inst, int(q), float(p))
+                for t, d, m, mk, inst, q, p in cursor.fetchall()
+            )
+    
+    logger.debug(f"Preview: {len(existing_keys)} chaves existentes carregadas para {len(existing_assets)} ativos")
+    
+    counts = {s: 0 for s in PREVIEW_STATUSES}
+    detail = []
+    seen_keys = set(existing_keys)
+    
+    for idx, row in zip(df.index, df.to_dict("records")):
+        ticker_raw = row["Código de Negociação"]
+        ticker = ticker_map.get(ticker_raw, ticker_raw)
+        
+        if not is_real_operation(row):
+            row_status = "non_operation"
+        else:
+            key = _operation_key(ticker, row)
+            if key is not None and key in seen_keys:
+                row_status = "duplicate"
+            else:
+                row_status = "new"
+                if key is not None:
+                    seen_keys.add(key)
+        
+        counts[row_status] += 1
+        if status is None or row_status == status:
+            detail.append((idx, ticker_raw, ticker, row, row_status))
+    
+    assets_to_create = [t for t in tickers if t not in existing_assets]
+    
+    total_pages = max(1, math.ceil(len(detail) / page_size))
+    offset = (page - 1) * page_size
+    rows = [
+        {
+            "row": int(idx),
+            "ticker": ticker,
+            "ticker_original": _json_value(ticker_raw),
+            "trade_date": row["Data do Negócio"],
+            "movement_type": str(row["Tipo de Movimentação"]).upper(),
+            "market": _json_value(row["Mercado"]),
+            "institution": _json_value(row["Instituição"]),
+            "quantity": _json_value(row["Quantidade"]),
+            "price": _json_value(row["Preço"]),
+            "value": _json_value(row["Valor"]),
+            "status": row_status,
+        }
+        for idx, ticker_raw, ticker, row, row_status in detail[offset:offset + page_size]
+    ]
+    
+    logger.info(f"Preview concluído: {counts['new']} novas, {counts['duplicate']} duplicadas, {counts['non_operation']} não-operações, {len(assets_to_create)} ativos a criar")
+    
+    return {
+        "total_rows": len(df),
+        "summary": {
+            "new": counts["new"],
+            "duplicated": counts["duplicate"],
+            "skipped_non_operations": counts["non_operation"],
+            "assets_to_create": len(assets_to_create),
+            "unique_assets": len(tickers),
+            "date_range": {"start": date_min, "end": date_max},
+        },
+        "assets_to_create": assets_to_create,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": total_pages,
+        "total_filtered": len(detail),
+        "rows": rows,
     }
@@ -0,0 +1,86 @@
+"""
+Coordenação entre processos (workers do uvicorn) via concessões no SQLite.
+
+- LeaderLease: liderança com validade; só o líder executa tarefas que não
+  devem rodar em paralelo (ex.: agendador de cotações). O líder renova a
+  concessão periodicamente; se o processo morrer, outro assume após o TTL.
+- claim/release_claims: reserva de itens (ex.: tickers em atualização) para
+  que dois workers não busquem o mesmo dado ao mesmo tempo.
+"""
+
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from app.db.database import get_db
+from app.repositories import leases_repository
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SECONDS = float(os.getenv("QUOTES_LEASE_TTL_SECONDS", "60"))
+
+_TOKEN = uuid.uuid4().hex[:8]
+
+
+def process_id() -> str:
+    """Identifica o processo atual (o pid muda em processos filhos)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_TOKEN}"
+
+
+def claim(names: Iterable[str], ttl_seconds: float = LEASE_TTL_SECONDS) -> List[str]:
+    """Reserva os itens livres para este processo; retorna os reservados."""
+    names = list(names)
+    if not names:
+        return []
+    with get_db() as conn:
+        return leases_repository.acquire(conn.cursor(), names, process_id(), ttl_seconds, time.time())
+
+
+def release_claims(names: Iterable[str]) -> None:
+    names = list(names)
+    if names:
+        with get_db() as conn:
+            leases_repository.release(conn.cursor(), names, process_id())
+
+
+class LeaderLease:
+    def __init__(self, name: str, ttl_seconds: float = LEASE_TTL_SECONDS):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._expires_at = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        return time.time() < self._expires_at
+
+    def acquire(self) -> bool:
+        """Adquire ou renova a liderança; False se outro processo a detém."""
+        try:
+            now = time.time()
+            acquired = bool(claim([self.name], self.ttl_seconds))
+        except Exception as e:
+            logger.error(f"Erro ao adquirir liderança '{self.name}': {e}")
+            return self.is_leader
+        if acquired and not self.is_leader:
+            logger.info(f"👑 Liderança '{self.name}' adquirida por {process_id()}")
+        self._expires_at = now + self.ttl_seconds if acquired else 0.0
+        return acquired
+
+    def release(self) -> None:
+        if self._expires_at:
+            release_claims([self.name])
+            self._expires_at = 0.0
+
+    def status(self) -> Dict:
+        with get_db() as conn:
+            lease = leases_repository.get_lease(conn.cursor(), self.name)
+        active = lease is not None and lease["expires_at"] > time.time()
+        return {
+            "is_leader": self.is_leader,
+            "leader": lease["holder"] if active else None,
+            "leader_expires_at": datetime.fromtimestamp(lease["expires_at"]).isoformat() if active else None
+        }
@@ -0,0 +1,139 @@
+"""
+Calendário de pregões da B3.
+
+- Feriados nacionais fixos, feriados móveis (Carnaval, Sexta-feira Santa,
+  Corpus Christi) e dias sem pregão (24/12 e 31/12)
+- Horário da sessão regular (horário de Brasília); Quarta-feira de Cinzas
+  abre às 13h
+- Validade de cotações: durante o pregão vale o TTL; cotação obtida com o
+  mercado fechado vale até a próxima abertura
+"""
+
+import logging
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from zoneinfo import ZoneInfo
+    B3_TZ = ZoneInfo("America/Sao_Paulo")
+except Exception:
+    # Sem base de fusos (tzdata): Brasília sem horário de verão desde 2019
+    B3_TZ = timezone(timedelta(hours=-3))
+
+SESSION_OPEN = time.fromisoformat(os.getenv("B3_SESSION_OPEN", "10:00"))
+SESSION_CLOSE = time.fromisoformat(os.getenv("B3_SESSION_CLOSE", "18:00"))
+ASH_WEDNESDAY_OPEN = time(13, 0)
+
+# (mês, dia): Confraternização, Tiradentes, Trabalho, Independência,
+# Aparecida, Finados, República, Consciência Negra, Natal
+FIXED_HOLIDAYS = [(1, 1), (4, 21), (5, 1), (9, 7), (10, 12), (11, 2), (11, 15), (11, 20), (12, 25)]
+# Sem pregão: véspera de Natal e último dia do ano
+NO_SESSION_DAYS = [(12, 24), (12, 31)]
+# Consciência Negra passou a ser feriado nacional em 2024
+BLACK_CONSCIOUSNESS_SINCE = 2024
+
+
+def easter(year: int) -> date:
+    """Domingo de Páscoa (algoritmo gregoriano anônimo)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=64)
+def b3_holidays(year: int) -> Set[date]:
+    """Dias úteis sem pregão na B3 no ano."""
+    fixed = [
+        (month, day) for month, day in FIXED_HOLIDAYS
+        if (month, day) != (11, 20) or year >= BLACK_CONSCIOUSNESS_SINCE
+    ]
+    holidays = {date(year, month, day) for month, day in fixed + NO_SESSION_DAYS}
+    sunday = easter(year)
+    holidays.update({
+        sunday - timedelta(days=48),  # Carnaval (segunda)
+        sunday - timedelta(days=47),  # Carnaval (terça)
+        sunday - timedelta(days=2),   # Sexta-feira Santa
+        sunday + timedelta(days=60),  # Corpus Christi
+    })
+    return holidays
+
+
+class B3Calendar:
+    """Sessões de pregão da B3 (datas/horas em B3_TZ)."""
+
+    def __init__(self, session_open: time = SESSION_OPEN, session_close: time = SESSION_CLOSE):
+        self.session_open = session_open
+        self.session_close = session_close
+
+    def now(self) -> datetime:
+        return datetime.now(B3_TZ)
+
+    def _local(self, moment: datetime) -> datetime:
+        # Datas sem fuso são tratadas como horário local do servidor
+        return moment.astimezone(B3_TZ)
+
+    def is_trading_day(self, day: date) -> bool:
+        return day.weekday() < 5 and day not in b3_holidays(day.year)
+
+    def session(self, day: date) -> Optional[Tuple[datetime, datetime]]:
+        """(abertura, fechamento) do pregão do dia, ou None se não houver."""
+        if not self.is_trading_day(day):
+            return None
+        opens = self.session_open
+        if day == easter(day.year) - timedelta(days=46):
+            opens = max(opens, ASH_WEDNESDAY_OPEN)
+        return (
+            datetime.combine(day, opens, tzinfo=B3_TZ),
+            datetime.combine(day, self.session_close, tzinfo=B3_TZ),
+        )
+
+    def is_open(self, moment: Optional[datetime] = None) -> bool:
+        moment = self._local(moment or self.now())
+        session = self.session(moment.date())
+        return session is not None and session[0] <= moment < session[1]
+
+    def next_open(self, moment: Optional[datetime] = None) -> datetime:
+        """Próxima abertura estritamente após `moment`."""
+        moment = self._local(moment or self.now())
+        day = moment.date()
+        for _ in range(30):
+            session = self.session(day)
+            if session and session[0] > moment:
+                return session[0]
+            day += timedelta(days=1)
+        raise RuntimeError(f"Nenhum pregão nos 30 dias após {moment.date()}")
+
+    def last_close(self, moment: Optional[datetime] = None) -> datetime:
+        """Último fechamento em ou antes de `moment`."""
+        moment = self._local(moment or self.now())
+        day = moment.date()
+        for _ in range(30):
+            session = self.session(day)
+            if session and session[1] <= moment:
+                return session[1]
+            day -= timedelta(days=1)
+        raise RuntimeError(f"Nenhum pregão nos 30 dias antes de {moment.date()}")
+
+    def quote_expiry(self, fetched_at: datetime, ttl: timedelta) -> datetime:
+        """
+        Até quando uma cotação obtida em `fetched_at` é considerada válida.
+
+        Com o pregão aberto, vale o TTL. Com o mercado fechado a cotação não
+        muda: vale até a próxima abertura.
+        """
+        fetched_at = self._local(fetched_at)
+        if self.is_open(fetched_at):
+            return fetched_at + ttl
+        return self.next_open(fetched_at)
@@ -1,72 +1,226 @@
 """
-Serviço de cotações de mercado usando yfinance.
+Serviço de cotações de mercado (Yahoo Finance ou outro provedor configurado).
 
 Responsável por buscar cotações em tempo quase real da B3,
 com cache persistente (banco de dados) para evitar requisições excessivas.
 """
 
-import yfinance as yf
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 from app.repositories import quotes_repository
+from app.services.circuit_breaker import OPEN, CircuitBreaker
+from app.services.leases import claim, release_claims
+from app.services.market_calendar import B3Calendar
+from app.services.quote_cache import NegativeCache, QuoteCache
+from app.services.quote_providers import QuoteProvider, build_quote_provider
+
+logger = logging.getLogger(__name__)
+
+# Máximo de tickers no cache em memória
+CACHE_MAX_SIZE = int(os.getenv("QUOTES_CACHE_MAX_SIZE", "1000"))
+
+# Intervalo mínimo (s) entre sincronizações com o cache compartilhado (banco)
+SHARED_SYNC_SECONDS = float(os.getenv("QUOTES_SHARED_SYNC_SECONDS", "1"))
+
+# Validade (s) da reserva de um ticker em atualização por um worker
+REFRESH_CLAIM_SECONDS = float(os.getenv("QUOTES_REFRESH_CLAIM_SECONDS", "60"))
+
+# Tickers sem cotação no provedor: espera inicial e máxima até nova tentativa
+NEGATIVE_TTL_SECONDS = float(os.getenv("QUOTES_NEGATIVE_TTL_SECONDS", "300"))
+NEGATIVE_TTL_MAX_SECONDS = float(os.getenv("QUOTES_NEGATIVE_TTL_MAX_SECONDS", "86400"))
+
+# Circuit breaker do provedor: falhas seguidas para abrir e tempo aberto (s)
+BREAKER_FAILURES = int(os.getenv("QUOTES_BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("QUOTES_BREAKER_RESET_SECONDS", "60"))
+
+# Formato de código de negociação da B3 (PETR4, BOVA11, AAPL34, B3SA3)
+LISTED_TICKER = re.compile(r"^[A-Z][A-Z0-9]{3}\d{1,2}$")
+
+
+def is_quotable(ticker: str) -> bool:
+    """True se o ticker tem formato de código negociado na B3."""
+    return bool(LISTED_TICKER.match(ticker))
 
 
 class MarketDataService:
     """
-    Serviço para buscar cotações de ativos da B3 usando Yahoo Finance.
+    Serviço para buscar cotações de ativos da B3.
+    
+    Cache: 15 minutos durante o pregão (delay típico do Yahoo Finance para
+    dados gratuitos); com o mercado fechado, até a próxima abertura (B3Calendar)
+    
+    As cotações vêm de um QuoteProvider (padrão definido por configuração,
+    ver build_quote_provider): Yahoo Finance em lote, arquivo local ou uma
+    cadeia de fallback entre eles.
+    
+    O cache em memória (QuoteCache) é limitado, thread-safe e coalesce
+    buscas concorrentes do mesmo ticker em uma só.
+    
+    Leituras de endpoints usam `read_quotes` (stale-while-revalidate): memória,
+    depois banco; cotações vencidas são servidas na hora, marcadas com
+    `stale`/`age_seconds`, e revalidadas em background (uma vez por ticker).
+    O provedor só é chamado na requisição se o chamador pedir (allow_fetch).
+    
+    Com vários workers, a tabela quotes é o cache compartilhado: cada worker
+    traz para a memória as cotações gravadas pelos outros (contador de
+    versão, ver `_sync_shared_cache`) e, na revalidação, reserva os tickers
+    no banco para que só um worker consulte o provedor por ticker.
     
-    Cache: 15 minutos (delay típico do Yahoo Finance para dados gratuitos)
+    Proteções contra buscas inúteis: tickers fora do formato da B3 não são
+    consultados; tickers sem cotação ficam em um cache negativo com espera
+    exponencial; e um circuit breaker recusa buscas na hora enquanto o
+    provedor está fora do ar.
     """
     
-    def __init__(self, cache_ttl_minutes: int = 15):
-        self._cache: Dict[str, Dict] = {}
+    def __init__(
+        self,
+        cache_ttl_minutes: int = 15,
+        provider: Optional[QuoteProvider] = None,
+        calendar: Optional[B3Calendar] = None,
+        breaker: Optional[CircuitBreaker] = None
+    ):
         self._cache_ttl = timedelta(minutes=cache_ttl_minutes)
+        self.calendar = calendar or B3Calendar()
+        self._cache = QuoteCache(self._cache_ttl, maxsize=CACHE_MAX_SIZE, ttl_for=self._remaining_validity)
+        self.provider = provider or build_quote_provider()
+        self.breaker = breaker or CircuitBreaker(self.provider.name, BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+        self._negative = NegativeCache(
+            timedelta(seconds=NEGATIVE_TTL_SECONDS), timedelta(seconds=NEGATIVE_TTL_MAX_SECONDS)
+        )
+        self._revalidating: set = set()
+        self._revalidating_lock = threading.Lock()
+        self._revalidation_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quotes-revalidate")
+        self.shared_sync_seconds = SHARED_SYNC_SECONDS
+        self._shared_version = 0
+        self._shared_synced_at = float('-inf')
+        self._shared_lock = threading.Lock()
     
-    def _is_cache_valid(self, ticker: str) -> bool:
-        """Verifica se o cache em memória está válido para o ticker."""
-        if ticker not in self._cache:
-            return False
-        
-        cached_time = self._cache[ticker].get('cached_at')
-        if not cached_time:
-            return False
-        
-        return datetime.now() - cached_time < self._cache_ttl
+    def _updated_at(self, quote: Dict) -> Optional[datetime]:
+        try:
+            return datetime.fromisoformat(quote['updated_at'])
+        except (KeyError, ValueError, TypeError):
+            return None
+    
+    def _quote_age(self, quote: Dict) -> Optional[float]:
+        """Idade da cotação em segundos (None se updated_at ausente/inválido)."""
+        updated_at = self._updated_at(quote)
+        if updated_at is None:
+            return None
+        return (datetime.now(updated_at.tzinfo) - updated_at).total_seconds()
+    
+    def _remaining_validity(self, quote: Dict) -> timedelta:
+        """Tempo até a cotação vencer (TTL no pregão; próxima abertura fora dele)."""
+        updated_at = self._updated_at(quote)
+        if updated_at is None:
+            return timedelta(0)
+        expiry = self.calendar.quote_expiry(updated_at, self._cache_ttl)
+        return max(expiry - self.calendar.now(), timedelta(0))
     
     def _is_db_cache_valid(self, quote: Dict) -> bool:
         """Verifica se o cache do banco de dados está válido."""
-        if not quote or 'updated_at' not in quote:
-            return False
+        return bool(quote) and self._remaining_validity(quote) > timedelta(0)
+    
+    def _with_staleness(self, quote: Optional[Dict]) -> Optional[Dict]:
+        """Cópia da cotação com age_seconds e stale."""
+        if quote is None:
+            return None
+        age = self._quote_age(quote)
+        return {
+            **quote,
+            'age_seconds': round(age, 1) if age is not None else None,
+            'stale': not self._is_db_cache_valid(quote)
+        }
+    
+    def _sync_shared_cache(self) -> None:
+        """
+        Traz para a memória as cotações gravadas no banco desde a última
+        sincronização (inclusive por outros processos).
         
-        try:
-            updated_at = datetime.fromisoformat(quote['updated_at'])
-            return datetime.now() - updated_at < self._cache_ttl
-        except (ValueError, TypeError):
-            return False
+        A primeira sincronização aquece o cache com as cotações ainda válidas.
+        """
+        with self._shared_lock:
+            now = time.monotonic()
+            if now - self._shared_synced_at < self.shared_sync_seconds:
+                return
+            self._shared_synced_at = now
+            version, changed = quotes_repository.get_quotes_changed_since(self._shared_version)
+            self._shared_version = version
+        
+        for ticker, quote in changed.items():
+            if self._is_db_cache_valid(quote):
+                self._cache.set(ticker, quote)
     
-    def _normalize_ticker(self, ticker: str) -> str:
+    def _should_fetch(self, ticker: str) -> bool:
+        """Ticker negociado e fora do cache negativo."""
+        return is_quotable(ticker) and not self._negative.is_blocked(ticker)
+    
+    def _fetch_quotes(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
         """
-        Normaliza ticker para o formato do Yahoo Finance.
+        Busca cotações no provedor configurado.
+        
+        Salva as cotações obtidas no banco em uma única transação (o cache
+        em memória é preenchido por QuoteCache.get_or_load); os chamadores
+        não devem gravá-las de novo. Tickers respondidos sem cotação entram
+        no cache negativo; provedor sem resposta alguma conta para o circuit
+        breaker.
         
-        Exemplo: PETR4 -> PETR4.SA
+        Args:
+            tickers: Códigos sem sufixo (ex: PETR4)
+        
+        Returns:
+            Dicionário ticker -> cotação (None se indisponível)
         """
-        ticker = ticker.upper().strip()
-        if not ticker.endswith('.SA'):
-            ticker = f'{ticker}.SA'
-        return ticker
+        results = {ticker: None for ticker in tickers}
+        candidates = [ticker for ticker in tickers if self._should_fetch(ticker)]
+        if not candidates:
+            return results
+        
+        if not self.breaker.allow():
+            logger.debug(f"Circuito de {self.provider.name} aberto; {len(candidates)} cotações não buscadas")
+            return results
+        
+        try:
+            fetched = self.provider.fetch_many(candidates)
+        except Exception as e:
+            logger.error(f"Erro ao buscar cotações em {self.provider.name}: {str(e)}")
+            self.breaker.record_failure()
+            return results
+        
+        # Nenhum ticker respondido = provedor indisponível (não é culpa dos
+        # tickers); respondido sem cotação (None) é falta do ticker
+        if not fetched:
+            self.breaker.record_failure()
+            return results
+        self.breaker.record_success()
+        
+        for ticker, quote_data in fetched.items():
+            if quote_data is None:
+                wait = self._negative.record_miss(ticker)
+                logger.info(f"Sem cotação para {ticker} em {self.provider.name}; nova tentativa em {wait}")
+                continue
+            
+            self._negative.record_hit(ticker)
+            results[ticker] = quote_data
+        
+        # Cache persistente: única gravação de cada cotação obtida, em um commit
+        quotes_repository.save_quotes_bulk(results)
+        return results
     
     def get_quote(self, ticker: str, force_refresh: bool = False) -> Optional[Dict]:
         """
         Busca cotação de um ativo específico.
         
-        Estratégia:
-        1. Verificar cache em memória (se válido, retornar)
-        2. Verificar cache persistente no banco (se válido, retornar)
-        3. Buscar do yfinance e salvar no banco
+        Caso particular de `get_batch_quotes` com um único ticker.
         
         Args:
             ticker: Código do ativo (ex: PETR4, PETR4.SA)
-            force_refresh: Se True, força atualização do yfinance ignorando cache
+            force_refresh: Se True, força atualização no provedor ignorando cache
         
         Returns:
             Dict com dados da cotação ou None se não encontrado
@@ -86,96 +240,24 @@ class MarketDataService:
             'source': 'yfinance'
         }
         """
-        # Normalizar ticker
-        ticker_normalized = self._normalize_ticker(ticker)
-        original_ticker = ticker.upper().replace('.SA', '')
-        
-        # Se não forçar refresh, verificar cache em memória
-        if not force_refresh and self._is_cache_valid(original_ticker):
-            return self._cache[original_ticker]['data']
-        
-        # Verificar cache persistente (banco de dados)
-        if not force_refresh:
-            db_quote = quotes_repository.get_quote(original_ticker)
-            if db_quote and self._is_db_cache_valid(db_quote):
-                # Cachear em memória também
-                self._cache[original_ticker] = {
-                    'data': db_quote,
-                    'cached_at': datetime.now()
-                }
-                return db_quote
-        
-        try:
-            # Buscar dados do yfinance
-            stock = yf.Ticker(ticker_normalized)
-            hist = stock.history(period='1d')
-            
-            if hist.empty:
-                return None
-            
-            # Extrair dados do último pregão
-            last_row = hist.iloc[-1]
-            last_timestamp = hist.index[-1]
-            
-            # Validar dados essenciais
-            if not last_row['Close'] or last_row['Close'] == 0:
-                print(f"Cotação inválida para {ticker_normalized}: preço zero ou nulo")
-                return None
-            
-            # Calcular variação
-            previous_close = last_row['Close']
-            current_price = last_row['Close']
-            
-            # Tentar pegar previous_close do info (com tratamento de erro)
-            try:
-                info = stock.info
-                if info and 'previousClose' in info and info['previousClose']:
-                    previous_close = info['previousClose']
-                    change = current_price - previous_close
-                    change_percent = (change / previous_close) * 100
-                else:
-                    change = 0
-                    change_percent = 0
-            except Exception:
-                # Se falhar ao buscar info, usar valores padrão
-                change = 0
-                change_percent = 0
-            
-            quote_data = {
-                'ticker': original_ticker,
-                'price': round(float(current_price), 2),
-                'change': round(float(change), 2),
-                'change_percent': round(float(change_percent), 2),
-                'volume': int(last_row['Volume']),
-                'open': round(float(last_row['Open']), 2),
-                'high': round(float(last_row['High']), 2),
-                'low': round(float(last_row['Low']), 2),
-                'previous_close': round(float(previous_close), 2),
-                'updated_at': last_timestamp.isoformat(),
-                'source': 'yfinance'
-            }
-            
-            # Salvar no banco de dados (cache persistente)
-            quotes_repository.save_quote(original_ticker, quote_data)
-            
-            # Cachear em memória também
-            self._cache[original_ticker] = {
-                'data': quote_data,
-                'cached_at': datetime.now()
-            }
-            
-            return quote_data
-            
-        except Exception as e:
-            print(f"Erro ao buscar cotação de {ticker_normalized}: {str(e)}")
-            return None
+        original_ticker = ticker.upper().strip().replace('.SA', '')
+        return self.get_batch_quotes([ticker], force_refresh)[original_ticker]
     
-    def get_batch_quotes(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
+    def get_batch_quotes(self, tickers: List[str], force_refresh: bool = False) -> Dict[str, Optional[Dict]]:
         """
         Busca cotações de múltiplos ativos.
         
+        Estratégia:
+        1. Cache em memória (se válido)
+        2. Cache persistente no banco (uma consulta para todos os pendentes)
+        3. Provedor de cotações, em lote, para os que faltarem
+        
+        Tickers ausentes que já estão sendo buscados por outra requisição
+        aguardam essa busca (single-flight) em vez de repeti-la.
+        
         Args:
             tickers: Lista de códigos de ativos
+            force_refresh: Se True, busca todos no provedor ignorando cache
         
         Returns:
             Dicionário com ticker -> dados da cotação
@@ -187,32 +269,177 @@ class MarketDataService:
             'INVALID': None
         }
         """
+        keys = [ticker.upper().strip().replace('.SA', '') for ticker in tickers]
+        if force_refresh:
+            return self._cache.get_or_load(keys, self._fetch_quotes, refresh=True)
+        self._sync_shared_cache()
+        return self._cache.get_or_load(keys, self._load_quotes)
+    
+    def _load_quotes(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
+        """Carrega cotações ausentes do cache em memória: banco, depois provedor."""
         results = {}
-        
+        pending = []
+        db_quotes = quotes_repository.get_quotes(tickers)
         for ticker in tickers:
-            ticker_clean = ticker.upper().replace('.SA', '')
-            results[ticker_clean] = self.get_quote(ticker)
+            db_quote = db_quotes.get(ticker)
+            if db_quote and self._is_db_cache_valid(db_quote):
+                results[ticker] = db_quote
+            else:
+                pending.append(ticker)
+        
+        if pending:
+            logger.debug(f"Buscando {len(pending)} cotações em {self.provider.name}")
+            results.update(self._fetch_quotes(pending))
         
         return results
     
+    def read_quotes(self, tickers: List[str], allow_fetch: bool = False) -> Dict[str, Optional[Dict]]:
+        """
+        Leitura em camadas para endpoints (stale-while-revalidate).
+        
+        1. Memória (válida)
+        2. Banco: servida mesmo vencida; vencidas são revalidadas em background
+        3. Provedor: só com allow_fetch=True (tickers sem nenhuma cotação);
+           sem isso, o ticker fica None e é buscado em background
+        
+        Args:
+            tickers: Lista de códigos de ativos
+            allow_fetch: Permite chamada ao provedor na própria requisição
+        
+        Returns:
+            Dicionário ticker -> cotação com `age_seconds` e `stale` (ou None)
+        """
+        keys = list(dict.fromkeys(ticker.upper().strip().replace('.SA', '') for ticker in tickers))
+        self._sync_shared_cache()
+        quotes = {}
+        missing = []
+        for key in keys:
+            cached = self._cache.get(key)
+            if cached is not None:
+                quotes[key] = cached
+            else:
+                missing.append(key)
+        
+        to_revalidate = []
+        cold = []
+        if missing:
+            db_quotes = quotes_repository.get_quotes(missing)
+            for key in missing:
+                db_quote = db_quotes.get(key)
+                if db_quote is None:
+                    cold.append(key)
+                    continue
+                quotes[key] = db_quote
+                if self._is_db_cache_valid(db_quote):
+                    self._cache.set(key, db_quote)
+                else:
+                    to_revalidate.append(key)
+        
+        if cold and allow_fetch:
+            quotes.update(self._cache.get_or_load(cold, self._fetch_quotes))
+        else:
+            to_revalidate.extend(cold)
+        
+        if to_revalidate:
+            self.revalidate(to_revalidate)
+        
+        return {key: self._with_staleness(quotes.get(key)) for key in keys}
+    
+    def read_quote(self, ticker: str, allow_fetch: bool = False) -> Optional[Dict]:
+        """Caso particular de `read_quotes` com um único ticker."""
+        return next(iter(self.read_quotes([ticker], allow_fetch).values()))
+    
+    def revalidate(self, tickers: List[str]) -> int:
+        """
+        Agenda atualização em background dos tickers no provedor.
+        
+        Tickers já em revalidação são ignorados (no máximo uma por ticker),
+        assim como os fora do formato da B3 ou no cache negativo; com o
+        circuito do provedor aberto, nada é agendado.
+        
+        Returns:
+            Quantidade de tickers agendados
+        """
+        keys = [ticker.upper().strip().replace('.SA', '') for ticker in tickers]
+        keys = [key for key in dict.fromkeys(keys) if self._should_fetch(key)]
+        if not keys or self.breaker.state == OPEN:
+            return 0
+        with self._revalidating_lock:
+            scheduled = [key for key in keys if key not in self._revalidating]
+            self._revalidating.update(scheduled)
+        
+        if scheduled:
+            logger.debug(f"🔄 Revalidação agendada para {len(scheduled)} cotações")
+            self._revalidation_pool.submit(self._revalidate, scheduled)
+        return len(scheduled)
+    
+    def _revalidate(self, tickers: List[str]) -> None:
+        claims = []
+        try:
+            # Tickers reservados por outro worker chegam pelo cache compartilhado
+            try:
+                claims = claim([f"quote:{ticker}" for ticker in tickers], REFRESH_CLAIM_SECONDS)
+            except Exception as e:
+                logger.warning(f"Reserva de tickers indisponível, revalidando sem coordenação: {e}")
+                claims = []
+                owned = list(tickers)
+            else:
+                owned = [ticker for ticker in tickers if f"quote:{ticker}" in claims]
+            
+            # Outro worker pode ter atualizado depois que a leitura viu a cotação vencida
+            db_quotes = quotes_repository.get_quotes(owned)
+            pending = []
+            for ticker in owned:
+                db_quote = db_quotes.get(ticker)
+                if db_quote and self._is_db_cache_valid(db_quote):
+                    self._cache.set(ticker, db_quote)
+                else:
+                    pending.append(ticker)
+            
+            if pending:
+                self._cache.get_or_load(pending, self._fetch_quotes, refresh=True)
+        except Exception as e:
+            logger.error(f"Erro na revalidação de cotações: {str(e)}")
+        finally:
+            try:
+                release_claims(claims)
+            except Exception as e:
+                logger.warning(f"Erro ao liberar reserva de tickers: {e}")
+            with self._revalidating_lock:
+                self._revalidating.difference_update(tickers)
+    
     def clear_cache(self, ticker: Optional[str] = None):
         """
-        Limpa o cache de cotações.
+        Limpa o cache de cotações (inclusive o negativo).
         
         Args:
             ticker: Se fornecido, limpa apenas o cache deste ticker.
                    Se None, limpa todo o cache.
         """
         if ticker:
-            ticker_clean = ticker.upper().replace('.SA', '')
-            if ticker_clean in self._cache:
-                del self._cache[ticker_clean]
+            key = ticker.upper().replace('.SA', '')
+            self._cache.delete(key)
+            self._negative.record_hit(key)
         else:
             self._cache.clear()
+            self._negative.clear()
+    
+    def cache_stats(self) -> Dict:
+        """
+        Contadores do cache em memória (hits, misses, evictions, ...), do
+        cache negativo (`negative`) e estado do circuit breaker (`breaker`).
+        """
+        return {
+            **self._cache.stats(),
+            "shared_version": self._shared_version,
+            "negative": self._negative.stats(),
+            "breaker": self.breaker.stats()
+        }
 
 
 # Instância singleton do serviço
 _market_data_service = None
+_market_data_service_lock = threading.Lock()
 
 
 def get_market_data_service() -> MarketDataService:
@@ -220,6 +447,8 @@ def get_market_data_service() -> MarketDataService:
     global _market_data_service
     
     if _market_data_service is None:
-        _market_data_service = MarketDataService()
+        with _market_data_service_lock:
+            if _market_data_service is None:
+                _market_data_service = MarketDataService()
     
     return _market_data_service
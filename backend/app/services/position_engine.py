@@ -1,8 +1,9 @@
 import logging
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from app.db.database import get_db
+from app.db.database import get_db, chunked
+from app.repositories import corporate_events_repository, positions_repository
+from app.repositories.corporate_events_repository import NO_ADJUSTMENT, AdjustmentFactors
 
 logger = logging.getLogger(__name__)
 
@@ -16,9 +17,19 @@ def _num(value: Optional[float], fallback: float = 0.0) -> float:
         return fallback
 
 
-def compute_asset_position(asset_id: int) -> Dict:
+def _new_state() -> Dict:
+    return {
+        "quantity": 0.0,
+        "total_cost": 0.0,
+        "total_bought_value": 0.0,
+        "total_sold_value": 0.0,
+        "timeline_count": 0,
+    }
+
+
+def _apply_operation(state: Dict, mtype, q, price, value, source, subtype) -> None:
     """
-    Calcula posição e preço médio de um ativo considerando eventos corporativos.
+    Aplica uma operação ao estado do engine (in-place).
 
     Regras:
     - COMPRA: aumenta quantidade e custo (usa value se disponível, senão quantity*price)
@@ -27,7 +38,126 @@ def compute_asset_position(asset_id: int) -> Dict:
     - GRUPAMENTO: reduz quantidade com custo 0 (custo inalterado)
     - AJUSTE_RECONCILIACAO (source='RECONCILIATION'): ajusta apenas quantidade (custo intacto)
     - SUBSCRICAO: se value/preço disponível, trata como compra; senão custo 0
-    - Ignora linhas de 'Atualização' e 'Transferência - Liquidação' (não devem existir como operações)
+    - Demais tipos (ex.: Rendimento) não alteram a posição
+    """
+    q = _num(q, 0.0)
+    price = _num(price, 0.0)
+    value = _num(value, q * price)
+
+    qty = state["quantity"]
+    cost = state["total_cost"]
+    state["timeline_count"] += 1
+
+    # Ajuste de reconciliação: altera quantidade sem mexer no custo
+    if source == "RECONCILIATION" and (subtype == "AJUSTE_RECONCILIACAO" or subtype == "RECONCILIACAO"):
+        # Usa movement_type para direção
+        state["quantity"] = qty + q if mtype == "COMPRA" else qty - q
+        return
+
+    # Eventos corporativos (quantidade-only)
+    if subtype in ("BONIFICACAO", "DESDOBRO"):
+        state["quantity"] = qty + q
+        return
+    if subtype == "GRUPAMENTO":
+        state["quantity"] = max(qty - q, 0.0)
+        return
+    if subtype and subtype.startswith("SUBSCRICAO"):
+        # Trata como compra com custo se houver valor/preço
+        buy_cost = value if value > 0 else (q * price)
+        state["quantity"] = qty + q
+        state["total_cost"] = cost + buy_cost
+        state["total_bought_value"] += buy_cost
+        return
+
+    # Operações de compra/venda
+    if mtype == "COMPRA":
+        buy_cost = value if value > 0 else (q * price)
+        state["quantity"] = qty + q
+        state["total_cost"] = cost + buy_cost
+        state["total_bought_value"] += buy_cost
+    elif mtype == "VENDA":
+        sell_value = value if value > 0 else (q * price)
+        # custo reduz pelo PM vigente, exceto se for venda de ajuste (já tratada acima)
+        pm = (cost / qty) if qty > 0 else 0.0
+        state["quantity"] = max(qty - q, 0.0)
+        state["total_cost"] = max(cost - pm * q, 0.0)
+        state["total_sold_value"] += sell_value
+    # tipos diversos sem impacto na posição (ex.: Rendimento)
+
+
+def _apply_bonus_cost(state: Dict, factors: AdjustmentFactors, ex_date: str, factor: float, cost_basis: float) -> None:
+    """Soma ao custo o custo atribuído das ações recebidas em bonificação."""
+    real_before = state["quantity"] * factors.factor_at(ex_date) / factor / factors.total
+    state["total_cost"] += real_before * (factor - 1) * cost_basis
+
+
+def _cost_events(factors: AdjustmentFactors, start: str) -> List[Tuple[str, float, float]]:
+    """Eventos com custo atribuído posteriores a `start` (ainda não aplicados)."""
+    return [e for e in factors.events if e[2] > 0 and e[0] > start]
+
+
+def _replay(
+    rows,
+    state: Dict,
+    checkpoints: Optional[List[Dict]] = None,
+    factors: AdjustmentFactors = NO_ADJUSTMENT,
+    start: str = ""
+) -> Dict:
+    """
+    Reaplica operações (ordenadas por trade_date, id) sobre um estado.
+
+    Se `checkpoints` for informado, acrescenta um checkpoint ao fim de cada
+    mês com operações (as_of = última trade_date do mês).
+
+    `factors` converte quantidade/preço de cada operação para a unidade atual
+    do ativo (eventos por razão em corporate_events) e aplica o custo atribuído
+    de bonificações na ex_date. Eventos com ex_date <= `start` já estão
+    refletidos no estado (retomada a partir de checkpoint).
+    """
+    events = _cost_events(factors, start)
+    next_event = 0
+    last_date = None
+    for (op_id, mtype, q, price, value, tdate, source, subtype) in rows:
+        if checkpoints is not None and last_date is not None and tdate[:7] != last_date[:7]:
+            checkpoints.append({"as_of": last_date, **state})
+        while next_event < len(events) and events[next_event][0] <= tdate:
+            _apply_bonus_cost(state, factors, *events[next_event])
+            next_event += 1
+        m = factors.multiplier(tdate)
+        _apply_operation(state, mtype, _num(q) * m, _num(price) / m, value, source, subtype)
+        last_date = tdate
+
+    if checkpoints is not None and last_date is not None:
+        checkpoints.append({"as_of": last_date, **state})
+
+    # Eventos após a última operação (não entram no checkpoint)
+    for event in events[next_event:]:
+        _apply_bonus_cost(state, factors, *event)
+    return state
+
+
+def _position_from_state(asset_id: int, state: Dict) -> Dict:
+    qty = state["quantity"]
+    cost = state["total_cost"]
+    return {
+        "asset_id": asset_id,
+        "quantity": round(qty, 8),
+        "total_cost": round(cost, 8),
+        "average_price": round((cost / qty) if qty > 0 else 0.0, 8),
+        "invested_value": round(state["total_bought_value"] - state["total_sold_value"], 8),
+        "events_applied": True,
+        "timeline_count": state["timeline_count"],
+    }
+
+
+def compute_asset_position(asset_id: int) -> Dict:
+    """
+    Calcula posição e preço médio de um ativo considerando eventos corporativos.
+
+    Faz o replay completo das operações ativas (regras em `_apply_operation`),
+    com quantidades na unidade atual do ativo (eventos em corporate_events).
+    Ignora linhas de 'Atualização' e 'Transferência - Liquidação' (não devem
+    existir como operações).
 
     Retorna: dict com quantity, total_cost, average_price, invested_value e detalhes.
     """
@@ -37,7 +167,7 @@ def compute_asset_position(asset_id: int) -> Dict:
         cursor.execute(
             """
             SELECT id, movement_type, quantity, price, value, trade_date,
-                   source, operation_subtype, notes
+                   source, operation_subtype
             FROM operations
             WHERE asset_id = ? AND status = 'ACTIVE'
             ORDER BY trade_date ASC, id ASC
@@ -45,120 +175,257 @@ def compute_asset_position(asset_id: int) -> Dict:
             (asset_id,),
         )
         rows = cursor.fetchall()
+        factors = corporate_events_repository.get_adjustment_factors(cursor, [asset_id])
 
-    qty = 0.0
-    cost = 0.0
-    total_bought_value = 0.0
-    total_sold_value = 0.0
+    state = _replay(rows, _new_state(), factors=factors.get(asset_id, NO_ADJUSTMENT))
+    return _position_from_state(asset_id, state)
 
-    timeline = []
 
-    def pm() -> float:
-        return (cost / qty) if qty > 0 else 0.0
+def _refresh_positions(cursor, asset_ids: Iterable[int], since: Optional[str], full: bool) -> Dict[int, Dict]:
+    """Implementação de refresh_positions sobre um cursor já em transação."""
+    asset_ids = sorted(set(asset_ids))
+    if not asset_ids:
+        return {}
 
-    for (op_id, mtype, q, price, value, tdate, source, subtype, notes) in rows:
-        q = _num(q, 0.0)
-        price = _num(price, 0.0)
-        value = _num(value, q * price)
+    results = {}
+    recomputed = 0
 
-        before = {"qty": qty, "cost": cost, "pm": pm()}
+    for chunk in chunked(asset_ids):
+        cached = positions_repository.get_cached_positions(cursor, chunk)
 
-        # Ajuste de reconciliação: altera quantidade sem mexer no custo
-        if source == "RECONCILIATION" and (subtype == "AJUSTE_RECONCILIACAO" or subtype == "RECONCILIACAO"):
-            # Usa movement_type para direção
-            if mtype == "COMPRA":
-                qty += q
+        # Data de retomada por ativo (None = replay completo)
+        resume_from = {}
+        for asset_id in chunk:
+            entry = cached.get(asset_id)
+            if full or entry is None:
+                resume_from[asset_id] = None
+                continue
+            dates = [d for d in (since, entry["stale_since"]) if d]
+            if dates:
+                resume_from[asset_id] = min(dates)
             else:
-                qty -= q
-            after = {"qty": qty, "cost": cost, "pm": pm()}
-            timeline.append({
-                "id": op_id, "date": tdate, "type": mtype, "subtype": subtype,
-                "quantity": q, "price": price, "value": value,
-                "before": before, "after": after, "note": "reconciliation-adjustment"
-            })
-            continue
+                results[asset_id] = _position_from_state(asset_id, entry)
 
-        # Eventos corporativos (quantidade-only)
-        if subtype in ("BONIFICACAO", "DESDOBRO"):
-            qty += q
-            after = {"qty": qty, "cost": cost, "pm": pm()}
-            timeline.append({
-                "id": op_id, "date": tdate, "type": "EVENT", "subtype": subtype,
-                "quantity": q, "price": 0.0, "value": 0.0,
-                "before": before, "after": after
-            })
-            continue
-        if subtype == "GRUPAMENTO":
-            qty -= q
-            if qty < 0:
-                qty = 0.0
-            after = {"qty": qty, "cost": cost, "pm": pm()}
-            timeline.append({
-                "id": op_id, "date": tdate, "type": "EVENT", "subtype": subtype,
-                "quantity": -q, "price": 0.0, "value": 0.0,
-                "before": before, "after": after
-            })
-            continue
-        if subtype and subtype.startswith("SUBSCRICAO"):
-            # Trata como compra com custo se houver valor/preço
-            buy_cost = value if value > 0 else (q * price)
-            qty += q
-            cost += buy_cost
-            total_bought_value += buy_cost
-            after = {"qty": qty, "cost": cost, "pm": pm()}
-            timeline.append({
-                "id": op_id, "date": tdate, "type": "COMPRA", "subtype": subtype,
-                "quantity": q, "price": price, "value": buy_cost,
-                "before": before, "after": after
-            })
+        if not resume_from:
             continue
 
-        # Operações de compra/venda
-        if mtype == "COMPRA":
-            buy_cost = value if value > 0 else (q * price)
-            qty += q
-            cost += buy_cost
-            total_bought_value += buy_cost
-            after = {"qty": qty, "cost": cost, "pm": pm()}
-            timeline.append({
-                "id": op_id, "date": tdate, "type": mtype, "subtype": subtype,
-                "quantity": q, "price": price, "value": buy_cost,
-                "before": before, "after": after
-            })
-        elif mtype == "VENDA":
-            sell_value = value if value > 0 else (q * price)
-            # custo reduz pelo PM vigente, exceto se for venda de ajuste (já tratada acima)
-            reduce_cost = pm() * q
-            qty -= q
-            if qty < 0:
-                qty = 0.0
-            cost -= reduce_cost
-            if cost < 0:
-                cost = 0.0
-            total_sold_value += sell_value
-            after = {"qty": qty, "cost": cost, "pm": pm()}
-            timeline.append({
-                "id": op_id, "date": tdate, "type": mtype, "subtype": subtype,
-                "quantity": -q, "price": price, "value": sell_value,
-                "before": before, "after": after
-            })
+        for asset_id, date_from in resume_from.items():
+            positions_repository.discard_checkpoints(cursor, asset_id, date_from)
+        checkpoints = positions_repository.get_latest_checkpoints(cursor, list(resume_from))
+        factors = corporate_events_repository.get_adjustment_factors(cursor, list(resume_from))
+
+        # Uma leitura por bloco, a partir do checkpoint mais antigo usado
+        floor = min(
+            (checkpoints[a]["as_of"] if a in checkpoints else "") for a in resume_from
+        )
+        placeholders = ",".join("?" * len(resume_from))
+        cursor.execute(f"""
+            SELECT asset_id, id, movement_type, quantity, price, value,
+                   trade_date, source, operation_subtype
+            FROM operations
+            WHERE asset_id IN ({placeholders}) AND status = 'ACTIVE'
+              AND trade_date > ?
+            ORDER BY asset_id ASC, trade_date ASC, id ASC
+        """, (*resume_from, floor))
+
+        rows_by_asset = {}
+        for row in cursor.fetchall():
+            rows_by_asset.setdefault(row[0], []).append(row[1:])
+
+        to_save = []
+        for asset_id in resume_from:
+            checkpoint = checkpoints.get(asset_id)
+            if checkpoint:
+                state = {col: checkpoint[col] for col in positions_repository.STATE_COLUMNS}
+                rows = [r for r in rows_by_asset.get(asset_id, []) if r[5] > checkpoint["as_of"]]
+                last_trade_date = checkpoint["as_of"]
+            else:
+                state = _new_state()
+                rows = rows_by_asset.get(asset_id, [])
+                last_trade_date = None
+
+            new_checkpoints = []
+            _replay(
+                rows, state, new_checkpoints,
+                factors=factors.get(asset_id, NO_ADJUSTMENT),
+                start=last_trade_date or ""
+            )
+            positions_repository.save_checkpoints(cursor, asset_id, new_checkpoints)
+
+            if rows:
+                last_trade_date = rows[-1][5]
+            to_save.append({"asset_id": asset_id, "last_trade_date": last_trade_date, **state})
+            results[asset_id] = _position_from_state(asset_id, state)
+            recomputed += 1
+
+        positions_repository.save_cached_positions(cursor, to_save)
+
+    logger.info(f"Posições atualizadas: {recomputed} recalculadas, {len(results) - recomputed} do cache")
+    return results
+
+
+def refresh_positions(
+    asset_ids: Iterable[int],
+    since: Optional[str] = None,
+    full: bool = False,
+    cursor=None
+) -> Dict[int, Dict]:
+    """
+    Recalcula e persiste no cache as posições dos ativos informados.
+
+    O recálculo é incremental: para cada ativo, parte do último checkpoint
+    anterior à menor data afetada (`since` ou `stale_since` do cache, marcado
+    pelos triggers de operations) e reaplica apenas as operações posteriores.
+    Ativos sem cache, ou com full=True, são recalculados do zero.
+    Ativos com cache atualizado e sem `since` não são recalculados.
+
+    Args:
+        asset_ids: IDs dos ativos a recalcular
+        since: Data (YYYY-MM-DD) mais antiga sabidamente afetada
+        full: Ignora cache e checkpoints
+        cursor: Cursor de uma transação de escrita do chamador. Se None,
+                abre conexão própria com lock de escrita.
+
+    Returns:
+        Dicionário asset_id -> posição (mesmo formato de compute_asset_position)
+    """
+    if cursor is not None:
+        return _refresh_positions(cursor, asset_ids, since, full)
+
+    with get_db() as conn:
+        # Lock de escrita desde a leitura: evita perder invalidações concorrentes
+        conn.execute("BEGIN IMMEDIATE")
+        return _refresh_positions(conn.cursor(), asset_ids, since, full)
+
+
+def _get_positions(cursor, asset_ids: Optional[Iterable[int]]) -> Tuple[Dict[int, Dict], List[int]]:
+    """Lê o cache; retorna (posições atualizadas, ativos a recalcular)."""
+    if asset_ids is None:
+        cursor.execute("SELECT id FROM assets WHERE status = 'ACTIVE'")
+        asset_ids = [row[0] for row in cursor.fetchall()]
+    else:
+        asset_ids = sorted(set(asset_ids))
+    cached = positions_repository.get_cached_positions(cursor, asset_ids)
+
+    results = {}
+    pending = []
+    for asset_id in asset_ids:
+        entry = cached.get(asset_id)
+        if entry is None or entry["stale_since"] is not None:
+            pending.append(asset_id)
         else:
-            # tipos diversos sem impacto na posição (ex.: Rendimento)
-            timeline.append({
-                "id": op_id, "date": tdate, "type": mtype, "subtype": subtype,
-                "quantity": 0.0, "price": price, "value": value,
-                "before": before, "after": before, "note": "ignored"
-            })
+            results[asset_id] = _position_from_state(asset_id, entry)
+    return results, pending
 
-    return {
-        "asset_id": asset_id,
-        "quantity": round(qty, 8),
-        "total_cost": round(cost, 8),
-        "average_price": round((cost / qty) if qty > 0 else 0.0, 8),
-        "invested_value": round(total_bought_value - total_sold_value, 8),
-        "events_applied": True,
-        "timeline_count": len(timeline),
-    }
+
+def get_positions(asset_ids: Optional[Iterable[int]] = None, cursor=None) -> Dict[int, Dict]:
+    """
+    Retorna posições do cache do engine, recalculando apenas as desatualizadas.
+
+    Args:
+        asset_ids: IDs dos ativos. Se None, todos os ativos ativos.
+        cursor: Cursor de uma transação de escrita do chamador (opcional)
+
+    Returns:
+        Dicionário asset_id -> posição (mesmo formato de compute_asset_position)
+    """
+    if cursor is not None:
+        results, pending = _get_positions(cursor, asset_ids)
+    else:
+        with get_db() as conn:
+            results, pending = _get_positions(conn.cursor(), asset_ids)
+
+    if pending:
+        results.update(refresh_positions(pending, cursor=cursor))
+    return results
+
+
+def get_positions_as_of(targets: Iterable[Tuple[int, str]], cursor=None) -> Dict[Tuple[int, str], Dict]:
+    """
+    Calcula posições em datas passadas (ex.: data de cada snapshot B3).
+
+    Para cada ativo, parte do checkpoint mensal mais recente anterior à
+    primeira data pedida e reaplica apenas as operações até a última data
+    (leitura limitada por trade_date no índice asset_id, trade_date). Várias
+    datas do mesmo ativo são atendidas em um único replay.
+
+    Args:
+        targets: Pares (asset_id, data YYYY-MM-DD); considera operações com
+                 trade_date <= data
+        cursor: Cursor de uma transação de escrita do chamador (opcional)
+
+    Returns:
+        Dicionário (asset_id, data) -> posição (mesmo formato de compute_asset_position)
+    """
+    dates_by_asset = {}
+    for asset_id, as_of in targets:
+        dates_by_asset.setdefault(asset_id, set()).add(as_of)
+    if not dates_by_asset:
+        return {}
+
+    # Garante checkpoints válidos (recalcula ativos com operações alteradas)
+    get_positions(dates_by_asset, cursor=cursor)
+
+    if cursor is not None:
+        return _positions_as_of(cursor, dates_by_asset)
+    with get_db() as conn:
+        return _positions_as_of(conn.cursor(), dates_by_asset)
+
+
+def _positions_as_of(cursor, dates_by_asset: Dict[int, set]) -> Dict[Tuple[int, str], Dict]:
+    """Replay limitado de get_positions_as_of (checkpoints já válidos)."""
+    results = {}
+    for chunk in chunked(sorted(dates_by_asset)):
+        first_dates = {asset_id: min(dates_by_asset[asset_id]) for asset_id in chunk}
+        checkpoints = positions_repository.get_checkpoints_as_of(cursor, first_dates)
+        factors_by_asset = corporate_events_repository.get_adjustment_factors(cursor, chunk)
+
+        floor = min((checkpoints[a]["as_of"] if a in checkpoints else "") for a in chunk)
+        ceiling = max(max(dates_by_asset[a]) for a in chunk)
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, id, movement_type, quantity, price, value,
+                   trade_date, source, operation_subtype
+            FROM operations
+            WHERE asset_id IN ({placeholders}) AND status = 'ACTIVE'
+              AND trade_date > ? AND trade_date <= ?
+            ORDER BY asset_id ASC, trade_date ASC, id ASC
+        """, (*chunk, floor, ceiling))
+
+        rows_by_asset = {}
+        for row in cursor.fetchall():
+            rows_by_asset.setdefault(row[0], []).append(row[1:])
+
+        for asset_id in chunk:
+            checkpoint = checkpoints.get(asset_id)
+            if checkpoint:
+                state = {col: checkpoint[col] for col in positions_repository.STATE_COLUMNS}
+                start = checkpoint["as_of"]
+            else:
+                state = _new_state()
+                start = ""
+
+            factors = factors_by_asset.get(asset_id, NO_ADJUSTMENT)
+            events = _cost_events(factors, start)
+            rows = iter(r for r in rows_by_asset.get(asset_id, []) if r[5] > start)
+            pending = next(rows, None)
+            for as_of in sorted(dates_by_asset[asset_id]):
+                while pending is not None and pending[5] <= as_of:
+                    _, mtype, q, price, value, tdate, source, subtype = pending
+                    while events and events[0][0] <= tdate:
+                        _apply_bonus_cost(state, factors, *events.pop(0))
+                    m = factors.multiplier(tdate)
+                    _apply_operation(state, mtype, _num(q) * m, _num(price) / m, value, source, subtype)
+                    pending = next(rows, None)
+                while events and events[0][0] <= as_of:
+                    _apply_bonus_cost(state, factors, *events.pop(0))
+                # Estado está na unidade atual; a posição sai na unidade vigente em as_of
+                m = factors.multiplier(as_of)
+                results[(asset_id, as_of)] = _position_from_state(
+                    asset_id, {**state, "quantity": state["quantity"] / m}
+                )
+
+    return results
 
 
 def compute_asset_position_by_ticker(ticker: str) -> Dict:
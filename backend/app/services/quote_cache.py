@@ -0,0 +1,207 @@
+"""
+Cache em memória de cotações: TTL + LRU, thread-safe, com single-flight.
+
+- Entradas expiram após `ttl` e o cache guarda no máximo `maxsize` tickers
+  (o menos usado recentemente é descartado)
+- Buscas concorrentes do mesmo ticker ausente esperam uma única busca em
+  andamento (single-flight) em vez de consultar o provedor N vezes
+- Contadores de acerto/erro/descartes para diagnóstico (`stats`)
+
+NegativeCache guarda tickers sem cotação no provedor (símbolo inválido,
+ativo deslistado) com espera exponencial até a próxima tentativa.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteCache:
+    def __init__(
+        self,
+        ttl: timedelta,
+        maxsize: int = 1000,
+        ttl_for: Optional[Callable[[object], timedelta]] = None
+    ):
+        """
+        Args:
+            ttl: Validade padrão das entradas
+            maxsize: Máximo de entradas (LRU)
+            ttl_for: Validade por valor (ex.: conforme o horário do pregão);
+                     se None, usa `ttl`
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize deve ser >= 1")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.ttl_for = ttl_for
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "coalesced": 0}
+
+    def _get_locked(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return value
+
+    def _set_locked(self, key: Hashable, value) -> None:
+        ttl = self.ttl_for(value) if self.ttl_for else self.ttl
+        self._entries[key] = (value, time.monotonic() + ttl.total_seconds())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get(self, key: Hashable):
+        """Valor em cache (None se ausente ou expirado)."""
+        with self._lock:
+            return self._get_locked(key)
+
+    def set(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._set_locked(key, value)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(
+        self,
+        keys: Iterable[Hashable],
+        loader: Callable[[List[Hashable]], Dict[Hashable, Optional[object]]],
+        refresh: bool = False
+    ) -> Dict[Hashable, Optional[object]]:
+        """
+        Retorna os valores das chaves, carregando as ausentes com single-flight.
+
+        `loader` recebe só as chaves que esta chamada ficou responsável por
+        buscar; chaves já em busca por outra thread aguardam aquele resultado.
+        Valores None não são cacheados.
+
+        Args:
+            refresh: Ignora valores em cache (ainda reaproveita buscas em andamento)
+        """
+        results = {}
+        owned: List[Hashable] = []
+        waiting: Dict[Hashable, Future] = {}
+
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if not refresh:
+                    value = self._get_locked(key)
+                    if value is not None:
+                        results[key] = value
+                        continue
+                flight = self._in_flight.get(key)
+                if flight is not None:
+                    waiting[key] = flight
+                    self._counters["coalesced"] += 1
+                else:
+                    self._in_flight[key] = Future()
+                    owned.append(key)
+
+        if owned:
+            try:
+                loaded = loader(owned)
+            except BaseException as e:
+                with self._lock:
+                    flights = [self._in_flight.pop(key) for key in owned]
+                for flight in flights:
+                    flight.set_exception(e)
+                raise
+
+            with self._lock:
+                flights = []
+                for key in owned:
+                    value = loaded.get(key)
+                    if value is not None:
+                        self._set_locked(key, value)
+                    flights.append((self._in_flight.pop(key), value))
+                    results[key] = value
+            for flight, value in flights:
+                flight.set_result(value)
+
+        for key, flight in waiting.items():
+            try:
+                results[key] = flight.result()
+            except Exception as e:
+                logger.warning(f"Busca compartilhada de {key} falhou: {e}")
+                results[key] = None
+
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._counters, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+class NegativeCache:
+    """
+    Tickers sem cotação no provedor, com espera exponencial por ticker.
+
+    A n-ésima falha seguida bloqueia o ticker por ttl * 2^(n-1), até max_ttl;
+    uma cotação obtida limpa o histórico do ticker.
+    """
+
+    def __init__(self, ttl: timedelta, max_ttl: timedelta, maxsize: int = 10000):
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self.maxsize = maxsize
+        # ticker -> (falhas seguidas, bloqueado até [monotonic])
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"skipped": 0}
+
+    def is_blocked(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[1]:
+                return False
+            self._counters["skipped"] += 1
+            return True
+
+    def record_miss(self, key: Hashable) -> timedelta:
+        """Registra falha do ticker; retorna a espera até a próxima tentativa."""
+        with self._lock:
+            failures = self._entries.get(key, (0, 0.0))[0] + 1
+            wait = min(self.ttl * (2 ** (failures - 1)), self.max_ttl)
+            self._entries[key] = (failures, time.monotonic() + wait.total_seconds())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return wait
+
+    def record_hit(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            blocked = sorted(str(key) for key, (_, until) in self._entries.items() if until > now)
+            return {**self._counters, "size": len(self._entries), "blocked": blocked}
@@ -0,0 +1,197 @@
+"""
+Histórico diário de cotações: carga (backfill) e consultas por intervalo.
+
+- backfill_history: baixa pregões diários dos ativos em carteira, em blocos
+  de tickers, a partir do último pregão gravado de cada um (ou de
+  HISTORY_YEARS atrás na primeira carga). Cada bloco é gravado na sua
+  própria transação, então uma carga interrompida continua de onde parou.
+- load_history: leitura colunar (arrays numpy) para análises
+
+Os pregões são gravados como negociados na data; a leitura ajusta os preços
+para a unidade atual do ativo com os eventos de corporate_events.
+"""
+
+import logging
+import os
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.db.database import get_db, chunked
+from app.repositories import corporate_events_repository, quote_history_repository
+from app.repositories import quotes_repository
+from app.repositories.corporate_events_repository import AdjustmentFactors
+from app.repositories.quote_history_repository import HISTORY_COLUMNS, decode_date, encode_date
+from app.services.market_data_service import get_market_data_service
+from app.services.quote_providers import BATCH_SIZE, QuoteProvider
+
+logger = logging.getLogger(__name__)
+
+# Profundidade da primeira carga (anos)
+HISTORY_YEARS = int(os.getenv("QUOTES_HISTORY_YEARS", "5"))
+
+
+def _asset_ids_by_ticker(cursor, tickers: List[str]) -> Dict[str, int]:
+    asset_ids = {}
+    for chunk in chunked(tickers):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT ticker, id FROM assets WHERE ticker IN ({placeholders})", chunk)
+        asset_ids.update(cursor.fetchall())
+    return asset_ids
+
+
+def bars_to_rows(asset_id: int, bars: pd.DataFrame) -> List[tuple]:
+    """Pregões (BAR_COLUMNS, índice YYYY-MM-DD) -> linhas de quote_history."""
+    bars = bars.dropna(subset=['Close'])
+    dates = pd.Index(bars.index).astype(str).str.replace('-', '', regex=False).str[:8].astype(np.int64)
+    volume = bars['Volume'].fillna(0).astype(np.int64)
+    return list(zip(
+        [asset_id] * len(bars), dates.tolist(),
+        bars['Open'].tolist(), bars['High'].tolist(), bars['Low'].tolist(),
+        bars['Close'].tolist(), volume.tolist()
+    ))
+
+
+def backfill_history(
+    tickers: Optional[List[str]] = None,
+    years: int = HISTORY_YEARS,
+    end: Optional[str] = None,
+    provider: Optional[QuoteProvider] = None,
+    batch_size: int = BATCH_SIZE
+) -> Dict:
+    """
+    Carrega o histórico diário dos tickers (padrão: ativos com posição).
+
+    Incremental: cada ticker é buscado a partir do último pregão já gravado,
+    inclusive; ele é regravado, pois pode ter sido gravado com o pregão em
+    andamento. Tickers de um bloco compartilham a requisição, que começa na
+    menor data necessária do bloco; pregões anteriores são descartados antes
+    do upsert.
+
+    Returns:
+        tickers, batches, rows (pregões gravados) e missing (sem dados)
+    """
+    tickers = tickers if tickers is not None else quotes_repository.get_tickers_to_update()
+    provider = provider or get_market_data_service().provider
+    default_start = (date.today() - timedelta(days=365 * years)).isoformat()
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        asset_ids = _asset_ids_by_ticker(cursor, tickers)
+        last_dates = quote_history_repository.get_last_dates(cursor, asset_ids.values())
+
+    def start_for(ticker: str) -> str:
+        last = last_dates.get(asset_ids[ticker])
+        if last is None:
+            return default_start
+        return decode_date(last)
+
+    # Ordena por data inicial: blocos agrupam tickers com necessidades parecidas;
+    # tickers com pregões depois de `end` ficam de fora
+    until = end or date.today().isoformat()
+    pending = sorted(
+        (t for t in tickers if t in asset_ids and start_for(t) <= until),
+        key=lambda t: (start_for(t), t)
+    )
+    unknown = [t for t in tickers if t not in asset_ids]
+
+    rows_written = 0
+    batches = 0
+    missing = list(unknown)
+    for batch in (pending[i:i + batch_size] for i in range(0, len(pending), batch_size)):
+        start = start_for(batch[0])
+        try:
+            bars = provider.fetch_bars(batch, start, end)
+        except Exception as e:
+            logger.error(f"Erro ao buscar histórico de {len(batch)} tickers desde {start}: {e}")
+            missing.extend(batch)
+            continue
+
+        rows = [
+            row
+            for ticker in batch if ticker in bars
+            for row in bars_to_rows(asset_ids[ticker], bars[ticker][bars[ticker].index >= start_for(ticker)])
+        ]
+        with get_db() as conn:
+            rows_written += quote_history_repository.upsert_bars(conn.cursor(), rows)
+        missing.extend(t for t in batch if t not in bars)
+        batches += 1
+        logger.info(f"Histórico: bloco {batches} ({len(batch)} tickers desde {start}) -> {len(rows)} pregões")
+
+    return {
+        "tickers": len(pending),
+        "batches": batches,
+        "rows": rows_written,
+        "missing": missing
+    }
+
+
+def adjust_history(columns: Dict[str, np.ndarray], factors: AdjustmentFactors) -> Dict[str, np.ndarray]:
+    """
+    Pregões na unidade atual do ativo: preços por AdjustmentFactors.adjust_price,
+    volume pelo inverso.
+
+    O fator é constante entre ex_dates consecutivas, então é calculado uma
+    vez por intervalo e distribuído às datas por busca binária.
+    """
+    if not factors.dates:
+        return columns
+    ex_dates = np.array([encode_date(ex_date) for ex_date in factors.dates], dtype=np.int64)
+    # Intervalo 0: antes do primeiro evento; intervalo i: a partir da i-ésima ex_date
+    scales = np.array([factors.adjust_price(ex_date, 1.0) for ex_date in ["", *factors.dates]])
+    scale = scales[np.searchsorted(ex_dates, columns["date"], side="right")]
+    adjusted = {**columns, **{column: columns[column] * scale for column in ("open", "high", "low", "close")}}
+    adjusted["volume"] = np.rint(columns["volume"] / scale).astype(np.int64)
+    return adjusted
+
+
+def load_history(
+    tickers: List[str],
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    adjusted: bool = True
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Pregões gravados por ticker entre start e end (inclusive), em colunas.
+
+    Args:
+        adjusted: Ajusta preços/volume pelos eventos corporativos registrados
+                  (unidade atual do ativo); False = como negociados
+
+    Returns:
+        ticker -> {"date": int64[] (YYYYMMDD), "open", "high", "low", "close", "volume"}
+        (tickers sem histórico no intervalo ficam de fora)
+    """
+    start_key = encode_date(start) if start else 0
+    end_key = encode_date(end) if end else 99991231
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        asset_ids = _asset_ids_by_ticker(cursor, tickers)
+        history = quote_history_repository.get_range(cursor, asset_ids.values(), start_key, end_key)
+        factors = corporate_events_repository.get_adjustment_factors(cursor, history) if adjusted else {}
+
+    return {
+        ticker: adjust_history(history[asset_id], factors[asset_id]) if asset_id in factors else history[asset_id]
+        for ticker, asset_id in asset_ids.items() if asset_id in history
+    }
+
+
+def _json_values(values: np.ndarray) -> list:
+    # JSON não aceita NaN: pregões sem abertura/máxima/mínima viram null
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return [None if np.isnan(value) else value for value in values.tolist()]
+    return values.tolist()
+
+
+def history_to_json(history: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Dict[str, list]]:
+    """Arrays -> listas (datas em YYYY-MM-DD) para respostas da API."""
+    return {
+        ticker: {
+            "dates": [decode_date(value) for value in columns["date"].tolist()],
+            **{column: _json_values(columns[column]) for column in HISTORY_COLUMNS}
+        }
+        for ticker, columns in history.items()
+    }
@@ -0,0 +1,392 @@
+"""
+Provedores de cotações para o MarketDataService.
+
+- YFinanceProvider: Yahoo Finance (uma requisição por símbolo, blocos concorrentes)
+- FileQuoteProvider: arquivo local CSV/Parquet com pregões diários, com
+  replay determinístico (cotação "vigente" em uma data fixa); para testes,
+  benchmarks e ambientes sem rede
+- FallbackQuoteProvider: cadeia de provedores; tickers sem cotação (ou com
+  falha) no primeiro são buscados no seguinte
+
+O provedor padrão é escolhido por configuração (ver build_quote_provider).
+"""
+
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+import yfinance as yf
+
+from app.services.fetch_executor import ConcurrentFetcher, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Janela baixada por requisição: cobre o pregão anterior mesmo após feriados
+HISTORY_PERIOD = '5d'
+
+# Busca concorrente: símbolos por bloco, blocos simultâneos,
+# taxa máxima (req/s), timeout por requisição (s) e retentativas
+BATCH_SIZE = int(os.getenv("QUOTES_BATCH_SIZE", "50"))
+MAX_IN_FLIGHT = int(os.getenv("QUOTES_MAX_IN_FLIGHT", "4"))
+RATE_PER_SECOND = float(os.getenv("QUOTES_RATE_PER_SECOND", "2"))
+RATE_BURST = int(os.getenv("QUOTES_RATE_BURST", "4"))
+REQUEST_TIMEOUT = float(os.getenv("QUOTES_REQUEST_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("QUOTES_MAX_RETRIES", "2"))
+
+# Colunas dos pregões (mesmos nomes do yfinance)
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def unadjust_splits(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Desfaz o ajuste por desdobros do Yahoo (preços/volume como negociados).
+
+    O Yahoo devolve pregões anteriores a um desdobro já na unidade nova; a
+    coluna 'Stock Splits' (history com actions=True) traz a razão na ex_date
+    (ex.: 10.0 em um desdobro 1:10, 0.1 em um grupamento 10:1).
+    """
+    bars = frame[BAR_COLUMNS].copy()
+    splits = frame['Stock Splits'].fillna(0) if 'Stock Splits' in frame else None
+    if splits is None or not (splits > 0).any():
+        return bars
+    ratio = splits.where(splits > 0, 1.0)
+    # Produto das razões com ex_date posterior a cada pregão
+    later = ratio[::-1].cumprod()[::-1].shift(-1, fill_value=1.0)
+    bars[['Open', 'High', 'Low', 'Close']] = bars[['Open', 'High', 'Low', 'Close']].mul(later, axis=0)
+    bars['Volume'] = bars['Volume'] / later
+    return bars
+
+
+def quote_from_bars(ticker: str, bars: pd.DataFrame, source: str) -> Optional[Dict]:
+    """
+    Monta a cotação a partir dos pregões de um ticker (último + anterior).
+
+    `market_time` é o horário do último pregão; `updated_at` é o momento da
+    busca (usado para validade do cache).
+
+    Args:
+        bars: Pregões ordenados por data, colunas BAR_COLUMNS
+    """
+    bars = bars.dropna(subset=['Close'])
+    if bars.empty:
+        return None
+
+    last_row = bars.iloc[-1]
+    last_timestamp = pd.Timestamp(bars.index[-1])
+
+    # Validar dados essenciais
+    if not last_row['Close'] or last_row['Close'] == 0:
+        logger.warning(f"Cotação inválida para {ticker}: preço zero ou nulo")
+        return None
+
+    current_price = last_row['Close']
+    # Fechamento anterior vem dos mesmos dados (pregão anterior)
+    previous_close = bars['Close'].iloc[-2] if len(bars) > 1 else current_price
+    change = current_price - previous_close
+    change_percent = (change / previous_close) * 100 if previous_close else 0
+
+    return {
+        'ticker': ticker,
+        'price': round(float(current_price), 2),
+        'change': round(float(change), 2),
+        'change_percent': round(float(change_percent), 2),
+        'volume': int(last_row['Volume']) if pd.notna(last_row['Volume']) else 0,
+        'open': round(float(last_row['Open']), 2),
+        'high': round(float(last_row['High']), 2),
+        'low': round(float(last_row['Low']), 2),
+        'previous_close': round(float(previous_close), 2),
+        'market_time': last_timestamp.isoformat(),
+        'updated_at': datetime.now().isoformat(),
+        'source': source
+    }
+
+
+class QuoteProvider:
+    """
+    Interface de provedor de cotações.
+
+    Tickers são sempre códigos B3 sem sufixo (ex: PETR4).
+    """
+
+    name = "base"
+
+    def fetch_many(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Cotação atual de cada ticker.
+
+        None = o provedor respondeu sem cotação (símbolo inválido, deslistado).
+        Tickers cuja requisição falhou (rede, timeout) ficam fora do resultado.
+        """
+        raise NotImplementedError
+
+    def fetch_one(self, ticker: str) -> Optional[Dict]:
+        return self.fetch_many([ticker]).get(ticker)
+
+    def fetch_bars(self, tickers: List[str], start: str, end: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Pregões diários entre start e end (inclusive), com preços como
+        negociados na data (sem ajuste por desdobros/grupamentos).
+
+        Returns:
+            ticker -> DataFrame com BAR_COLUMNS, índice = data (YYYY-MM-DD);
+            tickers sem dados ficam de fora
+        """
+        raise NotImplementedError
+
+    def fetch_history(self, tickers: List[str], start: str, end: Optional[str] = None) -> pd.DataFrame:
+        """
+        Fechamentos diários entre start e end (inclusive).
+
+        Returns:
+            DataFrame índice = data (YYYY-MM-DD), colunas = tickers
+        """
+        bars = self.fetch_bars(tickers, start, end)
+        closes = pd.DataFrame({ticker: frame['Close'] for ticker, frame in bars.items()})
+        return closes.sort_index().dropna(how='all')
+
+
+class YFinanceProvider(QuoteProvider):
+    """
+    Yahoo Finance: uma requisição `Ticker.history` por símbolo (o Yahoo não
+    tem endpoint de pregões para vários símbolos), em blocos de BATCH_SIZE
+    símbolos; blocos em paralelo via ConcurrentFetcher (limite de blocos
+    simultâneos, rate limiting e retentativas com backoff).
+
+    O ganho do lote é dispensar a requisição extra de fechamento anterior
+    (vem dos mesmos pregões), não reduzir N símbolos a uma requisição.
+    """
+
+    name = "yfinance"
+
+    def __init__(self, fetcher: Optional[ConcurrentFetcher] = None):
+        self._fetcher = fetcher or ConcurrentFetcher(
+            max_in_flight=MAX_IN_FLIGHT,
+            limiter=TokenBucket(RATE_PER_SECOND, RATE_BURST),
+            max_retries=MAX_RETRIES
+        )
+
+    @staticmethod
+    def _symbol(ticker: str) -> str:
+        """PETR4 -> PETR4.SA"""
+        ticker = ticker.upper().strip()
+        return ticker if ticker.endswith('.SA') else f'{ticker}.SA'
+
+    def _request(self, symbol: str, **kwargs) -> pd.DataFrame:
+        """
+        Pregões de um símbolo (uma requisição HTTP).
+
+        Erros de rede/timeout levantam exceção; símbolo sem pregões (inválido,
+        deslistado) devolve DataFrame vazio. yf.download não serve aqui: ele
+        engole os dois casos e devolve o símbolo vazio.
+        """
+        options = {"period": HISTORY_PERIOD, "actions": False, **kwargs}
+        frame = yf.Ticker(symbol).history(auto_adjust=False, timeout=REQUEST_TIMEOUT, **options)
+        if isinstance(frame.index, pd.DatetimeIndex) and frame.index.tz is not None:
+            frame.index = frame.index.tz_localize(None)
+        return frame
+
+    def _download(self, symbols: List[str], **kwargs) -> Dict[str, pd.DataFrame]:
+        """
+        Baixa pregões dos símbolos do bloco, em sequência.
+
+        Returns:
+            símbolo -> pregões (vazio = respondido sem dados); símbolos cuja
+            requisição falhou ficam de fora
+
+        Raises:
+            ConnectionError: todas as requisições do bloco falharam (provedor
+            fora do ar), para que o ConcurrentFetcher tente de novo com backoff
+        """
+        frames = {}
+        errors = []
+        for symbol in symbols:
+            try:
+                frames[symbol] = self._request(symbol, **kwargs)
+            except Exception as e:
+                errors.append(f"{symbol}: {e}")
+        if errors and not frames:
+            raise ConnectionError(f"Falha em {len(errors)} requisições ({errors[0]})")
+        if errors:
+            logger.warning(f"{len(errors)} de {len(symbols)} requisições falharam: {'; '.join(errors[:3])}")
+        return frames
+
+    def _download_bars(self, tickers: List[str], **kwargs) -> Tuple[Dict[str, pd.DataFrame], Set[str]]:
+        """
+        Pregões por ticker, baixados em blocos concorrentes.
+
+        Returns:
+            (ticker -> pregões, tickers respondidos); respondido sem pregões
+            (inválido, deslistado) fica fora do primeiro e dentro do segundo
+        """
+        symbols = {self._symbol(ticker): ticker for ticker in tickers}
+        ordered = list(symbols)
+        chunks = [tuple(ordered[i:i + BATCH_SIZE]) for i in range(0, len(ordered), BATCH_SIZE)]
+        responses = self._fetcher.map(lambda chunk: self._download(list(chunk), **kwargs), chunks)
+
+        bars = {}
+        answered = set()
+        for frames in responses.values():
+            for symbol, frame in (frames or {}).items():
+                answered.add(symbols[symbol])
+                if 'Close' in frame and frame['Close'].notna().any():
+                    bars[symbols[symbol]] = frame
+        return bars, answered
+
+    def fetch_many(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
+        bars_by_ticker, answered = self._download_bars(tickers)
+        results = {ticker: None for ticker in tickers if ticker in answered}
+        for ticker, bars in bars_by_ticker.items():
+            try:
+                results[ticker] = quote_from_bars(ticker, bars, self.name)
+            except Exception as e:
+                logger.error(f"Erro ao processar cotação de {ticker}: {str(e)}")
+        return results
+
+    def fetch_bars(self, tickers: List[str], start: str, end: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+        # Baixa até hoje: desdobros posteriores a `end` também ajustam os preços
+        bars = {}
+        downloaded, _ = self._download_bars(tickers, period=None, start=start, actions=True)
+        for ticker, frame in downloaded.items():
+            frame = unadjust_splits(frame).dropna(subset=['Close'])
+            frame.index = pd.to_datetime(frame.index).strftime('%Y-%m-%d')
+            if end:
+                frame = frame[frame.index <= end]
+            if not frame.empty:
+                bars[ticker] = frame
+        return bars
+
+
+class FileQuoteProvider(QuoteProvider):
+    """
+    Cotações de um arquivo local (CSV ou Parquet) com pregões diários.
+
+    Colunas: ticker, date, close e, opcionalmente, open, high, low, volume.
+    Com `as_of`, as cotações são as vigentes naquela data (último pregão
+    <= as_of), o que torna testes e benchmarks reprodutíveis; sem `as_of`,
+    usa o último pregão do arquivo.
+    """
+
+    name = "file"
+
+    def __init__(self, path: str, as_of: Optional[str] = None):
+        self.path = path
+        self.as_of = as_of
+        self._bars: Optional[pd.DataFrame] = None
+
+    def _load(self) -> pd.DataFrame:
+        if self._bars is None:
+            if self.path.lower().endswith('.parquet'):
+                df = pd.read_parquet(self.path)
+            else:
+                df = pd.read_csv(self.path, dtype={'ticker': str, 'date': str})
+            df.columns = [str(c).strip().lower() for c in df.columns]
+            missing = {'ticker', 'date', 'close'} - set(df.columns)
+            if missing:
+                raise ValueError(f"Arquivo de cotações {self.path} sem colunas: {', '.join(sorted(missing))}")
+
+            df['ticker'] = df['ticker'].str.upper().str.strip().str.replace('.SA', '', regex=False)
+            df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+            df['close'] = pd.to_numeric(df['close'], errors='coerce')
+            for column in ('open', 'high', 'low'):
+                df[column] = pd.to_numeric(df[column], errors='coerce') if column in df else df['close']
+            df['volume'] = pd.to_numeric(df['volume'], errors='coerce').fillna(0) if 'volume' in df else 0
+            df = df.rename(columns={c.lower(): c for c in BAR_COLUMNS})
+            self._bars = df.sort_values(['ticker', 'date']).set_index('date')
+        return self._bars
+
+    def fetch_many(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
+        bars = self._load()
+        if self.as_of:
+            bars = bars[bars.index <= self.as_of]
+        wanted = bars[bars['ticker'].isin(tickers)]
+
+        results = {ticker: None for ticker in tickers}
+        for ticker, frame in wanted.groupby('ticker', sort=False):
+            results[ticker] = quote_from_bars(ticker, frame.tail(2)[BAR_COLUMNS], self.name)
+        return results
+
+    def fetch_bars(self, tickers: List[str], start: str, end: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+        bars = self._load()
+        end = min(filter(None, (end, self.as_of)), default=None)
+        mask = bars['ticker'].isin(tickers) & (bars.index >= start)
+        if end:
+            mask &= bars.index <= end
+        return {
+            ticker: frame[~frame.index.duplicated(keep='last')][BAR_COLUMNS]
+            for ticker, frame in bars[mask].groupby('ticker', sort=False)
+        }
+
+
+class FallbackQuoteProvider(QuoteProvider):
+    """
+    Cadeia de provedores: cada um busca apenas os tickers que os anteriores
+    não resolveram (sem cotação ou com erro).
+    """
+
+    def __init__(self, providers: List[QuoteProvider]):
+        if not providers:
+            raise ValueError("FallbackQuoteProvider requer ao menos um provedor")
+        self.providers = providers
+        self.name = "+".join(p.name for p in providers)
+
+    def fetch_many(self, tickers: List[str]) -> Dict[str, Optional[Dict]]:
+        results = {}
+        pending = list(dict.fromkeys(tickers))
+        for provider in self.providers:
+            if not pending:
+                break
+            try:
+                fetched = provider.fetch_many(pending)
+            except Exception as e:
+                logger.warning(f"Provedor {provider.name} falhou: {e}")
+                continue
+            results.update((t, q) for t, q in fetched.items() if q is not None or t not in results)
+            pending = [t for t in pending if results.get(t) is None]
+            if pending and provider is not self.providers[-1]:
+                logger.info(f"{len(pending)} tickers sem cotação em {provider.name}; tentando próximo provedor")
+        return results
+
+    def fetch_bars(self, tickers: List[str], start: str, end: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+        bars = {}
+        pending = list(tickers)
+        for provider in self.providers:
+            if not pending:
+                break
+            try:
+                bars.update(provider.fetch_bars(pending, start, end))
+            except Exception as e:
+                logger.warning(f"Provedor {provider.name} falhou ao buscar histórico: {e}")
+                continue
+            pending = [t for t in pending if t not in bars]
+        return bars
+
+
+def build_quote_provider(spec: Optional[str] = None) -> QuoteProvider:
+    """
+    Monta o provedor a partir da configuração.
+
+    Args:
+        spec: Lista separada por vírgula, em ordem de prioridade (padrão:
+              env QUOTES_PROVIDER ou "yfinance"). Valores: yfinance, file.
+              O provedor "file" usa QUOTES_FILE_PATH e QUOTES_FILE_AS_OF.
+
+    Exemplo: QUOTES_PROVIDER=yfinance,file (arquivo cobre falhas do Yahoo)
+    """
+    spec = spec or os.getenv("QUOTES_PROVIDER", "yfinance")
+    providers = []
+    for name in (part.strip().lower() for part in spec.split(",") if part.strip()):
+        if name == "yfinance":
+            providers.append(YFinanceProvider())
+        elif name == "file":
+            path = os.getenv("QUOTES_FILE_PATH")
+            if not path:
+                raise ValueError("QUOTES_FILE_PATH é obrigatório para o provedor 'file'")
+            providers.append(FileQuoteProvider(path, as_of=os.getenv("QUOTES_FILE_AS_OF") or None))
+        else:
+            raise ValueError(f"Provedor de cotações desconhecido: {name}")
+
+    if not providers:
+        raise ValueError("Nenhum provedor de cotações configurado")
+    return providers[0] if len(providers) == 1 else FallbackQuoteProvider(providers)
@@ -0,0 +1,198 @@
+"""
+Agendador de atualização de cotações dentro da aplicação.
+
+Substitui o cron fixo (`*/15 9-18 * * 1-5`) usando o calendário da B3:
+- Durante o pregão: atualiza a cada `interval` minutos
+- Após o fechamento: uma atualização de fechamento ("settle") por dia de
+  pregão, `settle_delay` minutos depois do fim da sessão, que também grava
+  o pregão do dia no histórico (quote_history)
+- Fora do pregão (noite, fim de semana, feriado): dorme até a próxima abertura
+
+Tickers são enviados ao provedor em ordem decrescente de valor da posição,
+para que os blocos das maiores posições sejam buscados primeiro. `status()` informa
+o atraso (lag) entre o horário agendado e o início de cada execução.
+
+Com vários workers, todos iniciam o agendador mas só o líder (LeaderLease
+"quote-scheduler") consulta o provedor; os demais aguardam para assumir se
+o líder parar de renovar a liderança e leem as cotações pelo banco.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.repositories import quotes_repository
+from app.repositories.quotes_repository import QUOTED_ASSET_CLASSES
+from app.repositories.assets_repository import list_assets
+from app.services.leases import LeaderLease
+from app.services.market_calendar import B3Calendar
+from app.services.market_data_service import MarketDataService
+from app.services.quote_history import backfill_history
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_INTERVAL_MINUTES = int(os.getenv("QUOTES_SCHEDULER_INTERVAL_MINUTES", "15"))
+SCHEDULER_SETTLE_DELAY_MINUTES = int(os.getenv("QUOTES_SCHEDULER_SETTLE_DELAY_MINUTES", "20"))
+# Espera máxima entre reavaliações do plano (mudança de relógio, parada)
+MAX_SLEEP_SECONDS = 3600
+
+
+def prioritize_by_value(positions: Dict[str, float], quotes: Dict[str, Dict]) -> List[str]:
+    """
+    Ordena tickers por valor da posição (quantidade × último preço), maior primeiro.
+
+    Tickers sem cotação conhecida vêm antes: não há valor para exibir e a
+    busca deles é a mais urgente.
+    """
+    def value(ticker: str) -> float:
+        price = (quotes.get(ticker) or {}).get('price')
+        return float('inf') if price is None else positions[ticker] * price
+
+    return sorted(positions, key=lambda ticker: (-value(ticker), ticker))
+
+
+class QuoteRefreshScheduler:
+    def __init__(
+        self,
+        service: MarketDataService,
+        calendar: Optional[B3Calendar] = None,
+        interval_minutes: int = SCHEDULER_INTERVAL_MINUTES,
+        settle_delay_minutes: int = SCHEDULER_SETTLE_DELAY_MINUTES
+    ):
+        self.service = service
+        self.calendar = calendar or service.calendar
+        self.interval = timedelta(minutes=interval_minutes)
+        self.settle_delay = timedelta(minutes=settle_delay_minutes)
+        self._last_run_at: Optional[datetime] = None
+        self._settled_day: Optional[date] = None
+        self._last_run: Dict = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.lease = LeaderLease("quote-scheduler")
+
+    def next_run(self, now: Optional[datetime] = None) -> Tuple[datetime, str]:
+        """
+        Próxima execução planejada: (horário, modo).
+
+        Modos: "session" (durante o pregão) e "settle" (após o fechamento).
+        Um horário no passado significa execução imediata.
+        """
+        now = self.calendar._local(now or self.calendar.now())
+        session = self.calendar.session(now.date())
+
+        if session and now >= session[0]:
+            opens, closes = session
+            if now < closes:
+                if self._last_run_at is None or self._last_run_at < opens:
+                    return now, "session"
+                due = self._last_run_at + self.interval
+                if due < closes:
+                    return due, "session"
+            if self._settled_day != now.date():
+                return closes + self.settle_delay, "settle"
+
+        return self.calendar.next_open(now), "session"
+
+    def prioritized_tickers(self) -> List[str]:
+        """Tickers com posição negociados em bolsa, maiores posições primeiro."""
+        positions = {
+            asset['ticker']: asset['current_position']
+            for asset in list_assets()
+            if asset.get('current_position', 0) > 0
+            and asset.get('asset_class') in QUOTED_ASSET_CLASSES
+        }
+        return prioritize_by_value(positions, quotes_repository.get_quotes(list(positions)))
+
+    def run_once(self, mode: str = "manual", scheduled_at: Optional[datetime] = None) -> Dict:
+        """Atualiza as cotações de todas as posições e registra a execução."""
+        with self._lock:
+            started_at = self.calendar.now()
+            scheduled_at = scheduled_at or started_at
+            started = time.monotonic()
+            refreshed = failed = history_rows = 0
+            error = None
+
+            try:
+                tickers = self.prioritized_tickers()
+                # Uma chamada: os blocos do provedor saem em ordem de prioridade
+                # e todas as cotações são gravadas em um único commit
+                quotes = self.service.get_batch_quotes(tickers, force_refresh=True)
+                refreshed = sum(1 for ticker in tickers if quotes.get(ticker))
+                failed = len(tickers) - refreshed
+                if self.lease.is_leader:
+                    # Execuções longas não podem deixar a liderança expirar
+                    self.lease.acquire()
+                if mode == "settle":
+                    history_rows = backfill_history(tickers, provider=self.service.provider)["rows"]
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Erro na atualização agendada de cotações ({mode}): {e}", exc_info=True)
+
+            self._last_run_at = started_at
+            if mode == "settle":
+                self._settled_day = self.calendar._local(scheduled_at).date()
+
+            self._last_run = {
+                "mode": mode,
+                "scheduled_at": scheduled_at.isoformat(),
+                "started_at": started_at.isoformat(),
+                "lag_seconds": round(max((started_at - scheduled_at).total_seconds(), 0.0), 1),
+                "duration_seconds": round(time.monotonic() - started, 2),
+                "refreshed": refreshed,
+                "failed": failed,
+                "history_rows": history_rows,
+                "error": error
+            }
+            logger.info(
+                f"Cotações atualizadas ({mode}): {refreshed} ok, {failed} falhas, "
+                f"lag {self._last_run['lag_seconds']}s"
+            )
+            return self._last_run
+
+    def _loop(self) -> None:
+        # O líder acorda a cada terço do TTL para renovar a liderança
+        max_sleep = min(MAX_SLEEP_SECONDS, self.lease.ttl_seconds / 3)
+        while not self._stop.is_set():
+            if not self.lease.acquire():
+                self._stop.wait(self.lease.ttl_seconds / 2)
+                continue
+            run_at, mode = self.next_run()
+            wait = (run_at - self.calendar.now()).total_seconds()
+            if wait > 0:
+                if self._stop.wait(min(wait, max_sleep)) or wait > max_sleep:
+                    continue
+            self.run_once(mode, scheduled_at=run_at)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="quote-refresh-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Agendador de cotações iniciado (intervalo {self.interval}, settle +{self.settle_delay})")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.lease.release()
+
+    def status(self) -> Dict:
+        now = self.calendar.now()
+        next_at, next_mode = self.next_run(now)
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            **self.lease.status(),
+            "market_open": self.calendar.is_open(now),
+            "interval_minutes": self.interval.total_seconds() / 60,
+            "next_run_at": next_at.isoformat(),
+            "next_mode": next_mode,
+            # Quanto a próxima execução já está atrasada (0 se ainda no futuro)
+            "behind_seconds": round(max((now - next_at).total_seconds(), 0.0), 1),
+            "last_run": self._last_run or None
+        }
@@ -8,17 +8,26 @@ Responsável por:
 - Aplicar ajustes automáticos
 """
 
+import json
 import logging
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional
 from io import BytesIO
 
-from app.db.database import get_db
-from app.services.importer import normalize_ticker, classify_asset
+from app.db.database import get_db, chunked
+from app.repositories import snapshots_repository
+from app.services.importer import classify_asset, read_b3_file
+from app.services.position_engine import get_positions, get_positions_as_of
 
 logger = logging.getLogger(__name__)
 
+# Prefixos de produtos de renda fixa ("CDB - CDB124AUGT1 - BANCO X")
+FIXED_INCOME_PREFIXES = ["CDB", "LCI", "LCA", "CRI", "CRA", "Debênture", "Debenture"]
+
+# Lotes de snapshot mais antigos que isso são reduzidos a um por mês
+SNAPSHOT_RETENTION_DAYS = 90
+
 
 def extract_ticker_from_product(produto):
     """
@@ -39,7 +48,7 @@ def extract_ticker_from_product(produto):
     parts = produto_str.split(" - ")
     
     # Tipos de renda fixa
-    if parts[0] in ["CDB", "LCI", "LCA", "CRI", "CRA", "Debênture", "Debenture"]:
+    if parts[0] in FIXED_INCOME_PREFIXES:
         return parts[1].strip() if len(parts) > 1 else produto_str
     else:
         # Ações, FIIs, ETFs: primeira parte
@@ -47,24 +56,68 @@ def extract_ticker_from_product(produto):
 
 
 
+def extract_tickers_from_products(produtos: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de `extract_ticker_from_product` + normalização
+    (strip/upper), para uma coluna inteira do arquivo de posição.
+    """
+    text = produtos.astype(str).str.strip()
+    parts = text.str.split(" - ", n=2, expand=True, regex=False)
+    first = parts[0].str.strip()
+    second = parts[1].str.strip() if 1 in parts.columns else pd.Series(None, index=text.index, dtype=object)
+    
+    is_fixed_income = parts[0].isin(FIXED_INCOME_PREFIXES) & second.notna()
+    tickers = first.where(~is_fixed_income, second)
+    tickers = tickers.where(text.str.contains(" - ", regex=False), text)
+    return tickers.str.strip().str.upper()
+
+
+def _upsert_assets(cursor, tickers: List[str]) -> Dict[str, int]:
+    """
+    Busca os IDs dos tickers informados, criando em lote os que não existem.
+    
+    Returns:
+        Dicionário ticker -> asset_id
+    """
+    asset_ids = {}
+    for chunk in chunked(tickers):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT ticker, id FROM assets WHERE ticker IN ({placeholders})", chunk)
+        asset_ids.update(cursor.fetchall())
+    
+    missing = [t for t in tickers if t not in asset_ids]
+    if missing:
+        now = datetime.utcnow().isoformat()
+        cursor.executemany("""
+            INSERT OR IGNORE INTO assets (ticker, asset_class, asset_type, product_name, created_at, status)
+            VALUES (?, ?, ?, ?, ?, 'ACTIVE')
+        """, [(t, *classify_asset(t), t, now) for t in missing])
+        for chunk in chunked(missing):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT ticker, id FROM assets WHERE ticker IN ({placeholders})", chunk)
+            asset_ids.update(cursor.fetchall())
+        logger.info(f"{len(missing)} ativos criados a partir do snapshot de posição")
+    
+    return asset_ids
+
+
 def import_position_snapshot(file) -> Dict:
     """
-    Importa arquivo de posição B3 (posicao-*.xlsx) e cria snapshot.
+    Importa arquivo de posição B3 (posicao-*.xlsx) e cria um lote de snapshot.
+    
+    Apenas quantidades diferentes do último snapshot de cada ativo são
+    gravadas em position_snapshots; o ponteiro position_snapshot_latest é
+    atualizado para todos os ativos do arquivo.
     
     Args:
-        file: UploadFile com arquivo Excel de posição
+        file: UploadFile com arquivo de posição (Excel, CSV ou Parquet)
     
     Returns:
         Dicionário com resumo da importação e discrepâncias encontradas
     """
     logger.info(f"Importando snapshot de posição: {file.filename}")
     
-    try:
-        df = pd.read_excel(file.file)
-        logger.debug(f"Arquivo lido: {len(df)} linhas")
-    except Exception as e:
-        logger.error(f"Erro ao ler arquivo: {e}")
-        raise ValueError(f"Arquivo Excel inválido: {e}")
+    df = read_b3_file(file)
     
     # Validar colunas obrigatórias
     required = ['Código de Negociação', 'Quantidade']
@@ -74,181 +127,306 @@ def import_position_snapshot(file) -> Dict:
     
     # Filtrar linhas válidas
     df = df[df['Código de Negociação'].notna()].copy()
+    total_positions = len(df)
     
     snapshot_date = datetime.now().isoformat()
-    snapshots_created = 0
     discrepancies = []
     
+    # Ticker e quantidade de todas as linhas de uma vez
+    df['ticker'] = extract_tickers_from_products(df['Código de Negociação'])
+    df['qty_b3'] = pd.to_numeric(df['Quantidade'], errors='coerce')
+    invalid = df['qty_b3'].isna() | (df['ticker'] == "")
+    if invalid.any():
+        logger.warning(f"{int(invalid.sum())} linhas ignoradas (ticker ou quantidade inválidos)")
+        df = df[~invalid]
+    snapshots_created = len(df)
+    
+    # Mesmo ativo em várias instituições: soma as quantidades
+    qty_by_ticker = df.groupby('ticker', sort=False)['qty_b3'].sum()
+    
     with get_db() as conn:
         cursor = conn.cursor()
         
-        for idx, row in df.iterrows():
-            try:
-                # Extrair ticker limpo
-                ticker_raw = row['Código de Negociação']
-                ticker = extract_ticker_from_product(ticker_raw)
-                ticker = normalize_ticker(ticker, "")
-                
-                qty_b3 = float(row['Quantidade'])
-                
-                # Buscar ou criar ativo
-                cursor.execute("SELECT id FROM assets WHERE ticker = ?", (ticker,))
-                result = cursor.fetchone()
-                
-                if not result:
-                    # Criar ativo se não existe
-                    asset_class, asset_type = classify_asset(ticker)
-                    cursor.execute("""
-                        INSERT INTO assets (ticker, asset_class, asset_type, product_name, created_at, status)
-                        VALUES (?, ?, ?, ?, ?, 'ACTIVE')
-                    """, (ticker, asset_class, asset_type, ticker, datetime.utcnow().isoformat()))
-                    asset_id = cursor.lastrowid
-                    logger.info(f"Ativo criado: {ticker} (ID {asset_id})")
-                else:
-                    asset_id = result[0]
-                
-                # Criar snapshot
-                cursor.execute("""
-                    INSERT INTO position_snapshots (asset_id, quantity, snapshot_date, source, created_at)
-                    VALUES (?, ?, ?, 'B3', ?)
-                """, (asset_id, qty_b3, snapshot_date, datetime.utcnow().isoformat()))
-                
-                snapshots_created += 1
-                
-                # Calcular posição no sistema
-                qty_sistema = calculate_position_by_asset_id(cursor, asset_id)
-                
-                # Registrar discrepância
-                diff = qty_sistema - qty_b3
-                if abs(diff) > 0.01:
-                    discrepancies.append({
-                        "ticker": ticker,
-                        "qty_b3": qty_b3,
-                        "qty_sistema": qty_sistema,
-                        "difference": diff,
-                        "error_pct": (diff / qty_b3 * 100) if qty_b3 > 0 else 0
-                    })
-                
-            except Exception as e:
-                logger.error(f"Erro ao processar linha {idx} ({ticker_raw}): {e}")
-                continue
+        asset_ids = _upsert_assets(cursor, list(qty_by_ticker.index))
+        quantities = {asset_ids[t]: float(q) for t, q in qty_by_ticker.items()}
+        tickers = {asset_ids[t]: t for t in qty_by_ticker.index}
+        
+        # Lote do snapshot: grava só as quantidades alteradas e o último snapshot por ativo
+        batch = snapshots_repository.save_snapshot_batch(
+            cursor, quantities, snapshot_date, filename=file.filename
+        )
+    
+    apply_snapshot_retention()
+    
+    # Posições do sistema para todos os ativos do snapshot (após o commit,
+    # pois o engine atualiza o próprio cache)
+    positions = get_system_positions(list(quantities))
+    
+    for asset_id, qty_b3 in quantities.items():
+        ticker = tickers[asset_id]
+        qty_sistema = positions.get(asset_id, 0)
+        
+        # Registrar discrepância
+        diff = qty_sistema - qty_b3
+        if abs(diff) > 0.01:
+            discrepancies.append({
+                "ticker": ticker,
+                "qty_b3": qty_b3,
+                "qty_sistema": qty_sistema,
+                "difference": diff,
+                "error_pct": (diff / qty_b3 * 100) if qty_b3 > 0 else 0
+            })
     
     logger.info(f"Snapshot importado: {snapshots_created} posições, {len(discrepancies)} discrepâncias")
     
     return {
         "status": "success",
         "snapshot_date": snapshot_date,
-        "total_positions": len(df),
+        "batch_id": batch["batch_id"],
+        "total_positions": total_positions,
         "snapshots_created": snapshots_created,
+        "changed_positions": batch["changed_positions"],
         "discrepancies_found": len(discrepancies),
         "discrepancies": sorted(discrepancies, key=lambda x: abs(x['difference']), reverse=True)[:20]
     }
 
 
-def calculate_position_by_asset_id(cursor, asset_id: int) -> float:
+def apply_snapshot_retention(keep_days: int = SNAPSHOT_RETENTION_DAYS) -> Dict:
+    """
+    Aplica a política de retenção de snapshots: lotes com mais de
+    `keep_days` dias são reduzidos a um lote por mês.
+    
+    Returns:
+        Resumo da retenção (lotes removidos, alterações movidas)
+    """
+    cutoff = (datetime.now() - timedelta(days=keep_days)).isoformat()
+    with get_db() as conn:
+        return snapshots_repository.downsample_snapshot_batches(conn.cursor(), cutoff)
+
+
+def get_system_positions(asset_ids: List[int]) -> Dict[int, float]:
     """
-    Calcula posição atual de um ativo baseado nas operações.
+    Quantidade atual de cada ativo segundo o engine de posições.
+    
+    Usa o cache do engine (recalcula só ativos com operações alteradas), de
+    modo que os números batem com `/assets/{ticker}/position`. Deve ser
+    chamada fora de transações de escrita, pois o engine grava o cache.
     
     Args:
-        cursor: Cursor do banco de dados
-        asset_id: ID do ativo
+        asset_ids: IDs dos ativos
     
     Returns:
-        Quantidade atual (compras - vendas)
+        Dicionário asset_id -> quantidade
     """
-    cursor.execute("""
-        SELECT 
-            SUM(CASE WHEN movement_type = 'COMPRA' THEN quantity ELSE 0 END) as compras,
-            SUM(CASE WHEN movement_type = 'VENDA' THEN quantity ELSE 0 END) as vendas
-        FROM operations
-        WHERE asset_id = ? AND status = 'ACTIVE'
-    """, (asset_id,))
-    
-    result = cursor.fetchone()
-    if result:
-        compras = result[0] or 0
-        vendas = result[1] or 0
-        return compras - vendas
-    return 0
+    positions = get_positions(asset_ids)
+    return {asset_id: position["quantity"] for asset_id, position in positions.items()}
 
 
-def get_reconciliation_diagnosis() -> Dict:
+def get_reconciliation_diagnosis(history: bool = False) -> Dict:
     """
     Gera diagnóstico completo de reconciliação.
     
-    Compara último snapshot B3 com posições calculadas,
+    Compara cada snapshot B3 com a posição calculada na data do snapshot
+    (operações lançadas depois dele não geram falsas discrepâncias),
     identificando discrepâncias e sugerindo correções.
     
+    Args:
+        history: Se True, reconcilia também cada alteração de quantidade
+                 registrada nos lotes históricos; senão, apenas o último
+                 snapshot de cada ativo
+    
     Returns:
         Dicionário com diagnóstico completo
     """
-    logger.info("Gerando diagnóstico de reconciliação")
+    logger.info(f"Gerando diagnóstico de reconciliação{' (histórico)' if history else ''}")
     
     with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Buscar último snapshot de cada ativo
-        cursor.execute("""
-            SELECT 
-                a.id,
-                a.ticker,
-                a.asset_class,
-                ps.quantity as qty_snapshot,
-                ps.snapshot_date
-            FROM assets a
-            INNER JOIN (
-                SELECT asset_id, quantity, snapshot_date,
-                       ROW_NUMBER() OVER (PARTITION BY asset_id ORDER BY snapshot_date DESC) as rn
-                FROM position_snapshots
-            ) ps ON a.id = ps.asset_id AND ps.rn = 1
-            WHERE a.status = 'ACTIVE' AND a.asset_class IN ('AÇÕES', 'FII', 'ETF')
-        """)
-        
-        snapshots = cursor.fetchall()
-        
-        if not snapshots:
-            return {
-                "status": "no_snapshots",
-                "message": "Nenhum snapshot de posição encontrado. Importe arquivo de posição B3 primeiro."
-            }
-        
-        issues = []
-        total_diff = 0
-        
-        for asset_id, ticker, asset_class, qty_snapshot, snapshot_date in snapshots:
-            qty_sistema = calculate_position_by_asset_id(cursor, asset_id)
-            diff = qty_sistema - qty_snapshot
-            
-            if abs(diff) > 0.01:
-                # Analisar causa da discrepância
-                causes = analyze_discrepancy(cursor, asset_id, ticker, diff)
-                
-                issues.append({
-                    "asset_id": asset_id,
-                    "ticker": ticker,
-                    "asset_class": asset_class,
-                    "qty_expected": qty_snapshot,
-                    "qty_calculated": qty_sistema,
-                    "difference": diff,
-                    "error_pct": (diff / qty_snapshot * 100) if qty_snapshot > 0 else 0,
-                    "snapshot_date": snapshot_date,
-                    "possible_causes": causes,
-                    "suggested_action": suggest_correction(diff, causes)
-                })
-                
-                total_diff += abs(diff)
+        # Lock de escrita: o engine pode atualizar o cache de posições
+        conn.execute("BEGIN IMMEDIATE")
+        return _diagnose(conn.cursor(), history)
+
+
+def _diagnose(cursor, history: bool = False) -> Dict:
+    """Diagnóstico de reconciliação sobre um cursor em transação de escrita."""
+    # Último snapshot de cada ativo: leitura direta do ponteiro mantido na
+    # importação. No histórico, também todas as alterações gravadas.
+    history_rows = """
+            UNION
+            SELECT asset_id, quantity, snapshot_date FROM position_snapshots
+    """ if history else ""
+    cursor.execute(f"""
+        SELECT 
+            a.id,
+            a.ticker,
+            a.asset_class,
+            ps.quantity as qty_snapshot,
+            ps.snapshot_date
+        FROM assets a
+        INNER JOIN (
+            SELECT asset_id, quantity, snapshot_date FROM position_snapshot_latest
+            {history_rows}
+        ) ps ON a.id = ps.asset_id
+        WHERE a.status = 'ACTIVE' AND a.asset_class IN ('AÇÕES', 'FII', 'ETF')
+        ORDER BY ps.snapshot_date DESC, a.id
+    """)
+    
+    snapshots = cursor.fetchall()
+    
+    if not snapshots:
+        return {
+            "status": "no_snapshots",
+            "message": "Nenhum snapshot de posição encontrado. Importe arquivo de posição B3 primeiro."
+        }
+    
+    issues = []
+    total_diff = 0
+    
+    # Posição de cada ativo na data de cada snapshot (checkpoints + replay
+    # limitado), na mesma transação do chamador
+    positions = get_positions_as_of(
+        ((asset_id, snapshot_date[:10]) for asset_id, _, _, _, snapshot_date in snapshots),
+        cursor=cursor
+    )
+    
+    # Diferenças agrupadas por data de snapshot (uma análise em lote por data)
+    diffs_by_date = {}
+    for asset_id, _, _, qty_snapshot, snapshot_date in snapshots:
+        diff = positions[(asset_id, snapshot_date[:10])]["quantity"] - qty_snapshot
+        if abs(diff) > 0.01:
+            diffs_by_date.setdefault(snapshot_date, {})[asset_id] = diff
+    
+    # Analisar causas de todas as discrepâncias em lote
+    causes_by_date = {
+        snapshot_date: analyze_discrepancies(cursor, diffs)
+        for snapshot_date, diffs in diffs_by_date.items()
+    }
+    
+    for asset_id, ticker, asset_class, qty_snapshot, snapshot_date in snapshots:
+        if asset_id not in diffs_by_date.get(snapshot_date, {}):
+            continue
         
-        snapshot_date = snapshots[0][4] if snapshots else None
+        qty_sistema = positions[(asset_id, snapshot_date[:10])]["quantity"]
+        diff = diffs_by_date[snapshot_date][asset_id]
+        causes = causes_by_date[snapshot_date][asset_id]
         
-        return {
-            "status": "success",
+        issues.append({
+            "asset_id": asset_id,
+            "ticker": ticker,
+            "asset_class": asset_class,
+            "qty_expected": qty_snapshot,
+            "qty_calculated": qty_sistema,
+            "difference": diff,
+            "error_pct": (diff / qty_snapshot * 100) if qty_snapshot > 0 else 0,
             "snapshot_date": snapshot_date,
-            "total_assets": len(snapshots),
-            "assets_with_issues": len(issues),
-            "assets_ok": len(snapshots) - len(issues),
-            "total_difference": total_diff,
-            "issues": sorted(issues, key=lambda x: abs(x['difference']), reverse=True)
-        }
+            "possible_causes": causes,
+            "suggested_action": suggest_correction(diff, causes)
+        })
+        
+        total_diff += abs(diff)
+    
+    snapshot_date = snapshots[0][4] if snapshots else None
+    total_assets = len({s[0] for s in snapshots})
+    assets_with_issues = len({i["asset_id"] for i in issues})
+    
+    return {
+        "status": "success",
+        "snapshot_date": snapshot_date,
+        "total_assets": total_assets,
+        "total_snapshots": len(snapshots),
+        "assets_with_issues": assets_with_issues,
+        "assets_ok": total_assets - assets_with_issues,
+        "total_difference": total_diff,
+        "issues": sorted(issues, key=lambda x: abs(x['difference']), reverse=True)
+    }
+
+
+def _detect_null_subtypes(cursor, diffs: Dict[int, float]) -> Dict[int, List[str]]:
+    """Operações com subtype NULL (possível atualização importada)."""
+    causes = {}
+    for chunk in chunked(list(diffs)):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, COUNT(*) FROM operations 
+            WHERE asset_id IN ({placeholders}) AND operation_subtype IS NULL
+            GROUP BY asset_id
+        """, chunk)
+        for asset_id, null_subtypes in cursor.fetchall():
+            causes[asset_id] = [f"{null_subtypes} operações sem subtipo (podem ser atualizações)"]
+    return causes
+
+
+def _detect_same_day_operations(cursor, diffs: Dict[int, float]) -> Dict[int, List[str]]:
+    """Datas com mais de duas operações (até 3 datas por ativo)."""
+    dates_by_asset = {}
+    for chunk in chunked(list(diffs)):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, trade_date, cnt
+            FROM (
+                SELECT asset_id, trade_date, COUNT(*) as cnt,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY asset_id ORDER BY COUNT(*) DESC, trade_date
+                       ) as rn
+                FROM operations
+                WHERE asset_id IN ({placeholders})
+                GROUP BY asset_id, trade_date
+                HAVING cnt > 2
+            )
+            WHERE rn <= 3
+            ORDER BY asset_id, rn
+        """, chunk)
+        for asset_id, trade_date, cnt in cursor.fetchall():
+            dates_by_asset.setdefault(asset_id, []).append(f"{trade_date} ({cnt} ops)")
+    
+    return {
+        asset_id: [f"Múltiplas operações em: {', '.join(dates)}"]
+        for asset_id, dates in dates_by_asset.items()
+    }
+
+
+def _detect_round_lot_difference(cursor, diffs: Dict[int, float]) -> Dict[int, List[str]]:
+    """Diferença positiva múltipla de 100 (possível duplicação)."""
+    return {
+        asset_id: ["Diferença é múltiplo de 100 (possível duplicação sistemática)"]
+        for asset_id, diff in diffs.items()
+        if diff > 0 and diff % 100 == 0
+    }
+
+
+# Detectores de causas, executados em lote para todos os ativos com
+# discrepância. Cada um recebe (cursor, {asset_id: diff}) e retorna
+# {asset_id: [causas]}; a ordem da lista é a ordem das causas no diagnóstico.
+DISCREPANCY_DETECTORS = [
+    _detect_null_subtypes,
+    _detect_same_day_operations,
+    _detect_round_lot_difference,
+]
+
+
+def analyze_discrepancies(cursor, diffs: Dict[int, float]) -> Dict[int, List[str]]:
+    """
+    Analisa possíveis causas das discrepâncias de vários ativos de uma vez.
+    
+    Args:
+        cursor: Cursor do banco
+        diffs: Dicionário asset_id -> diferença (sistema - B3)
+    
+    Returns:
+        Dicionário asset_id -> lista de possíveis causas
+    """
+    causes = {asset_id: [] for asset_id in diffs}
+    if not diffs:
+        return causes
+    
+    for detector in DISCREPANCY_DETECTORS:
+        for asset_id, found in detector(cursor, diffs).items():
+            causes[asset_id].extend(found)
+    
+    for asset_causes in causes.values():
+        if not asset_causes:
+            asset_causes.append("Causa não identificada automaticamente")
+    
+    return causes
 
 
 def analyze_discrepancy(cursor, asset_id: int, ticker: str, diff: float) -> List[str]:
@@ -264,42 +442,7 @@ def analyze_discrepancy(cursor, asset_id: int, ticker: str, diff: float) -> List
     Returns:
         Lista de possíveis causas
     """
-    causes = []
-    
-    # Verificar se há operações com subtype NULL (possível atualização importada)
-    cursor.execute("""
-        SELECT COUNT(*) FROM operations 
-        WHERE asset_id = ? AND operation_subtype IS NULL
-    """, (asset_id,))
-    
-    null_subtypes = cursor.fetchone()[0]
-    if null_subtypes > 0:
-        causes.append(f"{null_subtypes} operações sem subtipo (podem ser atualizações)")
-    
-    # Verificar múltiplas operações na mesma data
-    cursor.execute("""
-        SELECT trade_date, COUNT(*) as cnt
-        FROM operations
-        WHERE asset_id = ?
-        GROUP BY trade_date
-        HAVING cnt > 2
-        ORDER BY cnt DESC
-        LIMIT 3
-    """, (asset_id,))
-    
-    duplicates = cursor.fetchall()
-    if duplicates:
-        dates = [f"{d[0]} ({d[1]} ops)" for d in duplicates]
-        causes.append(f"Múltiplas operações em: {', '.join(dates)}")
-    
-    # Verificar se diferença é múltiplo inteiro (possível duplicação)
-    if diff > 0 and diff % 100 == 0:
-        causes.append("Diferença é múltiplo de 100 (possível duplicação sistemática)")
-    
-    if not causes:
-        causes.append("Causa não identificada automaticamente")
-    
-    return causes
+    return analyze_discrepancies(cursor, {asset_id: diff})[asset_id]
 
 
 def suggest_correction(diff: float, causes: List[str]) -> str:
@@ -322,68 +465,143 @@ def suggest_correction(diff: float, causes: List[str]) -> str:
         return f"Sistema tem {diff:.2f} ações a menos. Sugestão: criar ajuste de +{abs(diff):.2f}"
 
 
-def auto_fix_positions(ticker: Optional[str] = None) -> Dict:
+def _active_fix_adjustments(cursor, asset_ids: List[int]) -> Dict[Tuple[int, str], float]:
+    """Saldo (com sinal) dos ajustes de reconciliação ativos por (ativo, data)."""
+    totals = {}
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT asset_id, trade_date,
+                   SUM(CASE WHEN movement_type = 'COMPRA' THEN quantity ELSE -quantity END)
+            FROM operations
+            WHERE asset_id IN ({placeholders}) AND status = 'ACTIVE'
+              AND source = 'RECONCILIATION' AND operation_subtype = 'AJUSTE_RECONCILIACAO'
+            GROUP BY asset_id, trade_date
+        """, chunk)
+        totals.update(((asset_id, trade_date), total) for asset_id, trade_date, total in cursor.fetchall())
+    return totals
+
+
+def auto_fix_positions(
+    ticker: Optional[str] = None,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = None
+) -> Dict:
     """
     Aplica correções automáticas nas posições.
     
-    Remove operações duplicadas e cria ajustes para bater com snapshot B3.
+    Diagnóstico e ajustes rodam em uma única transação de escrita, então uma
+    segunda execução concorrente já enxerga os ajustes da primeira. Os ajustes
+    são datados na data do snapshot, de modo que o diagnóstico seguinte
+    (posição na data do snapshot) fica zerado. Os triggers de operations
+    invalidam o cache de posições apenas dos ativos ajustados.
+    
+    Cada ativo fica com um único ajuste líquido por data de snapshot: se já
+    houver ajuste de reconciliação ativo na data, o novo é somado a ele (o
+    antigo é cancelado). Assim, repetir a mesma diferença na mesma data não
+    colide com o UNIQUE de operations.
     
     Args:
         ticker: Se especificado, corrige apenas este ticker. Senão, todos.
+        dry_run: Se True, retorna os ajustes que seriam criados sem gravá-los
+        idempotency_key: Chave da requisição; repetições com a mesma chave
+                         devolvem o resultado original sem novos ajustes
     
     Returns:
-        Resumo das correções aplicadas
+        Resumo das correções aplicadas (ou previstas, em dry_run)
     """
-    logger.info(f"Iniciando correção automática: {ticker or 'TODOS'}")
-    
-    diagnosis = get_reconciliation_diagnosis()
-    
-    if diagnosis['status'] != 'success':
-        return diagnosis
-    
-    issues = diagnosis['issues']
-    
-    if ticker:
-        issues = [i for i in issues if i['ticker'] == ticker]
-    
-    fixed = []
+    logger.info(f"Iniciando correção automática: {ticker or 'TODOS'}{' (dry-run)' if dry_run else ''}")
     
     with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
         cursor = conn.cursor()
         
+        if idempotency_key and not dry_run:
+            cursor.execute(
+                "SELECT result FROM reconciliation_fix_requests WHERE idempotency_key = ?",
+                (idempotency_key,)
+            )
+            row = cursor.fetchone()
+            if row:
+                logger.info(f"Auto-fix já aplicado para a chave {idempotency_key}")
+                return {**json.loads(row[0]), "replayed": True}
+        
+        diagnosis = _diagnose(cursor)
+        
+        if diagnosis['status'] != 'success':
+            return diagnosis
+        
+        issues = diagnosis['issues']
+        
+        if ticker:
+            issues = [i for i in issues if i['ticker'] == ticker]
+        
+        now = datetime.utcnow().isoformat()
+        fixed = []
+        adjustments = []
+        replaced = []
+        
+        issues = [i for i in issues if abs(i['difference']) > 0.01]
+        existing = _active_fix_adjustments(cursor, [i['asset_id'] for i in issues])
+        
         for issue in issues:
-            asset_id = issue['asset_id']
-            ticker = issue['ticker']
             diff = issue['difference']
             
             # Criar ajuste para zerar diferença
-            if abs(diff) > 0.01:
-                adjustment_qty = -diff  # Inverter sinal
-                
-                cursor.execute("""
-                    INSERT INTO operations (
-                        asset_id, trade_date, movement_type, market, institution,
-                        quantity, price, value, created_at, source, operation_subtype, notes
-                    ) VALUES (?, ?, ?, '', '', ?, 0, 0, ?, 'RECONCILIATION', 'AJUSTE_RECONCILIACAO', ?)
-                """, (
-                    asset_id,
-                    datetime.now().date().isoformat(),
-                    'COMPRA' if adjustment_qty > 0 else 'VENDA',
-                    abs(adjustment_qty),
-                    datetime.utcnow().isoformat(),
-                    f"Ajuste automático de reconciliação: {adjustment_qty:+.2f} ações"
+            adjustment_qty = -diff  # Inverter sinal
+            key = (issue['asset_id'], issue['snapshot_date'][:10])
+            previous = existing.get(key, 0)
+            net_qty = previous + adjustment_qty
+            if previous:
+                replaced.append(key)
+            if abs(net_qty) > 0.01:
+                adjustments.append((
+                    *key,
+                    'COMPRA' if net_qty > 0 else 'VENDA',
+                    abs(net_qty),
+                    now,
+                    f"Ajuste automático de reconciliação: {net_qty:+.2f} ações"
                 ))
-                
-                fixed.append({
-                    "ticker": ticker,
-                    "adjustment": adjustment_qty,
-                    "reason": f"Discrepância de {diff:+.2f} ações corrigida"
-                })
-                
-                logger.info(f"Ajuste criado: {ticker} {adjustment_qty:+.2f}")
+            entry = {
+                "ticker": issue['ticker'],
+                "adjustment": adjustment_qty,
+                "reason": f"Discrepância de {diff:+.2f} ações corrigida"
+            }
+            if previous:
+                entry["previous_adjustment"] = previous
+            fixed.append(entry)
+        
+        result = {
+            "status": "success",
+            "dry_run": dry_run,
+            "fixed_count": len(fixed),
+            "adjustments": fixed
+        }
+        
+        if dry_run:
+            return result
+        
+        cursor.executemany("""
+            UPDATE operations SET status = 'CANCELLED'
+            WHERE asset_id = ? AND trade_date = ? AND status = 'ACTIVE'
+              AND source = 'RECONCILIATION' AND operation_subtype = 'AJUSTE_RECONCILIACAO'
+        """, replaced)
+        # Um ajuste idêntico cancelado antes (mesma chave UNIQUE) é reativado
+        cursor.executemany("""
+            INSERT INTO operations (
+                asset_id, trade_date, movement_type, market, institution,
+                quantity, price, value, created_at, source, operation_subtype, notes
+            ) VALUES (?, ?, ?, '', '', ?, 0, 0, ?, 'RECONCILIATION', 'AJUSTE_RECONCILIACAO', ?)
+            ON CONFLICT (trade_date, movement_type, market, institution, asset_id, quantity, price, source)
+            DO UPDATE SET status = 'ACTIVE', operation_subtype = excluded.operation_subtype, notes = excluded.notes
+        """, adjustments)
+        
+        if idempotency_key:
+            cursor.execute("""
+                INSERT INTO reconciliation_fix_requests (idempotency_key, ticker, result, created_at)
+                VALUES (?, ?, ?, ?)
+            """, (idempotency_key, ticker, json.dumps(result), now))
     
-    return {
-        "status": "success",
-        "fixed_count": len(fixed),
-        "adjustments": fixed
-    }
+    logger.info(f"Correção automática: {len(fixed)} ajustes criados")
+    
+    return result
@@ -0,0 +1,256 @@
+"""
+Detecção de desdobros/grupamentos não registrados
+
+Procura, no histórico de preços dos ativos em carteira, saltos entre
+fechamentos próximos (até MAX_GAP_SESSIONS pregões) que batem com razões
+usuais de desdobro (1:2, 1:10, ...) ou grupamento (2:1, 10:1, ...) e que não
+têm evento correspondente (corporate_events ou operação sintética de ajuste).
+
+Fonte de preços: pregões diários de quote_history, como negociados
+(`unadjust_splits` desfaz o ajuste do Yahoo); para ativos sem histórico
+gravado, os preços das próprias operações.
+
+As sugestões saem no formato aceito por /admin/apply-corporate-events.
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.db.database import get_db, chunked
+from app.repositories.quote_history_repository import decode_date
+from app.services.market_calendar import b3_holidays
+from app.services.position_engine import get_positions, get_positions_as_of
+from app.services.quote_history import load_history
+
+logger = logging.getLogger(__name__)
+
+# Fatores usuais (quantidade nova / antiga). Grupamentos usam o inverso.
+COMMON_SPLIT_FACTORS = (2, 3, 4, 5, 8, 10, 20, 50, 100)
+
+# Distância máxima (relativa) entre o salto de preço e o fator
+DEFAULT_TOLERANCE = 0.05
+
+# Pregões máximos entre os dois fechamentos comparados: em intervalos maiores
+# o preço pode ter variado por mercado (ex.: operações do usuário com um ano
+# de distância)
+MAX_GAP_SESSIONS = 5
+
+# Subtipos de operações sintéticas que já representam o evento
+ADJUSTMENT_SUBTYPES = ("DESDOBRO", "GRUPAMENTO", "BONIFICACAO")
+
+
+def _sessions_between(previous_dates: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    """Pregões B3 de previous_date (inclusive) a date (exclusive)."""
+    start = pd.to_datetime(previous_dates).to_numpy().astype("datetime64[D]")
+    end = pd.to_datetime(dates).to_numpy().astype("datetime64[D]")
+    years = range(start.min().astype(object).year, end.max().astype(object).year + 1)
+    holidays = sorted(day for year in years for day in b3_holidays(year))
+    return np.busday_count(start, end, holidays=np.array(holidays, dtype="datetime64[D]"))
+
+
+def detect_price_discontinuities(
+    closes: pd.DataFrame,
+    tolerance: float = DEFAULT_TOLERANCE,
+    max_gap: int = MAX_GAP_SESSIONS
+) -> pd.DataFrame:
+    """
+    Encontra saltos entre fechamentos próximos compatíveis com desdobro/grupamento.
+
+    Vetorizado para o universo inteiro: compara o log da razão entre cada
+    fechamento e o anterior válido do mesmo ticker com o log de todos os
+    fatores de uma vez.
+
+    Args:
+        closes: Fechamentos, índice = data (YYYY-MM-DD), colunas = tickers
+        tolerance: Diferença relativa aceita entre o salto e o fator
+        max_gap: Pregões máximos entre o fechamento anterior e o atual
+
+    Returns:
+        DataFrame com ticker, date, previous_date, previous_close, close,
+        event_type, ratio_from e ratio_to (um salto por linha)
+    """
+    columns = ["ticker", "date", "previous_date", "previous_close", "close",
+               "event_type", "ratio_from", "ratio_to"]
+    if closes.empty:
+        return pd.DataFrame(columns=columns)
+
+    closes = closes.sort_index().astype(float).where(lambda df: df > 0)
+    observed = closes.notna().to_numpy()
+    values = closes.to_numpy()
+    dates = closes.index.astype(str).to_numpy()
+
+    # Último fechamento válido anterior (e sua data) de cada célula
+    previous = closes.ffill().shift(1).to_numpy()
+    date_grid = pd.DataFrame(
+        np.where(observed, dates[:, None], None), index=closes.index, columns=closes.columns
+    )
+    previous_dates = date_grid.ffill().shift(1).to_numpy()
+
+    # Salto > 1: preço caiu (desdobro); < 1: preço subiu (grupamento)
+    factors = np.array(COMMON_SPLIT_FACTORS, dtype=float)
+    targets = np.log(np.concatenate([factors, 1 / factors]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jumps = np.log(previous / values)
+    distance = np.abs(jumps[..., None] - targets)
+    best = np.argmin(np.where(np.isnan(distance), np.inf, distance), axis=2)
+    matched = observed & (np.take_along_axis(distance, best[..., None], axis=2)[..., 0] <= np.log1p(tolerance))
+
+    rows, cols = np.nonzero(matched)
+    if len(rows):
+        near = _sessions_between(previous_dates[rows, cols], dates[rows]) <= max_gap
+        rows, cols = rows[near], cols[near]
+    if not len(rows):
+        return pd.DataFrame(columns=columns)
+
+    choice = best[rows, cols]
+    is_split = choice < len(factors)
+    factor = factors[choice % len(factors)]
+    return pd.DataFrame({
+        "ticker": closes.columns.to_numpy()[cols],
+        "date": dates[rows],
+        "previous_date": previous_dates[rows, cols],
+        "previous_close": previous[rows, cols],
+        "close": values[rows, cols],
+        "event_type": np.where(is_split, "DESDOBRO", "GRUPAMENTO"),
+        "ratio_from": np.where(is_split, 1.0, factor),
+        "ratio_to": np.where(is_split, factor, 1.0),
+    }, columns=columns)
+
+
+def load_quote_price_history(tickers: List[str]) -> pd.DataFrame:
+    """
+    Fechamentos gravados em quote_history, como negociados (sem ajuste).
+
+    Returns:
+        DataFrame índice = data, colunas = tickers (só tickers com histórico)
+    """
+    history = load_history(tickers, adjusted=False)
+    return pd.DataFrame({
+        ticker: pd.Series(columns["close"], index=[decode_date(d) for d in columns["date"].tolist()])
+        for ticker, columns in history.items()
+    })
+
+
+def load_trade_price_history(cursor, asset_ids: List[int]) -> pd.DataFrame:
+    """
+    Histórico de preços a partir das operações de compra/venda registradas.
+
+    Usa o preço mediano de cada ativo por pregão (ignora ajustes com preço
+    zero e operações sintéticas de eventos).
+
+    Returns:
+        DataFrame índice = data, colunas = tickers
+    """
+    frames = []
+    for chunk in chunked(asset_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"""
+            SELECT a.ticker, o.trade_date, o.price
+            FROM operations o
+            JOIN assets a ON a.id = o.asset_id
+            WHERE o.asset_id IN ({placeholders}) AND o.status = 'ACTIVE'
+              AND o.movement_type IN ('COMPRA', 'VENDA') AND o.price > 0
+              AND COALESCE(o.operation_subtype, '') NOT IN ('DESDOBRO', 'GRUPAMENTO', 'BONIFICACAO')
+              AND COALESCE(o.source, '') != 'RECONCILIATION'
+        """, chunk)
+        frames.append(pd.DataFrame(cursor.fetchall(), columns=["ticker", "date", "price"]))
+
+    history = pd.concat(frames) if frames else pd.DataFrame(columns=["ticker", "date", "price"])
+    if history.empty:
+        return pd.DataFrame()
+    return history.pivot_table(index="date", columns="ticker", values="price", aggfunc="median")
+
+
+def _recorded_event_windows(cursor, asset_ids: Dict[str, int]) -> Dict[int, List[str]]:
+    """Datas de eventos já registrados (corporate_events e ajustes sintéticos) por ativo."""
+    recorded: Dict[int, List[str]] = {}
+    for chunk in chunked(list(asset_ids.values())):
+        placeholders = ",".join("?" * len(chunk))
+        subtypes = ",".join("?" * len(ADJUSTMENT_SUBTYPES))
+        cursor.execute(f"""
+            SELECT asset_id, ex_date FROM corporate_events WHERE asset_id IN ({placeholders})
+            UNION ALL
+            SELECT asset_id, trade_date FROM operations
+            WHERE asset_id IN ({placeholders}) AND status = 'ACTIVE'
+              AND operation_subtype IN ({subtypes})
+        """, (*chunk, *chunk, *ADJUSTMENT_SUBTYPES))
+        for asset_id, event_date in cursor.fetchall():
+            recorded.setdefault(asset_id, []).append(event_date)
+    return recorded
+
+
+def suggest_corporate_events(
+    closes: Optional[pd.DataFrame] = None,
+    tolerance: float = DEFAULT_TOLERANCE
+) -> Dict:
+    """
+    Sugere desdobros/grupamentos não registrados para os ativos em carteira.
+
+    Preços de quote_history quando o ativo tem histórico gravado; senão, das
+    operações registradas (esparsas: só saltos entre operações a até
+    MAX_GAP_SESSIONS pregões contam). Um salto é descartado se já houver evento registrado entre o fechamento
+    anterior (exclusive) e a data do salto (inclusive). A quantidade sugerida
+    é o ajuste da posição na data do fechamento anterior.
+
+    Args:
+        closes: Histórico de fechamentos (índice = data, colunas = tickers).
+                Se None, usa quote_history e, na falta dele, as operações.
+        tolerance: Diferença relativa aceita entre o salto e o fator
+
+    Returns:
+        Dicionário com scanned_tickers e events (formato de
+        /admin/apply-corporate-events, com ratio_from/ratio_to)
+    """
+    held = {asset_id: p for asset_id, p in get_positions().items() if p["quantity"] > 0}
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        tickers = {}
+        for chunk in chunked(list(held)):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT ticker, id FROM assets WHERE id IN ({placeholders})", chunk)
+            tickers.update(cursor.fetchall())
+
+        if closes is None:
+            closes = load_quote_price_history(list(tickers))
+            without_history = [asset_id for ticker, asset_id in tickers.items() if ticker not in closes.columns]
+            closes = pd.concat([closes, load_trade_price_history(cursor, without_history)], axis=1)
+        closes = closes[[t for t in closes.columns if t in tickers]]
+
+        jumps = detect_price_discontinuities(closes, tolerance)
+        recorded = _recorded_event_windows(cursor, tickers)
+
+    candidates = [
+        jump for jump in jumps.itertuples(index=False)
+        if not any(
+            jump.previous_date < event_date <= jump.date
+            for event_date in recorded.get(tickers[jump.ticker], [])
+        )
+    ]
+    positions = get_positions_as_of((tickers[c.ticker], c.previous_date) for c in candidates)
+
+    events = []
+    for candidate in candidates:
+        quantity = positions[(tickers[candidate.ticker], candidate.previous_date)]["quantity"]
+        if quantity <= 0:
+            continue
+        delta = quantity * candidate.ratio_to / candidate.ratio_from - quantity
+        events.append({
+            "type": candidate.event_type,
+            "ticker": candidate.ticker,
+            "quantity": round(delta, 8),
+            "date": candidate.date,
+            "description": (
+                f"{candidate.event_type.capitalize()} {candidate.ratio_from:g}:{candidate.ratio_to:g} sugerido: "
+                f"preço de R$ {candidate.previous_close:.2f} ({candidate.previous_date}) "
+                f"para R$ {candidate.close:.2f} ({candidate.date})"
+            ),
+            "ratio_from": float(candidate.ratio_from),
+            "ratio_to": float(candidate.ratio_to),
+        })
+
+    logger.info(f"Detecção de desdobros: {len(closes.columns)} tickers, {len(events)} eventos sugeridos")
+    return {"scanned_tickers": len(closes.columns), "events": events}
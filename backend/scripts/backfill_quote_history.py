@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Carga do histórico diário de cotações (tabela quote_history).
+
+Uso:
+    python3 backend/scripts/backfill_quote_history.py [--years 5] [--tickers PETR4,VALE3]
+
+Incremental: tickers já carregados são buscados só a partir do último pregão
+gravado, então o script pode ser repetido (ou interrompido) sem retrabalho.
+O agendador de cotações (QUOTES_SCHEDULER_ENABLED=1) mantém o histórico em
+dia após cada fechamento; este script serve para a primeira carga.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+# Adicionar o diretório backend ao PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.quote_history import backfill_history, HISTORY_YEARS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga do histórico diário de cotações")
+    parser.add_argument("--years", type=int, default=HISTORY_YEARS, help="Anos na primeira carga de cada ticker")
+    parser.add_argument("--tickers", help="Tickers separados por vírgula (padrão: ativos com posição)")
+    args = parser.parse_args()
+
+    tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()] if args.tickers else None
+
+    start = time.perf_counter()
+    try:
+        result = backfill_history(tickers, years=args.years)
+    except Exception as e:
+        logger.error(f"❌ Erro na carga do histórico: {e}", exc_info=True)
+        return 1
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"📈 {result['tickers']} tickers em {result['batches']} blocos: "
+        f"{result['rows']} pregões gravados em {elapsed:.2f}s"
+    )
+    if result["missing"]:
+        logger.warning(f"  ⚠️  Sem dados: {', '.join(result['missing'])}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Benchmark de throughput da importação B3.
+
+Mede, para cada tamanho de arquivo e formato:
+- rows/sec de `import_b3_excel` (Movimentação; Negociação só com --kinds),
+  contando só as operações inseridas
+- rows/sec de `import_position_snapshot` (Posição), contando os snapshots
+- pico de memória (RSS) do processo
+- tamanho final do banco SQLite
+
+Cada caso roda em um processo novo, com banco temporário próprio, para que
+o pico de RSS e o tamanho do banco não sejam contaminados por casos anteriores.
+
+Uso:
+    python scripts/benchmark_import.py --sizes 1k,10k --output bench.json
+    python scripts/benchmark_import.py --sizes 10k --baseline bench.json --tolerance 0.2
+
+O script termina com código 1 se algum caso não gravar nenhuma linha ou,
+com --baseline, se ficar mais lento (rows/sec) ou mais pesado (RSS) do que
+a tolerância permite.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Adicionar o diretório backend ao PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.generate_b3_files import GENERATORS, parse_rows, write_b3_file
+
+KINDS = ["negociacao", "movimentacao", "posicao"]
+# Negociação fica fora do padrão: o arquivo gerado não tem a coluna
+# Entrada/Saída e `is_real_operation` descarta todas as linhas, então o caso
+# sempre termina sem linhas gravadas (use --kinds para medir mesmo assim)
+DEFAULT_KINDS = ["movimentacao", "posicao"]
+FORMATS = ["xlsx", "csv", "parquet"]
+DEFAULT_SIZES = "1k,10k,100k"
+
+
+class _UploadFile:
+    """Simula o UploadFile do FastAPI a partir de um arquivo em disco (use com `with`)."""
+    def __init__(self, path):
+        self.filename = os.path.basename(path)
+        self.file = open(path, "rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: KB no Linux, bytes no macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _db_size_mb(db_path: str) -> float:
+    size = 0
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            size += os.path.getsize(db_path + suffix)
+    return size / (1024 * 1024)
+
+
+def _run_case(kind: str, path: str, n_rows: int, setup_path: str = None) -> dict:
+    """Executa um caso isolado (chamado em processo filho)."""
+    logging.disable(logging.INFO)
+
+    import app.db.database as db_module
+    from app.services.importer import import_b3_excel
+    from app.services.reconciliation import import_position_snapshot
+
+    work_dir = tempfile.mkdtemp(prefix="bench_b3_")
+    db_module.DATA_DIR = __import__("pathlib").Path(work_dir)
+    db_module.DB_PATH = os.path.join(work_dir, "portfolio.db")
+    db_module.init_db()
+
+    # Posição é comparada contra operações já importadas
+    if setup_path:
+        with _UploadFile(setup_path) as setup:
+            import_b3_excel(setup)
+
+    with _UploadFile(path) as upload:
+        start = time.perf_counter()
+        if kind == "posicao":
+            result = import_position_snapshot(upload)
+            processed = result["snapshots_created"]
+        else:
+            result = import_b3_excel(upload)
+            processed = result["inserted"]
+        elapsed = time.perf_counter() - start
+
+    return {
+        "kind": kind,
+        "format": os.path.splitext(path)[1].lstrip("."),
+        "rows": n_rows,
+        "processed": processed,
+        "error": None if processed else "nenhuma linha gravada",
+        "seconds": round(elapsed, 3),
+        # Throughput do que foi efetivamente gravado (não das linhas lidas)
+        "rows_per_sec": round(processed / elapsed, 1) if processed and elapsed > 0 else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "db_size_mb": round(_db_size_mb(db_module.DB_PATH), 2),
+    }
+
+
+def _ensure_file(cache_dir: str, kind: str, n_rows: int, fmt: str) -> str:
+    """Gera (uma vez) o arquivo sintético do caso."""
+    path = os.path.join(cache_dir, f"{kind}_{n_rows}.{fmt}")
+    if not os.path.exists(path):
+        print(f"  gerando {path} ...", flush=True)
+        write_b3_file(GENERATORS[kind](n_rows), path)
+    return path
+
+
+def run_benchmarks(sizes, kinds, formats, cache_dir) -> list:
+    results = []
+    ctx = get_context("spawn")
+
+    for n_rows in sizes:
+        for fmt in formats:
+            for kind in kinds:
+                path = _ensure_file(cache_dir, kind, n_rows, fmt)
+                setup = _ensure_file(cache_dir, "movimentacao", n_rows, fmt) if kind == "posicao" else None
+
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    result = pool.submit(_run_case, kind, path, n_rows, setup).result()
+
+                results.append(result)
+                if result["error"]:
+                    print(f"  ❌ {kind:<13} {fmt:<8} {n_rows:>9} linhas: {result['error']}", flush=True)
+                    continue
+                print(
+                    f"  {kind:<13} {fmt:<8} {n_rows:>9} linhas: "
+                    f"{result['processed']:>9} gravadas  {result['rows_per_sec']:>10} rows/s  "
+                    f"RSS {result['peak_rss_mb']:>7} MB  DB {result['db_size_mb']:>7} MB",
+                    flush=True
+                )
+    return results
+
+
+def compare_with_baseline(results: list, baseline: list, tolerance: float) -> list:
+    """Retorna lista de regressões (rows/sec menor ou RSS maior que a tolerância)."""
+    index = {(b["kind"], b["format"], b["rows"]): b for b in baseline}
+    regressions = []
+
+    for r in results:
+        base = index.get((r["kind"], r["format"], r["rows"]))
+        if not base or r.get("error"):
+            continue
+        if base["rows_per_sec"] and r["rows_per_sec"] < base["rows_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{r['kind']}/{r['format']}/{r['rows']}: rows/sec {r['rows_per_sec']} < baseline {base['rows_per_sec']}"
+            )
+        if r["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{r['kind']}/{r['format']}/{r['rows']}: RSS {r['peak_rss_mb']} MB > baseline {base['peak_rss_mb']} MB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de importação B3")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Ex: 1k,10k,100k,1m")
+    parser.add_argument("--kinds", default=",".join(DEFAULT_KINDS), help=f"Entre {KINDS}")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "b3_bench_files"))
+    parser.add_argument("--output", help="Grava resultados em JSON")
+    parser.add_argument("--baseline", help="JSON de execução anterior para comparação")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Regressão tolerada (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    sizes = [parse_rows(s) for s in args.sizes.split(",")]
+    kinds = args.kinds.split(",")
+    formats = args.formats.split(",")
+
+    unknown = [k for k in kinds if k not in KINDS]
+    if unknown:
+        parser.error(f"Tipos não suportados: {unknown}. Use {KINDS}")
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        parser.error(f"Formatos não suportados: {unknown}. Use {FORMATS}")
+
+    print(f"📊 Benchmark de importação: tamanhos={sizes} tipos={kinds} formatos={formats}")
+    results = run_benchmarks(sizes, kinds, formats, args.cache_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Resultados gravados em {args.output}")
+
+    failed = [r for r in results if r["error"]]
+    if failed:
+        print("❌ Casos sem linhas gravadas:")
+        for r in failed:
+            print(f"  - {r['kind']}/{r['format']}/{r['rows']}: {r['error']}")
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressões detectadas:")
+            for r in regressions:
+                print(f"  - {r}")
+            return 1
+        print("✅ Sem regressões em relação ao baseline")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
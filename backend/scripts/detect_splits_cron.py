@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Detecção noturna de desdobros/grupamentos não registrados.
+
+Uso:
+    python3 backend/scripts/detect_splits_cron.py [--output sugestoes.json]
+
+Cron job recomendado (após o fechamento do pregão):
+    30 20 * * 1-5 cd /path/to/portfolio-manager-v2 && python3 backend/scripts/detect_splits_cron.py
+
+As sugestões gravadas em --output podem ser revisadas e enviadas para
+/admin/apply-corporate-events.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+# Adicionar o diretório backend ao PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.split_detection import suggest_corporate_events
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detecção de desdobros/grupamentos não registrados")
+    parser.add_argument("--output", help="Grava as sugestões em JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        result = suggest_corporate_events()
+    except Exception as e:
+        logger.error(f"❌ Erro na detecção de eventos: {e}", exc_info=True)
+        return 1
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"🔎 {result['scanned_tickers']} tickers analisados em {elapsed:.2f}s")
+    for event in result["events"]:
+        logger.info(f"  ⚠️  {event['ticker']}: {event['description']} (ajuste {event['quantity']:+g})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result["events"], f, indent=2, ensure_ascii=False)
+        logger.info(f"💾 Sugestões gravadas em {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Gerador de arquivos B3 sintéticos para testes de carga e benchmarks.
+
+Gera arquivos realistas de:
+- Negociação: compras/vendas em mercado à vista e fracionário (tickers com F)
+- Movimentação: transferências, Atualizações, Rendimentos e eventos
+  corporativos (Bonificação, Desdobro, Leilão de Fração, Subscrição)
+- Posição: snapshot de posição por ativo (import_position_snapshot)
+
+Os dados são determinísticos (seed) e incluem uma fração de linhas
+duplicadas para exercitar a deduplicação.
+
+Uso:
+    python scripts/generate_b3_files.py --kind negociacao --rows 10000 --output /tmp/neg.xlsx
+    python scripts/generate_b3_files.py --kind movimentacao --rows 1m --output /tmp/mov.csv
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+import pandas as pd
+
+# Tickers reais usados como base (ações, FIIs e ETFs)
+BASE_TICKERS = [
+    ("ITSA4", "ITAUSA S.A."), ("PETR4", "PETROLEO BRASILEIRO S.A. PETROBRAS"),
+    ("VALE3", "VALE S.A."), ("ABEV3", "AMBEV S.A."), ("BBAS3", "BANCO DO BRASIL S.A."),
+    ("BBDC4", "BANCO BRADESCO S.A."), ("ITUB4", "ITAU UNIBANCO HOLDING S.A."),
+    ("WEGE3", "WEG S.A."), ("TAEE11", "TRANSMISSORA ALIANCA DE ENERGIA ELETRICA S.A."),
+    ("EGIE3", "ENGIE BRASIL ENERGIA S.A."), ("CMIG4", "CIA ENERGETICA DE MINAS GERAIS"),
+    ("SAPR11", "CIA SANEAMENTO DO PARANA - SANEPAR"), ("KLBN11", "KLABIN S.A."),
+    ("BBSE3", "BB SEGURIDADE PARTICIPACOES S.A."), ("FESA4", "CIA FERRO LIGAS DA BAHIA"),
+    ("HGLG11", "CSHG LOGISTICA FDO INV IMOB"), ("HFOF11", "HEDGE TOP FOFII 3 FDO INV IMOB"),
+    ("KNRI11", "KINEA RENDA IMOBILIARIA FDO INV IMOB"), ("MXRF11", "MAXI RENDA FDO INV IMOB"),
+    ("XPML11", "XP MALLS FDO INV IMOB"), ("BOVA11", "ISHARES BOVA CI"),
+    ("IVVB11", "ISHARES S&P 500 FDO INV COTAS FDO INDICE"), ("SMAL11", "ISHARES SMALL CI"),
+]
+
+INSTITUTIONS = [
+    "CLEAR CORRETORA - GRUPO XP",
+    "XP INVESTIMENTOS CCTVM S/A",
+    "NU INVEST CORRETORA DE VALORES S.A.",
+]
+
+# (movimentação, peso relativo)
+MOVIMENTACOES = [
+    ("Transferência - Liquidação", 70),
+    ("Atualização", 8),
+    ("Rendimento", 8),
+    ("Juros Sobre Capital Próprio", 4),
+    ("Bonificação em Ativos", 3),
+    ("Desdobro", 2),
+    ("Leilão de Fração", 2),
+    ("Direito de Subscrição", 2),
+    ("Cessão de Direitos", 1),
+]
+
+DUPLICATE_RATIO = 0.02
+START_DATE = date(2019, 1, 2)
+
+ROW_SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def parse_rows(value: str) -> int:
+    """Converte '10k', '1m' ou '2500' em número de linhas."""
+    value = str(value).lower()
+    if value in ROW_SIZES:
+        return ROW_SIZES[value]
+    return int(value)
+
+
+def _tickers(rng: random.Random, count: int):
+    """Universo de tickers: base real + tickers sintéticos para volumes grandes."""
+    tickers = list(BASE_TICKERS)
+    for i in range(max(0, count - len(tickers))):
+        suffix = rng.choice(["3", "4", "11"])
+        tickers.append((f"SY{i:03d}{suffix}", f"EMPRESA SINTETICA {i}"))
+    return tickers[:max(count, 1)]
+
+
+def _trade_dates(rng: random.Random, n_rows: int):
+    """Datas úteis crescentes a partir de START_DATE."""
+    dates = []
+    current = START_DATE
+    for _ in range(n_rows):
+        if rng.random() < 0.3:
+            current += timedelta(days=1)
+            while current.weekday() >= 5:
+                current += timedelta(days=1)
+        dates.append(current)
+    return dates
+
+
+def _with_duplicates(rng: random.Random, rows: list, n_rows: int) -> list:
+    """Substitui parte das linhas por cópias exatas de linhas anteriores."""
+    for i in range(1, n_rows):
+        if rng.random() < DUPLICATE_RATIO:
+            rows[i] = dict(rows[rng.randrange(0, i)])
+    return rows
+
+
+def generate_negociacao(n_rows: int, seed: int = 42, n_tickers: int = 60) -> pd.DataFrame:
+    """
+    Gera DataFrame no formato do relatório de Negociação B3.
+
+    Lotes múltiplos de 100 vão para o mercado à vista; os demais para o
+    fracionário, com sufixo F no código de negociação.
+    """
+    rng = random.Random(seed)
+    tickers = _tickers(rng, n_tickers)
+    rows = []
+
+    for trade_date in _trade_dates(rng, n_rows):
+        ticker, _ = rng.choice(tickers)
+        fractional = rng.random() < 0.4 and not ticker.endswith("11")
+        quantity = rng.randint(1, 99) if fractional else rng.randint(1, 10) * 100
+        price = round(rng.uniform(5, 120), 2)
+        rows.append({
+            "Data do Negócio": trade_date.strftime("%d/%m/%Y"),
+            "Tipo de Movimentação": "Compra" if rng.random() < 0.7 else "Venda",
+            "Mercado": "Mercado Fracionário" if fractional else "Mercado à Vista",
+            "Prazo/Vencimento": "-",
+            "Instituição": rng.choice(INSTITUTIONS),
+            "Código de Negociação": f"{ticker}F" if fractional else ticker,
+            "Quantidade": quantity,
+            "Preço": price,
+            "Valor": round(quantity * price, 2),
+        })
+
+    return pd.DataFrame(_with_duplicates(rng, rows, n_rows))
+
+
+def generate_movimentacao(n_rows: int, seed: int = 42, n_tickers: int = 60) -> pd.DataFrame:
+    """
+    Gera DataFrame no formato do extrato de Movimentação B3.
+
+    Inclui Atualizações (snapshots que não são operações), Rendimentos sem
+    quantidade e eventos corporativos com preço "-".
+    """
+    rng = random.Random(seed)
+    tickers = _tickers(rng, n_tickers)
+    kinds = [m for m, _ in MOVIMENTACOES]
+    weights = [w for _, w in MOVIMENTACOES]
+    rows = []
+
+    for trade_date in _trade_dates(rng, n_rows):
+        ticker, name = rng.choice(tickers)
+        movimentacao = rng.choices(kinds, weights)[0]
+        quantity = rng.randint(1, 500)
+        price = round(rng.uniform(5, 120), 2)
+        entrada = "Credito"
+
+        if movimentacao == "Transferência - Liquidação":
+            entrada = "Credito" if rng.random() < 0.7 else "Debito"
+        elif movimentacao in ("Rendimento", "Juros Sobre Capital Próprio"):
+            quantity = 0
+        elif movimentacao == "Leilão de Fração":
+            entrada = "Debito"
+            quantity = rng.randint(1, 3)
+
+        no_price = movimentacao in ("Atualização", "Bonificação em Ativos", "Desdobro")
+        rows.append({
+            "Entrada/Saída": entrada,
+            "Data": trade_date.strftime("%d/%m/%Y"),
+            "Movimentação": movimentacao,
+            "Produto": f"{ticker} - {name}",
+            "Instituição": rng.choice(INSTITUTIONS),
+            "Quantidade": quantity,
+            "Preço unitário": "-" if no_price else price,
+            "Valor da Operação": "-" if no_price else round(quantity * price, 2),
+        })
+
+    return pd.DataFrame(_with_duplicates(rng, rows, n_rows))
+
+
+def generate_posicao(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Gera DataFrame no formato do relatório de Posição B3 (um ativo por linha).
+
+    Para volumes grandes (ex.: contas consolidadas de família) usa tickers
+    sintéticos, já que cada linha representa um ativo distinto.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for ticker, name in _tickers(rng, n_rows):
+        rows.append({
+            "Produto": f"{ticker} - {name}",
+            "Instituição": rng.choice(INSTITUTIONS),
+            "Código de Negociação": ticker,
+            "Tipo": "PN" if ticker.endswith("4") else "ON",
+            "Quantidade": rng.randint(1, 2000),
+        })
+    return pd.DataFrame(rows)
+
+
+GENERATORS = {
+    "negociacao": generate_negociacao,
+    "movimentacao": generate_movimentacao,
+    "posicao": generate_posicao,
+}
+
+
+def _mixed_columns(df: pd.DataFrame) -> list:
+    """Colunas com números misturados a texto (ex.: preço "-" em eventos)."""
+    return [c for c in df.columns if df[c].dtype == object and df[c].map(type).nunique() > 1]
+
+
+def write_b3_file(df: pd.DataFrame, path: str) -> str:
+    """
+    Grava o DataFrame no formato indicado pela extensão do arquivo.
+
+    - .xlsx: como exportado pela Área do Investidor
+    - .csv: separador ';' e vírgula decimal (padrão de planilhas pt-BR)
+    - .parquet: colunas com "-" misturado a números são gravadas como texto
+    """
+    ext = os.path.splitext(path)[1].lower()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    if ext == ".xlsx":
+        df.to_excel(path, index=False)
+    elif ext == ".csv":
+        # decimal="," só afeta colunas float; colunas mistas (número e "-") são formatadas aqui
+        df = df.assign(**{
+            c: df[c].map(lambda v: str(v).replace(".", ",") if isinstance(v, float) else v)
+            for c in _mixed_columns(df)
+        })
+        df.to_csv(path, index=False, sep=";", decimal=",", encoding="utf-8")
+    elif ext == ".parquet":
+        df.astype({c: str for c in _mixed_columns(df)}).to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Formato não suportado: {ext}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera arquivos B3 sintéticos")
+    parser.add_argument("--kind", choices=sorted(GENERATORS), required=True)
+    parser.add_argument("--rows", default="1k", help="Linhas: 1k, 10k, 100k, 1m ou número")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", required=True, help="Arquivo de saída (.xlsx, .csv ou .parquet)")
+    args = parser.parse_args()
+
+    n_rows = parse_rows(args.rows)
+    df = GENERATORS[args.kind](n_rows, seed=args.seed)
+    write_b3_file(df, args.output)
+    print(f"✅ {len(df)} linhas de {args.kind} gravadas em {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
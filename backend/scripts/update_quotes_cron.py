@@ -2,23 +2,32 @@
 """
 Script de atualização de cotações para execução via cron.
 
+Preferível: o agendador dentro da aplicação (QUOTES_SCHEDULER_ENABLED=1),
+que segue o calendário da B3 (feriados, horário do pregão, atualização de
+fechamento) e prioriza as maiores posições.
+
 Uso:
-    python3 backend/scripts/update_quotes_cron.py
+    python3 backend/scripts/update_quotes_cron.py [--force]
+
+Fora do pregão da B3 (noite, fim de semana, feriado) o script não faz nada,
+a menos que receba --force.
 
-Cron job recomendado (atualizar a cada 15 minutos durante horário de mercado):
+Cron job (se não usar o agendador interno):
     */15 9-18 * * 1-5 cd /path/to/portfolio-manager-v2 && python3 backend/scripts/update_quotes_cron.py
 """
 
 import sys
 import os
+import argparse
 import logging
 from datetime import datetime
 
-# Adicionar o diretório raiz ao path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+# Adicionar o diretório backend ao PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from backend.app.repositories import quotes_repository
-from backend.app.services.market_data_service import MarketDataService
+from app.repositories import quotes_repository
+from app.services.market_calendar import B3Calendar
+from app.services.market_data_service import MarketDataService
 
 # Configurar logging
 logging.basicConfig(
@@ -45,15 +54,14 @@ def update_all_quotes():
         
         if not tickers:
             logger.info("ℹ️  Nenhum ticker para atualizar")
-            return
+            return {"success": True, "updated": 0, "failed": 0, "total": 0}
         
         logger.info(f"📋 {len(tickers)} tickers para atualizar: {', '.join(tickers[:10])}{'...' if len(tickers) > 10 else ''}")
         
-        # Buscar cotações do yfinance
+        # Buscar cotações no provedor (o serviço grava todas no banco em um commit)
         market_service = MarketDataService()
-        quotes = market_service.get_batch_quotes(tickers)
+        quotes = market_service.get_batch_quotes(tickers, force_refresh=True)
         
-        # Salvar no banco
         updated_count = 0
         failed_count = 0
         
@@ -61,12 +69,8 @@ def update_all_quotes():
             quote_data = quotes.get(ticker)
             
             if quote_data:
-                if quotes_repository.save_quote(ticker, quote_data):
-                    updated_count += 1
-                    logger.info(f"  ✅ {ticker}: R$ {quote_data.get('price', 0):.2f}")
-                else:
-                    failed_count += 1
-                    logger.warning(f"  ❌ {ticker}: Falha ao salvar")
+                updated_count += 1
+                logger.info(f"  ✅ {ticker}: R$ {quote_data.get('price', 0):.2f}")
             else:
                 failed_count += 1
                 logger.warning(f"  ⚠️  {ticker}: Cotação não disponível")
@@ -90,6 +94,14 @@ def update_all_quotes():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Atualiza cotações dos ativos com posição")
+    parser.add_argument("--force", action="store_true", help="Atualiza mesmo com o pregão fechado")
+    args = parser.parse_args()
+    
+    if not args.force and not B3Calendar().is_open():
+        logger.info("ℹ️  Pregão da B3 fechado; nada a atualizar (use --force)")
+        sys.exit(0)
+    
     result = update_all_quotes()
     
     # Exit code: 0 = sucesso, 1 = falha
@@ -0,0 +1,16 @@
+"""
+Fixtures compartilhadas dos testes.
+"""
+
+import pytest
+
+import app.db.database as db_module
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Cria banco temporário com o schema completo da aplicação."""
+    path = str(tmp_path / "portfolio.db")
+    monkeypatch.setattr(db_module, "DB_PATH", path)
+    db_module.init_db()
+    return path
@@ -0,0 +1,61 @@
+"""
+Testes do classificador de movimentações e da detecção de eventos corporativos.
+"""
+
+import pandas as pd
+import pytest
+
+from app.services.importer import (
+    classify_movimentacao,
+    detect_corporate_events,
+    is_real_operation,
+)
+
+
+def test_classify_movimentacao_events_are_case_insensitive():
+    assert classify_movimentacao("BONIFICAÇÃO EM ATIVOS").events == ("BONIFICACAO",)
+    assert classify_movimentacao("Direito de Subscrição").events == ("SUBSCRICAO",)
+    assert classify_movimentacao("Leilão de Fração").events == ("LEILAO_FRACAO",)
+    assert classify_movimentacao("Transferência - Liquidação").events == ()
+
+
+def test_classify_movimentacao_is_cached():
+    classify_movimentacao.cache_clear()
+    classify_movimentacao("Desdobro")
+    classify_movimentacao("Desdobro")
+    assert classify_movimentacao.cache_info().hits == 1
+
+
+def test_is_real_operation_rules():
+    assert not is_real_operation({"Movimentação": "Atualização", "Entrada/Saída": "Credito"})
+    assert not is_real_operation({"Movimentação": "Rendimento", "Quantidade": 0})
+    assert is_real_operation({"Movimentação": "Bonificação em Ativos", "Quantidade": 5})
+    assert is_real_operation({"Movimentação": "Desdobro", "Quantidade": 0})
+    assert is_real_operation({"Movimentação": "Cessão", "Entrada/Saída": "Debito"})
+    assert not is_real_operation({"Movimentação": "Cessão", "Entrada/Saída": ""})
+
+
+def test_detect_corporate_events_groups_by_type_in_order():
+    df = pd.DataFrame([
+        {"Movimentação": "Direito de Subscrição", "Código de Negociação": "ITSA4", "Quantidade": 3, "Data do Negócio": "2026-01-05"},
+        {"Movimentação": "Desdobro", "Código de Negociação": "PETR4", "Quantidade": 10, "Data do Negócio": "2026-01-04"},
+        {"Movimentação": "Leilão de Fração", "Código de Negociação": "ITSA4", "Quantidade": -1, "Data do Negócio": "2026-01-03"},
+        {"Movimentação": "Bonificação em Ativos", "Código de Negociação": "ITSA4", "Quantidade": 2, "Data do Negócio": "2026-01-02"},
+        {"Movimentação": "Transferência - Liquidação", "Código de Negociação": "VALE3", "Quantidade": 1, "Data do Negócio": "2026-01-01"},
+        {"Movimentação": None, "Código de Negociação": "VALE3", "Quantidade": 1, "Data do Negócio": "2026-01-01"},
+    ])
+
+    events = detect_corporate_events(df)
+
+    assert [(e["type"], e["original_row"]) for e in events] == [
+        ("BONIFICACAO", 3),
+        ("DESDOBRO", 1),
+        ("CORRECAO", 2),
+        ("SUBSCRICAO", 0),
+    ]
+    assert events[2]["skip"] is True
+    assert events[2]["description"] == "Leilão de fração: venda de 1.0 fracionárias"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,125 @@
+"""
+Testes da aplicação em lote de eventos corporativos.
+"""
+
+import sqlite3
+
+import pytest
+
+from app.services.corporate_events import apply_corporate_events
+from app.services.position_engine import get_positions
+
+
+def create_asset(conn, ticker):
+    cursor = conn.execute("""
+        INSERT INTO assets (ticker, asset_class, asset_type, product_name, created_at)
+        VALUES (?, 'AÇÕES', 'ON', ?, '2026-01-01')
+    """, (ticker, ticker))
+    return cursor.lastrowid
+
+
+def event(ticker, quantity, date="2025-03-10", type_="BONIFICACAO", **extra):
+    return {"type": type_, "ticker": ticker, "quantity": quantity, "date": date,
+            "description": f"{type_} {ticker}", **extra}
+
+
+def count_adjustments(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM operations WHERE source = 'AJUSTE_LOTE'").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_applies_valid_events_and_reports_invalid_ones(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    conn.execute("""
+        INSERT INTO operations (asset_id, trade_date, movement_type, quantity, price, value,
+                                created_at, source, market, institution)
+        VALUES (?, '2025-01-10', 'COMPRA', 100, 10, 1000, '2026-01-01', 'MANUAL', '', 'CLEAR')
+    """, (asset_id,))
+    conn.commit()
+    conn.close()
+    get_positions([asset_id])
+
+    result = apply_corporate_events([
+        event("ITSA4", 10),
+        event("PETR4", 5),
+        event("ITSA4", 0),
+        event("ITSA4", 3, date="10/03/2025"),
+        event("ITSA4", 1, type_="LEILAO_FRACAO", skip=True),
+    ])
+
+    assert result["applied"] == 1
+    assert result["skipped"] == 1
+    assert len(result["errors"]) == 3
+    assert result["recomputed"] == 1
+    assert count_adjustments(temp_db) == 1
+    assert get_positions([asset_id])[asset_id]["quantity"] == 110
+
+
+def test_atomic_mode_cancels_whole_batch(temp_db):
+    conn = sqlite3.connect(temp_db)
+    create_asset(conn, "ITSA4")
+    conn.commit()
+    conn.close()
+
+    result = apply_corporate_events([event("ITSA4", 10), event("PETR4", 5)], atomic=True)
+
+    assert result["status"] == "error"
+    assert result["applied"] == 0
+    assert count_adjustments(temp_db) == 0
+
+
+def test_reapplying_same_events_does_not_double_adjust(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    create_asset(conn, "BBAS3")
+    conn.commit()
+    conn.close()
+    payload = [event("ITSA4", 10), event("BBAS3", 5)]
+
+    first = apply_corporate_events(payload)
+    second = apply_corporate_events(payload + [event("ITSA4", 2, date="2025-04-10")])
+
+    assert (first["applied"], second["applied"], second["already_applied"]) == (2, 1, 2)
+    assert second["status"] == "success" and second["errors"] == []
+    assert count_adjustments(temp_db) == 3
+    assert get_positions([asset_id])[asset_id]["quantity"] == 12
+
+
+def test_distinct_events_with_same_date_and_quantity_are_both_applied(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    conn.commit()
+    conn.close()
+    payload = [event("ITSA4", 10), event("ITSA4", 10, type_="DESDOBRO")]
+
+    first = apply_corporate_events(payload)
+    second = apply_corporate_events(payload)
+
+    assert (first["applied"], first["already_applied"]) == (2, 0)
+    assert (second["applied"], second["already_applied"]) == (0, 2)
+    assert count_adjustments(temp_db) == 2
+    assert get_positions([asset_id])[asset_id]["quantity"] == 20
+
+
+def test_adjustments_stored_before_event_type_in_market_are_recognized(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    conn.execute("""
+        INSERT INTO operations (asset_id, trade_date, movement_type, quantity, price, value, created_at,
+                                source, market, institution, operation_subtype)
+        VALUES (?, '2025-03-10', 'COMPRA', 10, 0, 0, '2026-01-01', 'AJUSTE_LOTE', '', '', 'BONIFICACAO')
+    """, (asset_id,))
+    conn.commit()
+    conn.close()
+
+    result = apply_corporate_events([event("ITSA4", 10)])
+
+    assert (result["applied"], result["already_applied"]) == (0, 1)
+    assert count_adjustments(temp_db) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
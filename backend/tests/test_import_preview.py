@@ -0,0 +1,109 @@
+"""
+Testes do preview (dry-run) de importação B3.
+
+Valida que o preview classifica linhas como novas, duplicadas ou
+não-operações sem gravar nada no banco.
+"""
+
+import sqlite3
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+from app.services.importer import import_b3_excel, preview_b3_import
+
+
+class MockFile:
+    """Mock de arquivo para simular upload."""
+    def __init__(self, buffer, filename="movimentacao.xlsx"):
+        self.file = buffer
+        self.filename = filename
+
+
+def create_movimentacao_excel(rows):
+    """Cria arquivo Excel no formato de Movimentação B3."""
+    buffer = BytesIO()
+    pd.DataFrame(rows).to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def movimentacao_row(data, movimentacao, produto, quantidade, preco, entrada="Credito"):
+    return {
+        "Entrada/Saída": entrada,
+        "Data": data,
+        "Movimentação": movimentacao,
+        "Produto": produto,
+        "Instituição": "CLEAR",
+        "Quantidade": quantidade,
+        "Preço unitário": preco,
+        "Valor da Operação": quantidade * preco,
+    }
+
+
+ROWS = [
+    movimentacao_row("02/01/2026", "Transferência - Liquidação", "ITSA4 - ITAUSA S.A.", 100, 10.0),
+    movimentacao_row("03/01/2026", "Transferência - Liquidação", "PETR4 - PETROBRAS", 50, 30.0),
+    movimentacao_row("04/01/2026", "Atualização", "ITSA4 - ITAUSA S.A.", 110, 0.0),
+]
+
+
+def test_preview_classifies_rows_without_writing(temp_db):
+    preview = preview_b3_import(MockFile(create_movimentacao_excel(ROWS)))
+
+    assert preview["total_rows"] == 3
+    assert preview["summary"]["new"] == 2
+    assert preview["summary"]["duplicated"] == 0
+    assert preview["summary"]["skipped_non_operations"] == 1
+    assert preview["assets_to_create"] == ["ITSA4", "PETR4"]
+    assert [r["status"] for r in preview["rows"]] == ["new", "new", "non_operation"]
+
+    conn = sqlite3.connect(temp_db)
+    assert conn.execute("SELECT COUNT(*) FROM operations").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0] == 0
+    conn.close()
+
+
+def test_preview_matches_import_after_commit(temp_db):
+    first = import_b3_excel(MockFile(create_movimentacao_excel(ROWS)))
+    assert first["inserted"] == 2
+
+    extra = ROWS + [movimentacao_row("05/01/2026", "Transferência - Liquidação", "VALE3 - VALE S.A.", 10, 60.0)]
+    preview = preview_b3_import(MockFile(create_movimentacao_excel(extra)))
+
+    assert preview["summary"]["new"] == 1
+    assert preview["summary"]["duplicated"] == 2
+    assert preview["assets_to_create"] == ["VALE3"]
+
+    second = import_b3_excel(MockFile(create_movimentacao_excel(extra)))
+    assert second["inserted"] == preview["summary"]["new"]
+    assert second["duplicated"] == preview["summary"]["duplicated"]
+
+
+def test_preview_detects_duplicates_inside_file(temp_db):
+    rows = [ROWS[0], ROWS[0]]
+    preview = preview_b3_import(MockFile(create_movimentacao_excel(rows)))
+
+    assert preview["summary"]["new"] == 1
+    assert preview["summary"]["duplicated"] == 1
+
+
+def test_preview_pagination_and_filter(temp_db):
+    preview = preview_b3_import(
+        MockFile(create_movimentacao_excel(ROWS)), page=2, page_size=1, status="new"
+    )
+
+    assert preview["total_filtered"] == 2
+    assert preview["total_pages"] == 2
+    assert len(preview["rows"]) == 1
+    assert preview["rows"][0]["ticker"] == "PETR4"
+
+
+def test_preview_rejects_invalid_status(temp_db):
+    with pytest.raises(ValueError):
+        preview_b3_import(MockFile(create_movimentacao_excel(ROWS)), status="foo")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,78 @@
+"""
+Testes do calendário da B3 e do agendador de cotações.
+"""
+
+from datetime import date, datetime, timedelta
+
+from app.services.market_calendar import B3_TZ, B3Calendar, b3_holidays
+from app.services.quote_scheduler import QuoteRefreshScheduler, prioritize_by_value
+
+
+class FixedCalendar(B3Calendar):
+    """Calendário com relógio controlado pelo teste."""
+    def __init__(self, moment):
+        super().__init__()
+        self.moment = moment
+
+    def now(self):
+        return self.moment
+
+
+def brt(*args):
+    return datetime(*args, tzinfo=B3_TZ)
+
+
+def test_holidays_and_sessions():
+    holidays = b3_holidays(2026)
+
+    # Carnaval, Sexta-feira Santa, Corpus Christi, Consciência Negra, 31/12
+    for day in ["2026-02-16", "2026-02-17", "2026-04-03", "2026-06-04", "2026-11-20", "2026-12-31"]:
+        assert date.fromisoformat(day) in holidays
+    assert date(2023, 11, 20) not in b3_holidays(2023)
+
+    calendar = B3Calendar()
+    # Quarta-feira de Cinzas abre às 13h
+    assert calendar.session(date(2026, 2, 18))[0] == brt(2026, 2, 18, 13, 0)
+    assert calendar.session(date(2026, 2, 21)) is None
+    assert calendar.is_open(brt(2026, 2, 18, 14, 0))
+    assert not calendar.is_open(brt(2026, 2, 18, 11, 0))
+    # Sexta à noite antes do Carnaval: próxima abertura na quarta
+    assert calendar.next_open(brt(2026, 2, 13, 19, 0)) == brt(2026, 2, 18, 13, 0)
+
+
+def test_quote_expiry_uses_ttl_in_session_and_next_open_off_hours():
+    calendar = B3Calendar()
+    ttl = timedelta(minutes=15)
+
+    assert calendar.quote_expiry(brt(2026, 3, 6, 11, 0), ttl) == brt(2026, 3, 6, 11, 15)
+    assert calendar.quote_expiry(brt(2026, 3, 6, 18, 30), ttl) == brt(2026, 3, 9, 10, 0)
+    assert calendar.quote_expiry(brt(2026, 3, 7, 12, 0), ttl) == brt(2026, 3, 9, 10, 0)
+
+
+def test_scheduler_plans_session_runs_settle_then_sleeps_until_open():
+    calendar = FixedCalendar(brt(2026, 3, 6, 9, 0))
+    scheduler = QuoteRefreshScheduler(service=None, calendar=calendar, interval_minutes=15, settle_delay_minutes=20)
+
+    assert scheduler.next_run() == (brt(2026, 3, 6, 10, 0), "session")
+
+    calendar.moment = brt(2026, 3, 6, 10, 2)
+    assert scheduler.next_run() == (calendar.moment, "session")
+    scheduler._last_run_at = brt(2026, 3, 6, 10, 2)
+    assert scheduler.next_run() == (brt(2026, 3, 6, 10, 17), "session")
+
+    # Última janela não cabe antes do fechamento: próxima é a de fechamento
+    scheduler._last_run_at = brt(2026, 3, 6, 17, 50)
+    calendar.moment = brt(2026, 3, 6, 17, 55)
+    assert scheduler.next_run() == (brt(2026, 3, 6, 18, 20), "settle")
+
+    scheduler._settled_day = date(2026, 3, 6)
+    calendar.moment = brt(2026, 3, 6, 18, 30)
+    assert scheduler.next_run() == (brt(2026, 3, 9, 10, 0), "session")
+
+
+def test_tickers_prioritized_by_position_value():
+    positions = {"PETR4": 100, "VALE3": 50, "ITSA4": 1000, "NOVO3": 10}
+    quotes = {"PETR4": {"price": 38.0}, "VALE3": {"price": 60.0}, "ITSA4": {"price": 10.0}}
+
+    # NOVO3 sem cotação primeiro; depois ITSA4 (10000), PETR4 (3800), VALE3 (3000)
+    assert prioritize_by_value(positions, quotes) == ["NOVO3", "ITSA4", "PETR4", "VALE3"]
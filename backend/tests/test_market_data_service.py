@@ -0,0 +1,407 @@
+"""
+Testes do MarketDataService (busca em lote, sem acesso à rede).
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import app.services.leases as leases_module
+import app.services.quote_providers as providers_module
+from app.repositories import quotes_repository
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.fetch_executor import ConcurrentFetcher, TokenBucket
+from app.services.leases import LeaderLease, claim
+from app.services.market_calendar import B3_TZ, B3Calendar
+from app.services.market_data_service import MarketDataService
+from app.services.quote_cache import QuoteCache
+from app.services.quote_providers import FallbackQuoteProvider, FileQuoteProvider, YFinanceProvider
+
+
+def history_frame(prices):
+    """Pregões de vários símbolos em colunas (símbolo, campo); frame[símbolo] = resposta de Ticker.history."""
+    index = pd.to_datetime(["2026-01-05", "2026-01-06"])
+    frames = {
+        symbol: pd.DataFrame({
+            "Open": closes, "High": closes, "Low": closes, "Close": closes,
+            "Adj Close": closes, "Volume": [1000, 2000],
+        }, index=index)
+        for symbol, closes in prices.items()
+    }
+    return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+
+class CountingProvider(YFinanceProvider):
+    """Provedor yfinance com respostas fixas (sem rede) que registra os blocos pedidos."""
+    def __init__(self, prices, failures=0):
+        super().__init__(fetcher=ConcurrentFetcher(max_in_flight=4, max_retries=2, backoff_base=0))
+        self.prices = prices
+        self.requests = []
+        self.failures = failures
+
+    def _download(self, symbols, **kwargs):
+        self.requests.append(list(symbols))
+        if self.failures:
+            self.failures -= 1
+            raise TimeoutError("timeout")
+        return super()._download(symbols, **kwargs)
+
+    def _request(self, symbol, **kwargs):
+        return history_frame(self.prices)[symbol] if symbol in self.prices else pd.DataFrame()
+
+
+def test_batch_quotes_use_one_request_per_symbol_and_previous_close_from_response(temp_db, monkeypatch):
+    prices = {"PETR4.SA": [37.65, 38.50], "VALE3.SA": [60.0, 59.0]}
+    http_requests = []
+
+    def history(ticker, **kwargs):
+        # Cada Ticker.history é uma requisição HTTP ao Yahoo
+        http_requests.append(ticker.ticker)
+        return history_frame(prices)[ticker.ticker] if ticker.ticker in prices else pd.DataFrame()
+
+    monkeypatch.setattr(providers_module.yf.Ticker, "history", history)
+    provider = YFinanceProvider(fetcher=ConcurrentFetcher(max_in_flight=1, max_retries=0))
+    service = MarketDataService(provider=provider)
+
+    quotes = service.get_batch_quotes(["PETR4", "vale3.SA", "XPTO3"])
+
+    # Sem requisição extra de fechamento anterior: uma por símbolo
+    assert sorted(http_requests) == ["PETR4.SA", "VALE3.SA", "XPTO3.SA"]
+    assert quotes["PETR4"]["price"] == 38.50
+    assert quotes["PETR4"]["previous_close"] == 37.65
+    assert quotes["PETR4"]["change_percent"] == 2.26
+    assert quotes["VALE3"]["change"] == -1.0
+    assert quotes["XPTO3"] is None
+
+    # Segunda chamada sai do cache; o bloco respondeu, então o símbolo sem
+    # pregões entra no cache negativo e não volta ao provedor
+    assert service.get_quote("PETR4")["price"] == 38.50
+    service.get_batch_quotes(["PETR4", "VALE3", "XPTO3"])
+    assert http_requests[3:] == []
+    stats = service.cache_stats()
+    assert stats["negative"]["blocked"] == ["XPTO3"]
+    assert stats["breaker"]["state"] == "closed"
+
+
+def test_lone_unquotable_ticker_is_negative_cached_without_tripping_breaker(temp_db, monkeypatch):
+    http_requests = []
+
+    def history(ticker, **kwargs):
+        http_requests.append(ticker.ticker)
+        return history_frame({"PETR4.SA": [37.65, 38.50]})[ticker.ticker] if ticker.ticker == "PETR4.SA" else pd.DataFrame()
+
+    monkeypatch.setattr(providers_module.yf.Ticker, "history", history)
+    service = MarketDataService(
+        provider=YFinanceProvider(fetcher=ConcurrentFetcher(max_in_flight=1, max_retries=2, backoff_base=0)),
+        breaker=CircuitBreaker("yfinance", failure_threshold=2, reset_timeout=60)
+    )
+
+    for _ in range(3):
+        assert service.get_quote("OIBR3") is None
+
+    # Uma requisição, sem retentativas; o provedor segue disponível
+    assert http_requests == ["OIBR3.SA"]
+    stats = service.cache_stats()
+    assert stats["negative"]["blocked"] == ["OIBR3"]
+    assert stats["breaker"]["state"] == "closed"
+    assert service.get_quote("PETR4")["price"] == 38.50
+
+
+def test_large_watchlist_is_split_into_retried_concurrent_batches(temp_db, monkeypatch):
+    monkeypatch.setattr(providers_module, "BATCH_SIZE", 2)
+    prices = {f"TEST{i}.SA": [10.0, 10.0 + i] for i in range(5)}
+    provider = CountingProvider(prices, failures=1)
+    service = MarketDataService(provider=provider)
+
+    quotes = service.get_batch_quotes([f"TEST{i}" for i in range(5)])
+
+    assert all(quotes[f"TEST{i}"]["price"] == 10.0 + i for i in range(5))
+    # 3 blocos + 1 retentativa
+    assert len(provider.requests) == 4
+    assert max(len(r) for r in provider.requests) == 2
+
+
+def test_failed_download_is_retried(temp_db, monkeypatch):
+    http_requests = []
+
+    def history(ticker, **kwargs):
+        http_requests.append(ticker.ticker)
+        if len(http_requests) == 1:
+            raise TimeoutError("timeout")
+        return history_frame({"PETR4.SA": [37.65, 38.50]})["PETR4.SA"]
+
+    monkeypatch.setattr(providers_module.yf.Ticker, "history", history)
+    provider = YFinanceProvider(fetcher=ConcurrentFetcher(max_in_flight=1, max_retries=2, backoff_base=0))
+
+    assert provider.fetch_many(["PETR4"])["PETR4"]["price"] == 38.50
+    assert http_requests == ["PETR4.SA", "PETR4.SA"]
+
+
+def test_answered_block_without_bars_is_not_retried(monkeypatch):
+    http_requests = []
+
+    def history(ticker, **kwargs):
+        http_requests.append(ticker.ticker)
+        if ticker.ticker == "VALE3.SA":
+            raise TimeoutError("timeout")
+        # Símbolo sem pregões: respondido vazio, não é erro de rede
+        return pd.DataFrame()
+
+    monkeypatch.setattr(providers_module.yf.Ticker, "history", history)
+    provider = YFinanceProvider(fetcher=ConcurrentFetcher(max_in_flight=1, max_retries=2, backoff_base=0))
+
+    provider.fetch_many(["XPTO3"])
+    assert http_requests == ["XPTO3.SA"]
+
+    # Erro só em parte do bloco: sem retentativa do bloco inteiro
+    provider.fetch_many(["XPTO3", "VALE3"])
+    assert http_requests[1:] == ["XPTO3.SA", "VALE3.SA"]
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # 2 fichas imediatas + 3 repostas a 50/s
+    assert time.monotonic() - start >= 0.05
+
+    slow = TokenBucket(rate=0.1, capacity=1)
+    assert slow.acquire(timeout=0)
+    assert not slow.acquire(timeout=0)
+
+
+def test_cache_is_bounded_and_counts_hits_misses_evictions():
+    cache = QuoteCache(timedelta(minutes=15), maxsize=2)
+    cache.set("PETR4", 1)
+    cache.set("VALE3", 2)
+    assert cache.get("PETR4") == 1
+    cache.set("ITUB4", 3)  # descarta VALE3 (menos usado recentemente)
+
+    assert cache.get("VALE3") is None
+    assert cache.stats() == {
+        "hits": 1, "misses": 1, "evictions": 1, "expirations": 0,
+        "coalesced": 0, "size": 2, "maxsize": 2,
+    }
+
+
+def test_concurrent_misses_share_one_fetch(temp_db):
+    provider = CountingProvider({"PETR4.SA": [37.65, 38.50]})
+    service = MarketDataService(provider=provider)
+    original_download = provider._download
+    release = threading.Event()
+
+    def slow_download(symbols):
+        release.wait(2)
+        return original_download(symbols)
+
+    provider._download = slow_download
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(service.get_quote, "PETR4") for _ in range(8)]
+        time.sleep(0.2)
+        release.set()
+        prices = [f.result()["price"] for f in futures]
+
+    assert prices == [38.50] * 8
+    assert provider.requests == [["PETR4.SA"]]
+    assert service.cache_stats()["coalesced"] == 7
+
+
+def write_quotes_file(path):
+    pd.DataFrame({
+        "ticker": ["PETR4", "PETR4", "PETR4", "VALE3", "VALE3"],
+        "date": ["2026-01-05", "2026-01-06", "2026-01-07", "2026-01-05", "2026-01-06"],
+        "close": [37.0, 38.0, 39.5, 60.0, 61.0],
+    }).to_parquet(path)
+    return str(path)
+
+
+def test_file_provider_replays_quotes_as_of_date(tmp_path):
+    provider = FileQuoteProvider(write_quotes_file(tmp_path / "quotes.parquet"), as_of="2026-01-06")
+
+    quote = provider.fetch_one("PETR4")
+    assert (quote["price"], quote["previous_close"], quote["source"]) == (38.0, 37.0, "file")
+    assert quote["market_time"].startswith("2026-01-06")
+    assert provider.fetch_many(["VALE3", "XPTO3"])["XPTO3"] is None
+    assert provider.fetch_history(["PETR4", "VALE3"], "2026-01-01").to_dict() == {
+        "PETR4": {"2026-01-05": 37.0, "2026-01-06": 38.0},
+        "VALE3": {"2026-01-05": 60.0, "2026-01-06": 61.0},
+    }
+
+
+def test_fallback_chain_covers_provider_outage(temp_db, tmp_path):
+    primary = CountingProvider({"VALE3.SA": [62.0, 63.0]}, failures=10)
+    primary._fetcher.max_retries = 0
+    chain = FallbackQuoteProvider([primary, FileQuoteProvider(write_quotes_file(tmp_path / "q.parquet"))])
+
+    quotes = MarketDataService(provider=chain).get_batch_quotes(["PETR4", "VALE3"])
+
+    assert quotes["PETR4"]["price"] == 39.5
+    assert quotes["VALE3"]["source"] == "file"
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_reads_serve_stale_quotes_and_revalidate_once_in_background(temp_db):
+    quotes_repository.save_quote("PETR4", {"price": 30.0, "updated_at": "2026-01-01T10:00:00"})
+    provider = CountingProvider({"PETR4.SA": [37.65, 38.50]})
+    release = threading.Event()
+    original_download = provider._download
+    provider._download = lambda symbols, **kwargs: release.wait(2) and original_download(symbols)
+    service = MarketDataService(provider=provider)
+
+    first = service.read_quotes(["PETR4", "VALE3"])
+    second = service.read_quote("PETR4")
+
+    # Nada bloqueou no provedor: cotação vencida servida, ticker sem cotação = None
+    assert (first["PETR4"]["price"], first["PETR4"]["stale"]) == (30.0, True)
+    assert first["PETR4"]["age_seconds"] > 0
+    assert first["VALE3"] is None
+    assert second["stale"] is True
+    release.set()
+
+    assert wait_for(lambda: service.read_quote("PETR4")["price"] == 38.50)
+    assert provider.requests == [["PETR4.SA", "VALE3.SA"]]
+    assert service.read_quote("PETR4")["stale"] is False
+
+
+def test_cold_ticker_is_fetched_on_request_only_when_asked(temp_db):
+    provider = CountingProvider({"PETR4.SA": [37.65, 38.50]})
+    service = MarketDataService(provider=provider)
+
+    assert service.read_quote("PETR4", allow_fetch=True)["price"] == 38.50
+    assert provider.requests == [["PETR4.SA"]]
+
+
+def test_quote_fetched_after_close_stays_fresh_until_next_open(temp_db):
+    class FixedCalendar(B3Calendar):
+        moment = datetime(2026, 3, 7, 12, 0, tzinfo=B3_TZ)
+
+        def now(self):
+            return self.moment
+
+    calendar = FixedCalendar()
+    # Cotação de sexta após o fechamento: vale o fim de semana todo
+    quotes_repository.save_quote("PETR4", {"price": 38.5, "updated_at": "2026-03-06T18:40:00-03:00"})
+    service = MarketDataService(provider=CountingProvider({}), calendar=calendar)
+
+    assert service.read_quote("PETR4")["stale"] is False
+    calendar.moment = datetime(2026, 3, 9, 10, 1, tzinfo=B3_TZ)
+    assert service.read_quote("PETR4")["stale"] is True
+
+
+def test_workers_share_quotes_through_database(temp_db):
+    worker_a = MarketDataService(provider=CountingProvider({"PETR4.SA": [37.65, 38.50]}))
+    worker_b = MarketDataService(provider=CountingProvider({}))
+    worker_b.shared_sync_seconds = 0
+
+    worker_a.get_batch_quotes(["PETR4"])
+    assert worker_b.read_quote("PETR4")["price"] == 38.50
+
+    # Atualização forçada em A aparece em B mesmo com a entrada antiga ainda válida
+    worker_a.provider.prices["PETR4.SA"] = [38.50, 40.0]
+    worker_a.get_batch_quotes(["PETR4"], force_refresh=True)
+
+    assert worker_b.read_quote("PETR4")["price"] == 40.0
+    assert worker_b.provider.requests == []
+    assert worker_b.cache_stats()["shared_version"] == 2
+
+
+def test_leader_lease_is_exclusive_across_processes(temp_db, monkeypatch):
+    leader, follower = LeaderLease("quote-scheduler"), LeaderLease("quote-scheduler")
+
+    monkeypatch.setattr(leases_module, "process_id", lambda: "worker-a")
+    assert leader.acquire() and leader.acquire()
+    assert claim(["quote:PETR4"]) == ["quote:PETR4"]
+
+    monkeypatch.setattr(leases_module, "process_id", lambda: "worker-b")
+    assert not follower.acquire()
+    assert follower.status()["leader"] == "worker-a"
+    assert claim(["quote:PETR4", "quote:VALE3"]) == ["quote:VALE3"]
+
+    monkeypatch.setattr(leases_module, "process_id", lambda: "worker-a")
+    leader.release()
+    monkeypatch.setattr(leases_module, "process_id", lambda: "worker-b")
+    assert follower.acquire() and follower.is_leader
+
+
+def test_unlisted_tickers_are_never_fetched_and_breaker_fails_fast(temp_db):
+    provider = CountingProvider({"PETR4.SA": [37.65, 38.50]}, failures=100)
+    provider._fetcher.max_retries = 0
+    service = MarketDataService(provider=provider, breaker=CircuitBreaker("yfinance", failure_threshold=2, reset_timeout=0.2))
+
+    assert service.get_batch_quotes(["CDB-BANCO-X", "TESOURO SELIC 2029"]) == {
+        "CDB-BANCO-X": None, "TESOURO SELIC 2029": None
+    }
+    assert provider.requests == []
+
+    # Provedor fora do ar: 2 falhas abrem o circuito; a terceira busca nem sai
+    for _ in range(3):
+        service.get_batch_quotes(["PETR4"], force_refresh=True)
+    assert len(provider.requests) == 2
+    assert service.cache_stats()["breaker"]["state"] == "open"
+    assert service.revalidate(["PETR4"]) == 0
+
+    # Após o tempo de espera, uma requisição de teste fecha o circuito
+    provider.failures = 0
+    time.sleep(0.25)
+    assert service.get_batch_quotes(["PETR4"], force_refresh=True)["PETR4"]["price"] == 38.50
+    assert service.cache_stats()["breaker"]["state"] == "closed"
+
+
+def test_refresh_persists_all_quotes_in_one_bulk_write(temp_db, monkeypatch):
+    writes = []
+    save_bulk = quotes_repository.save_quotes_bulk
+    monkeypatch.setattr(quotes_repository, "save_quotes_bulk", lambda quotes: writes.append(quotes) or save_bulk(quotes))
+    tickers = [f"TEST{i}" for i in range(60)]
+    service = MarketDataService(provider=CountingProvider({f"{t}.SA": [10.0, 11.0] for t in tickers}))
+
+    quotes = service.get_batch_quotes(tickers, force_refresh=True)
+
+    assert len(writes) == 1
+    assert sum(1 for quote in writes[0].values() if quote) == 60
+    assert len(quotes_repository.get_quotes(tickers)) == 60
+    assert quotes["TEST59"]["price"] == 11.0
+
+
+def test_outage_with_failed_requests_trips_breaker_without_blocking_tickers(temp_db, monkeypatch):
+    def history(ticker, **kwargs):
+        raise TimeoutError("timeout")
+
+    monkeypatch.setattr(providers_module.yf.Ticker, "history", history)
+    service = MarketDataService(
+        provider=YFinanceProvider(fetcher=ConcurrentFetcher(max_in_flight=1, max_retries=0)),
+        breaker=CircuitBreaker("yfinance", failure_threshold=3, reset_timeout=60)
+    )
+
+    for _ in range(4):
+        service.get_batch_quotes(["PETR4", "VALE3"], force_refresh=True)
+
+    stats = service.cache_stats()
+    assert stats["breaker"]["state"] == "open"
+    assert stats["negative"]["blocked"] == []
+
+
+def test_provider_answering_nothing_counts_as_failure(temp_db):
+    class SilentProvider(FileQuoteProvider):
+        def fetch_many(self, tickers):
+            return {}
+
+    service = MarketDataService(
+        provider=SilentProvider("unused.csv"), breaker=CircuitBreaker("file", failure_threshold=2, reset_timeout=60)
+    )
+
+    service.get_batch_quotes(["PETR4", "VALE3"], force_refresh=True)
+    service.get_batch_quotes(["PETR4", "VALE3"], force_refresh=True)
+
+    stats = service.cache_stats()
+    assert (stats["breaker"]["state"], stats["breaker"]["consecutive_failures"]) == ("open", 2)
+    assert stats["negative"]["blocked"] == []
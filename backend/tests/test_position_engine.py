@@ -0,0 +1,228 @@
+"""
+Testes do engine de posições: cache, checkpoints e recálculo incremental.
+"""
+
+import sqlite3
+
+import pytest
+
+import app.repositories.dashboard_repository as dashboard_module
+from app.repositories.assets_repository import list_assets
+from app.repositories.corporate_events_repository import AdjustmentFactors
+from app.services.corporate_events import register_ratio_event
+from app.services.position_engine import (
+    compute_asset_position,
+    get_positions,
+    get_positions_as_of,
+    refresh_positions,
+)
+
+
+def create_asset(conn, ticker):
+    cursor = conn.execute("""
+        INSERT INTO assets (ticker, asset_class, asset_type, product_name, created_at)
+        VALUES (?, 'AÇÕES', 'ON', ?, '2026-01-01')
+    """, (ticker, ticker))
+    return cursor.lastrowid
+
+
+def add_operation(conn, asset_id, trade_date, movement_type, quantity, price, subtype=None, source="MANUAL"):
+    cursor = conn.execute("""
+        INSERT INTO operations (
+            asset_id, trade_date, movement_type, quantity, price, value,
+            created_at, source, market, institution, operation_subtype
+        ) VALUES (?, ?, ?, ?, ?, ?, '2026-01-01', ?, '', 'CLEAR', ?)
+    """, (asset_id, trade_date, movement_type, quantity, price, quantity * price, source, subtype))
+    return cursor.lastrowid
+
+
+def test_refresh_matches_full_replay(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    add_operation(conn, asset_id, "2025-01-10", "COMPRA", 100, 10.0)
+    add_operation(conn, asset_id, "2025-02-10", "VENDA", 30, 12.0)
+    add_operation(conn, asset_id, "2025-03-10", "COMPRA", 10, 0.0, subtype="BONIFICACAO")
+    add_operation(conn, asset_id, "2025-04-10", "VENDA", 500, 0.0, subtype="GRUPAMENTO")
+    conn.commit()
+    conn.close()
+
+    refreshed = refresh_positions([asset_id])
+
+    assert refreshed[asset_id] == compute_asset_position(asset_id)
+
+
+def test_new_operation_marks_cache_stale_and_resumes_from_checkpoint(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "PETR4")
+    for month in range(1, 7):
+        add_operation(conn, asset_id, f"2025-{month:02d}-15", "COMPRA", 10, 20.0 + month)
+    conn.commit()
+
+    refresh_positions([asset_id])
+    assert conn.execute("SELECT COUNT(*) FROM position_checkpoints").fetchone()[0] == 6
+
+    add_operation(conn, asset_id, "2025-04-20", "VENDA", 15, 30.0)
+    conn.commit()
+    stale_since = conn.execute(
+        "SELECT stale_since FROM position_cache WHERE asset_id = ?", (asset_id,)
+    ).fetchone()[0]
+    assert stale_since == "2025-04-20"
+    conn.close()
+
+    positions = get_positions([asset_id])
+
+    assert positions[asset_id] == compute_asset_position(asset_id)
+    assert positions[asset_id]["quantity"] == 45
+
+
+def test_soft_delete_invalidates_cache(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "VALE3")
+    add_operation(conn, asset_id, "2025-01-10", "COMPRA", 100, 60.0)
+    op_id = add_operation(conn, asset_id, "2025-02-10", "VENDA", 40, 65.0)
+    conn.commit()
+
+    assert get_positions([asset_id])[asset_id]["quantity"] == 60
+
+    conn.execute("UPDATE operations SET status = 'DELETED' WHERE id = ?", (op_id,))
+    conn.commit()
+    conn.close()
+
+    assert get_positions([asset_id])[asset_id]["quantity"] == 100
+
+
+def test_untouched_assets_are_not_recomputed(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ABEV3")
+    b = create_asset(conn, "BBAS3")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 10, 15.0)
+    add_operation(conn, b, "2025-01-10", "COMPRA", 10, 50.0)
+    conn.commit()
+
+    refresh_positions([a, b])
+    computed_at_b = conn.execute(
+        "SELECT computed_at FROM position_cache WHERE asset_id = ?", (b,)
+    ).fetchone()[0]
+
+    add_operation(conn, a, "2025-02-10", "COMPRA", 5, 16.0)
+    conn.commit()
+    get_positions([a, b])
+
+    assert conn.execute(
+        "SELECT computed_at FROM position_cache WHERE asset_id = ?", (b,)
+    ).fetchone()[0] == computed_at_b
+    conn.close()
+
+
+def test_positions_as_of_match_truncated_replay(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    add_operation(conn, asset_id, "2025-01-10", "COMPRA", 100, 10.0)
+    add_operation(conn, asset_id, "2025-01-20", "VENDA", 20, 11.0)
+    add_operation(conn, asset_id, "2025-02-10", "COMPRA", 10, 0.0, subtype="BONIFICACAO")
+    add_operation(conn, asset_id, "2025-04-10", "VENDA", 30, 12.0)
+    conn.commit()
+    conn.close()
+
+    dates = ["2024-12-31", "2025-01-10", "2025-01-31", "2025-03-15", "2025-12-31"]
+    positions = get_positions_as_of((asset_id, d) for d in dates)
+
+    assert [positions[(asset_id, d)]["quantity"] for d in dates] == [0, 100, 80, 90, 60]
+    assert positions[(asset_id, "2025-12-31")] == compute_asset_position(asset_id)
+
+
+def _comparable(position):
+    return {k: position[k] for k in ("quantity", "total_cost", "average_price", "invested_value")}
+
+
+def test_ratio_split_matches_synthetic_rows(temp_db):
+    conn = sqlite3.connect(temp_db)
+    legacy = create_asset(conn, "MGLU3")
+    ratio = create_asset(conn, "MGLU4")
+    for asset_id in (legacy, ratio):
+        add_operation(conn, asset_id, "2025-01-10", "COMPRA", 100, 10.0)
+        add_operation(conn, asset_id, "2025-04-10", "VENDA", 300, 1.2)
+    add_operation(conn, legacy, "2025-02-10", "COMPRA", 900, 0.0, subtype="DESDOBRO")
+    conn.commit()
+    conn.close()
+
+    assert get_positions([ratio])[ratio]["quantity"] == 0.0  # venda maior que a posição sem o evento
+
+    result = register_ratio_event("MGLU4", {
+        "event_type": "DESDOBRO", "ex_date": "2025-02-10", "ratio_from": 1, "ratio_to": 10
+    })
+
+    # Evento invalida o cache e a posição é recalculada na mesma transação
+    assert _comparable(result["position"]) == _comparable(compute_asset_position(legacy))
+    assert _comparable(get_positions([ratio])[ratio]) == _comparable(compute_asset_position(legacy))
+    assert result["event"]["cumulative_factor"] == 10.0
+
+    # Quantidades passadas ficam na unidade vigente na data
+    as_of = get_positions_as_of([(ratio, "2025-01-31"), (ratio, "2025-03-31")])
+    assert as_of[(ratio, "2025-01-31")]["quantity"] == 100
+    assert as_of[(ratio, "2025-03-31")]["quantity"] == 1000
+
+    with pytest.raises(ValueError):
+        register_ratio_event("MGLU3", {
+            "event_type": "DESDOBRO", "ex_date": "2025-02-10", "ratio_from": 1, "ratio_to": 10
+        })
+
+
+def test_bonus_event_adds_attributed_cost(temp_db):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "ITSA4")
+    add_operation(conn, asset_id, "2025-01-10", "COMPRA", 100, 10.0)
+    conn.commit()
+    conn.close()
+    refresh_positions([asset_id])
+
+    register_ratio_event("ITSA4", {
+        "event_type": "BONIFICACAO", "ex_date": "2025-03-10",
+        "ratio_from": 10, "ratio_to": 11, "cost_basis": 5.0
+    })
+
+    position = get_positions([asset_id])[asset_id]
+    assert position["quantity"] == pytest.approx(110)
+    assert position["total_cost"] == pytest.approx(1050.0)
+    assert refresh_positions([asset_id], full=True)[asset_id] == compute_asset_position(asset_id)
+
+
+class FixedQuotes:
+    """Cotações fixas no lugar do serviço de mercado (sem rede)."""
+    def __init__(self, prices):
+        self.prices = prices
+
+    def read_quotes(self, tickers):
+        return {ticker: {"price": self.prices[ticker]} for ticker in tickers if ticker in self.prices}
+
+
+def test_dashboard_values_split_positions_in_current_unit(temp_db, monkeypatch):
+    conn = sqlite3.connect(temp_db)
+    asset_id = create_asset(conn, "MGLU3")
+    add_operation(conn, asset_id, "2025-01-10", "COMPRA", 100, 10.0)
+    conn.commit()
+    conn.close()
+    register_ratio_event("MGLU3", {
+        "event_type": "DESDOBRO", "ex_date": "2025-02-10", "ratio_from": 1, "ratio_to": 10
+    })
+    monkeypatch.setattr(dashboard_module, "get_market_data_service", lambda: FixedQuotes({"MGLU3": 1.5}))
+
+    summary = dashboard_module.get_dashboard_summary()
+
+    assert summary["positions"][0]["quantity"] == 1000
+    assert summary["current_value"] == pytest.approx(1500.0)
+    assert list_assets()[0]["current_position"] == 1000
+
+
+def test_adjustment_factors_lookup():
+    factors = AdjustmentFactors(["2025-01-10", "2025-06-10"], [10.0, 5.0], [])
+
+    assert factors.factor_at("2025-01-09") == 1.0
+    assert factors.factor_at("2025-01-10") == 10.0
+    assert factors.multiplier("2024-12-31") == 5.0
+    assert factors.multiplier("2025-07-01") == 1.0
+    assert factors.adjust_price("2025-03-01", 20.0) == 40.0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,138 @@
+"""
+Testes do histórico diário de cotações (backfill incremental e leitura colunar).
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from app.services.corporate_events import register_ratio_event
+from app.services.quote_history import backfill_history, history_to_json, load_history
+from app.services.quote_providers import FileQuoteProvider, unadjust_splits
+
+
+class RecordingFileProvider(FileQuoteProvider):
+    """Provedor de arquivo que registra os intervalos pedidos."""
+    def __init__(self, path, as_of=None):
+        super().__init__(path, as_of=as_of)
+        self.requests = []
+
+    def fetch_bars(self, tickers, start, end=None):
+        self.requests.append((list(tickers), start))
+        return super().fetch_bars(tickers, start, end)
+
+
+def write_bars(path):
+    pd.DataFrame({
+        "ticker": ["PETR4", "PETR4", "PETR4", "VALE3", "VALE3"],
+        "date": ["2026-01-05", "2026-01-06", "2026-01-07", "2026-01-05", "2026-01-07"],
+        "open": [36.5, 37.2, None, 59.0, 60.5],
+        "high": [37.5, 38.4, 39.0, 60.5, 61.5],
+        "low": [36.0, 37.0, 37.8, 58.5, 60.0],
+        "close": [37.0, 38.0, 38.6, 60.0, 61.0],
+        "volume": [1000, 2000, 1500, 500, 700],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def create_asset(conn, ticker):
+    conn.execute("""
+        INSERT INTO assets (ticker, asset_class, asset_type, product_name, created_at)
+        VALUES (?, 'AÇÕES', 'ON', ?, '2026-01-01')
+    """, (ticker, ticker))
+
+
+def test_backfill_is_batched_and_incremental(temp_db, tmp_path):
+    conn = sqlite3.connect(temp_db)
+    create_asset(conn, "PETR4")
+    create_asset(conn, "VALE3")
+    conn.commit()
+    conn.close()
+    path = write_bars(tmp_path / "bars.csv")
+
+    first = backfill_history(
+        ["PETR4", "VALE3", "XPTO3"], provider=RecordingFileProvider(path, as_of="2026-01-06"), batch_size=1
+    )
+
+    assert (first["batches"], first["rows"], first["missing"]) == (2, 3, ["XPTO3"])
+
+    # Segunda carga: a partir do último pregão gravado de cada ticker (regravado)
+    provider = RecordingFileProvider(path)
+    second = backfill_history(["PETR4", "VALE3"], provider=provider)
+
+    assert provider.requests == [(["VALE3", "PETR4"], "2026-01-05")]
+    assert second["rows"] == 4
+
+
+def test_backfill_rewrites_last_stored_bar(temp_db, tmp_path):
+    conn = sqlite3.connect(temp_db)
+    create_asset(conn, "PETR4")
+    conn.commit()
+    conn.close()
+    path = write_bars(tmp_path / "bars.csv")
+    backfill_history(["PETR4"], provider=FileQuoteProvider(path, as_of="2026-01-07"))
+
+    # Pregão de 07/01 gravado durante a sessão; fechamento final difere
+    bars = pd.read_csv(path)
+    bars.loc[bars["date"].eq("2026-01-07") & bars["ticker"].eq("PETR4"), "close"] = 39.2
+    bars.to_csv(path, index=False)
+    backfill_history(["PETR4"], provider=FileQuoteProvider(path))
+
+    np.testing.assert_array_equal(load_history(["PETR4"], start="2026-01-07")["PETR4"]["close"], [39.2])
+
+
+def test_range_query_returns_columnar_arrays(temp_db, tmp_path):
+    conn = sqlite3.connect(temp_db)
+    create_asset(conn, "PETR4")
+    create_asset(conn, "VALE3")
+    conn.commit()
+    conn.close()
+    backfill_history(["PETR4", "VALE3"], provider=FileQuoteProvider(write_bars(tmp_path / "bars.csv")))
+
+    history = load_history(["PETR4", "VALE3"], start="2026-01-06")
+
+    np.testing.assert_array_equal(history["PETR4"]["date"], [20260106, 20260107])
+    np.testing.assert_array_equal(history["PETR4"]["close"], [38.0, 38.6])
+    np.testing.assert_array_equal(history["VALE3"]["volume"], [700])
+    assert history_to_json(history)["PETR4"] == {
+        "dates": ["2026-01-06", "2026-01-07"],
+        "open": [37.2, None],
+        "high": [38.4, 39.0],
+        "low": [37.0, 37.8],
+        "close": [38.0, 38.6],
+        "volume": [2000, 1500],
+    }
+    assert load_history(["PETR4"], end="2026-01-04") == {}
+
+
+def test_history_is_adjusted_by_registered_events(temp_db, tmp_path):
+    conn = sqlite3.connect(temp_db)
+    create_asset(conn, "PETR4")
+    conn.commit()
+    conn.close()
+    backfill_history(["PETR4"], provider=FileQuoteProvider(write_bars(tmp_path / "bars.csv")))
+    register_ratio_event("PETR4", {
+        "event_type": "DESDOBRO", "ex_date": "2026-01-07", "ratio_from": 1, "ratio_to": 2
+    })
+
+    adjusted = load_history(["PETR4"])["PETR4"]
+    traded = load_history(["PETR4"], adjusted=False)["PETR4"]
+
+    np.testing.assert_allclose(adjusted["close"], [18.5, 19.0, 38.6])
+    np.testing.assert_array_equal(adjusted["volume"], [2000, 4000, 1500])
+    np.testing.assert_array_equal(traded["close"], [37.0, 38.0, 38.6])
+
+
+def test_yahoo_split_adjustment_is_undone():
+    index = pd.to_datetime(["2026-01-05", "2026-01-06", "2026-01-07"])
+    frame = pd.DataFrame({
+        "Open": [3.7, 3.8, 3.9], "High": [3.7, 3.8, 3.9], "Low": [3.7, 3.8, 3.9],
+        "Close": [3.7, 3.8, 3.9], "Volume": [10000, 20000, 15000],
+        "Stock Splits": [0.0, 10.0, 0.0],
+    }, index=index)
+
+    bars = unadjust_splits(frame)
+
+    np.testing.assert_allclose(bars["Close"], [37.0, 3.8, 3.9])
+    np.testing.assert_allclose(bars["Volume"], [1000, 20000, 15000])
@@ -0,0 +1,307 @@
+"""
+Testes de reconciliação: snapshot B3 vs posição calculada.
+"""
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from app.repositories.snapshots_repository import (
+    downsample_snapshot_batches,
+    save_snapshot_batch,
+)
+from app.services.position_engine import compute_asset_position
+from app.services.reconciliation import (
+    auto_fix_positions,
+    extract_ticker_from_product,
+    extract_tickers_from_products,
+    analyze_discrepancies,
+    get_reconciliation_diagnosis,
+    get_system_positions,
+)
+
+
+def create_asset(conn, ticker):
+    cursor = conn.execute("""
+        INSERT INTO assets (ticker, asset_class, asset_type, product_name, created_at)
+        VALUES (?, 'AÇÕES', 'ON', ?, '2026-01-01')
+    """, (ticker, ticker))
+    return cursor.lastrowid
+
+
+def add_operation(conn, asset_id, trade_date, movement_type, quantity, price=10.0, subtype=None):
+    conn.execute("""
+        INSERT INTO operations (
+            asset_id, trade_date, movement_type, quantity, price, value,
+            created_at, source, market, institution, operation_subtype
+        ) VALUES (?, ?, ?, ?, ?, ?, '2026-01-01', 'MANUAL', '', 'CLEAR', ?)
+    """, (asset_id, trade_date, movement_type, quantity, price, quantity * price, subtype))
+
+
+def add_snapshot(conn, asset_id, quantity, snapshot_date="2026-01-31"):
+    save_snapshot_batch(conn.cursor(), {asset_id: quantity}, snapshot_date)
+
+
+def test_vectorized_ticker_extraction_matches_scalar():
+    produtos = pd.Series([
+        "ITSA4 - ITAUSA S.A.",
+        " petr4 ",
+        "CDB - CDB124AUGT1 - BANCO X",
+        "Debênture - PETR16 - PETROBRAS",
+        "LCA - ",
+        "HGLG11 - CSHG LOGISTICA - FII",
+        1234,
+    ])
+
+    expected = [str(extract_ticker_from_product(p)).strip().upper() for p in produtos]
+
+    assert extract_tickers_from_products(produtos).tolist() == expected
+
+
+def test_system_positions_follow_engine_rules(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    b = create_asset(conn, "PETR4")
+    c = create_asset(conn, "VALE3")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 100)
+    add_operation(conn, a, "2025-02-10", "VENDA", 30)
+    add_operation(conn, b, "2025-01-10", "COMPRA", 50)
+    # Grupamento maior que a posição é limitado a zero pelo engine
+    add_operation(conn, b, "2025-03-10", "VENDA", 80, 0.0, subtype="GRUPAMENTO")
+    conn.commit()
+    conn.close()
+
+    positions = get_system_positions([a, b, c])
+
+    assert positions == {a: 70, b: 0, c: 0}
+    assert positions[b] == compute_asset_position(b)["quantity"]
+
+
+def test_diagnosis_reports_only_divergent_assets(temp_db):
+    conn = sqlite3.connect(temp_db)
+    ok = create_asset(conn, "ITSA4")
+    divergent = create_asset(conn, "PETR4")
+    missing_ops = create_asset(conn, "VALE3")
+    add_operation(conn, ok, "2025-01-10", "COMPRA", 100)
+    add_operation(conn, divergent, "2025-01-10", "COMPRA", 300)
+    add_snapshot(conn, ok, 100)
+    add_snapshot(conn, divergent, 200)
+    add_snapshot(conn, missing_ops, 10)
+    conn.commit()
+    conn.close()
+
+    diagnosis = get_reconciliation_diagnosis()
+
+    assert diagnosis["total_assets"] == 3
+    assert diagnosis["assets_ok"] == 1
+    issues = {i["ticker"]: i for i in diagnosis["issues"]}
+    assert issues["PETR4"]["difference"] == 100
+    assert issues["VALE3"]["qty_calculated"] == 0
+    assert issues["VALE3"]["difference"] == -10
+
+
+def test_repeated_diagnosis_reuses_cached_positions(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 100)
+    add_snapshot(conn, a, 90)
+    conn.commit()
+
+    get_reconciliation_diagnosis()
+    computed_at = conn.execute("SELECT computed_at FROM position_cache").fetchone()[0]
+    diagnosis = get_reconciliation_diagnosis()
+
+    assert conn.execute("SELECT computed_at FROM position_cache").fetchone()[0] == computed_at
+    assert diagnosis["issues"][0]["difference"] == 10
+    conn.close()
+
+
+def test_diagnosis_ignores_operations_after_snapshot_date(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 100)
+    add_snapshot(conn, a, 100, "2025-01-31T10:00:00")
+    add_operation(conn, a, "2025-02-10", "COMPRA", 50)
+    conn.commit()
+    conn.close()
+
+    diagnosis = get_reconciliation_diagnosis()
+
+    assert diagnosis["assets_with_issues"] == 0
+
+
+def test_history_diagnosis_reconciles_every_snapshot(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 100)
+    add_operation(conn, a, "2025-03-10", "COMPRA", 50)
+    add_snapshot(conn, a, 100, "2025-01-31T10:00:00")
+    add_snapshot(conn, a, 120, "2025-02-28T10:00:00")
+    add_snapshot(conn, a, 150, "2025-03-31T10:00:00")
+    conn.commit()
+    conn.close()
+
+    latest = get_reconciliation_diagnosis()
+    history = get_reconciliation_diagnosis(history=True)
+
+    assert latest["assets_with_issues"] == 0
+    assert history["total_snapshots"] == 3
+    assert [(i["snapshot_date"], i["difference"]) for i in history["issues"]] == [
+        ("2025-02-28T10:00:00", -20),
+    ]
+
+
+def test_batched_cause_analysis(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    b = create_asset(conn, "PETR4")
+    for price in (10.0, 11.0, 12.0):
+        add_operation(conn, a, "2025-01-10", "COMPRA", 100, price)
+    add_operation(conn, a, "2025-02-10", "COMPRA", 100)
+    add_operation(conn, b, "2025-01-10", "COMPRA", 15)
+    conn.execute("UPDATE operations SET operation_subtype = 'NORMAL' WHERE asset_id = ?", (b,))
+    conn.commit()
+
+    causes = analyze_discrepancies(conn.cursor(), {a: 200, b: -5})
+    conn.close()
+
+    assert causes[a] == [
+        "4 operações sem subtipo (podem ser atualizações)",
+        "Múltiplas operações em: 2025-01-10 (3 ops)",
+        "Diferença é múltiplo de 100 (possível duplicação sistemática)",
+    ]
+    assert causes[b] == ["Causa não identificada automaticamente"]
+
+
+def test_snapshot_batches_store_only_changed_quantities(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    b = create_asset(conn, "PETR4")
+    cursor = conn.cursor()
+
+    first = save_snapshot_batch(cursor, {a: 100, b: 50}, "2025-01-31T10:00:00")
+    second = save_snapshot_batch(cursor, {a: 100, b: 60}, "2025-02-28T10:00:00")
+    conn.commit()
+
+    assert first["changed_positions"] == 2
+    assert second["changed_positions"] == 1
+    assert conn.execute("SELECT COUNT(*) FROM position_snapshots").fetchone()[0] == 3
+    latest = dict(conn.execute(
+        "SELECT asset_id, batch_id FROM position_snapshot_latest"
+    ).fetchall())
+    assert latest == {a: second["batch_id"], b: second["batch_id"]}
+    conn.close()
+
+
+def test_retention_keeps_last_batch_of_month_and_its_changes(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    b = create_asset(conn, "PETR4")
+    cursor = conn.cursor()
+    save_snapshot_batch(cursor, {a: 100, b: 50}, "2025-01-05T10:00:00")
+    save_snapshot_batch(cursor, {a: 120, b: 50}, "2025-01-15T10:00:00")
+    last = save_snapshot_batch(cursor, {a: 120, b: 70}, "2025-01-31T10:00:00")
+    recent = save_snapshot_batch(cursor, {a: 130, b: 70}, "2025-06-30T10:00:00")
+
+    result = downsample_snapshot_batches(cursor, "2025-06-01")
+    conn.commit()
+
+    assert result["batches_removed"] == 2
+    batches = [r[0] for r in conn.execute("SELECT id FROM snapshot_batches ORDER BY id")]
+    assert batches == [last["batch_id"], recent["batch_id"]]
+    rows = conn.execute("""
+        SELECT batch_id, asset_id, quantity FROM position_snapshots ORDER BY batch_id, asset_id
+    """).fetchall()
+    assert rows == [
+        (last["batch_id"], a, 120),
+        (last["batch_id"], b, 70),
+        (recent["batch_id"], a, 130),
+    ]
+    conn.close()
+
+
+def test_retention_keeps_snapshot_date_of_moved_changes(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    b = create_asset(conn, "PETR4")
+    add_operation(conn, a, "2025-01-02", "COMPRA", 100)
+    add_operation(conn, a, "2025-01-10", "VENDA", 100)
+    add_operation(conn, b, "2025-01-02", "COMPRA", 50)
+    cursor = conn.cursor()
+    save_snapshot_batch(cursor, {a: 100, b: 50}, "2025-01-05T10:00:00")
+    save_snapshot_batch(cursor, {b: 50}, "2025-01-20T10:00:00")
+    conn.commit()
+    assert get_reconciliation_diagnosis()["assets_with_issues"] == 0
+
+    downsample_snapshot_batches(cursor, "2025-06-01")
+    conn.commit()
+
+    # ITSA4 = 100 foi observado em 05/01, antes da venda de 10/01
+    assert conn.execute(
+        "SELECT snapshot_date FROM position_snapshots WHERE asset_id = ?", (a,)
+    ).fetchall() == [("2025-01-05T10:00:00",)]
+    assert get_reconciliation_diagnosis()["assets_with_issues"] == 0
+    assert auto_fix_positions(dry_run=True)["adjustments"] == []
+    conn.close()
+
+
+def test_auto_fix_dry_run_then_apply_once(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    b = create_asset(conn, "PETR4")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 100)
+    add_operation(conn, b, "2025-01-10", "COMPRA", 50)
+    add_snapshot(conn, a, 90, "2025-01-31T10:00:00")
+    add_snapshot(conn, b, 50, "2025-01-31T10:00:00")
+    conn.commit()
+
+    preview = auto_fix_positions(dry_run=True)
+    assert preview["adjustments"] == [
+        {"ticker": "ITSA4", "adjustment": -10, "reason": "Discrepância de +10.00 ações corrigida"}
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM operations").fetchone()[0] == 2
+
+    first = auto_fix_positions(idempotency_key="fix-1")
+    replay = auto_fix_positions(idempotency_key="fix-1")
+    second = auto_fix_positions()
+
+    assert first["fixed_count"] == 1
+    assert replay["replayed"] is True
+    assert replay["fixed_count"] == 1
+    assert second["fixed_count"] == 0
+    assert conn.execute("""
+        SELECT asset_id, trade_date, movement_type, quantity FROM operations
+        WHERE source = 'RECONCILIATION'
+    """).fetchall() == [(a, "2025-01-31", "VENDA", 10)]
+    assert get_reconciliation_diagnosis()["assets_with_issues"] == 0
+    conn.close()
+
+
+def test_auto_fix_repeated_on_same_snapshot_date_folds_into_one_adjustment(temp_db):
+    conn = sqlite3.connect(temp_db)
+    a = create_asset(conn, "ITSA4")
+    add_operation(conn, a, "2025-01-10", "COMPRA", 100)
+    add_snapshot(conn, a, 90, "2025-01-31T10:00:00")
+    conn.commit()
+    auto_fix_positions()
+
+    # Mesma diferença de novo na mesma data: ajuste cancelado, depois nova compra
+    conn.execute("UPDATE operations SET status = 'CANCELLED' WHERE source = 'RECONCILIATION'")
+    conn.commit()
+    assert auto_fix_positions()["fixed_count"] == 1
+    add_operation(conn, a, "2025-01-20", "COMPRA", 10)
+    conn.commit()
+    result = auto_fix_positions()
+
+    assert result["adjustments"][0]["previous_adjustment"] == -10
+    assert conn.execute("""
+        SELECT movement_type, quantity FROM operations
+        WHERE source = 'RECONCILIATION' AND status = 'ACTIVE'
+    """).fetchall() == [("VENDA", 20)]
+    assert get_reconciliation_diagnosis()["assets_with_issues"] == 0
+    conn.close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,82 @@
+"""
+Testes da detecção de desdobros/grupamentos por saltos de preço.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from app.repositories.quote_history_repository import upsert_bars
+from app.services.corporate_events import register_ratio_event
+from app.services.split_detection import detect_price_discontinuities, suggest_corporate_events
+
+
+def create_asset(conn, ticker):
+    cursor = conn.execute("""
+        INSERT INTO assets (ticker, asset_class, asset_type, product_name, created_at)
+        VALUES (?, 'AÇÕES', 'ON', ?, '2026-01-01')
+    """, (ticker, ticker))
+    return cursor.lastrowid
+
+
+def add_operation(conn, asset_id, trade_date, movement_type, quantity, price):
+    conn.execute("""
+        INSERT INTO operations (
+            asset_id, trade_date, movement_type, quantity, price, value,
+            created_at, source, market, institution
+        ) VALUES (?, ?, ?, ?, ?, ?, '2026-01-01', 'MANUAL', '', 'CLEAR')
+    """, (asset_id, trade_date, movement_type, quantity, price, quantity * price))
+
+
+def test_detects_split_and_reverse_split_across_tickers():
+    closes = pd.DataFrame({
+        "MGLU3": [20.0, 20.4, 2.05, 2.1],
+        "OIBR3": [0.50, np.nan, 5.10, 5.0],
+        "PETR4": [38.0, 30.0, 31.0, 32.0],
+    }, index=["2025-01-02", "2025-01-03", "2025-01-06", "2025-01-07"])
+
+    jumps = detect_price_discontinuities(closes)
+
+    assert jumps[["ticker", "date", "previous_date", "event_type", "ratio_from", "ratio_to"]].values.tolist() == [
+        ["MGLU3", "2025-01-06", "2025-01-03", "DESDOBRO", 1.0, 10.0],
+        ["OIBR3", "2025-01-06", "2025-01-02", "GRUPAMENTO", 10.0, 1.0],
+    ]
+
+
+def add_bars(conn, asset_id, closes):
+    upsert_bars(conn.cursor(), [
+        (asset_id, int(day.replace("-", "")), close, close, close, close, 1000) for day, close in closes.items()
+    ])
+
+
+def test_suggests_only_unrecorded_events(temp_db):
+    conn = sqlite3.connect(temp_db)
+    mglu = create_asset(conn, "MGLU3")
+    vale = create_asset(conn, "VALE3")
+    itub = create_asset(conn, "ITUB4")
+    # MGLU3: operações esparsas, mas o histórico gravado mostra o desdobro
+    add_operation(conn, mglu, "2025-01-10", "COMPRA", 100, 20.0)
+    add_operation(conn, mglu, "2025-03-10", "COMPRA", 100, 2.0)
+    add_bars(conn, mglu, {"2025-01-10": 20.0, "2025-02-03": 20.4, "2025-02-04": 2.05, "2025-03-10": 2.0})
+    # VALE3: sem histórico gravado; operações em pregões vizinhos
+    add_operation(conn, vale, "2025-03-07", "COMPRA", 100, 60.0)
+    add_operation(conn, vale, "2025-03-10", "COMPRA", 100, 30.0)
+    # ITUB4: preço caiu à metade entre operações com um ano de distância
+    add_operation(conn, itub, "2024-03-01", "COMPRA", 100, 40.0)
+    add_operation(conn, itub, "2025-03-03", "COMPRA", 100, 20.0)
+    conn.commit()
+    conn.close()
+
+    result = suggest_corporate_events()
+
+    assert result["scanned_tickers"] == 3
+    assert [(e["ticker"], e["type"], e["quantity"], e["date"]) for e in result["events"]] == [
+        ("MGLU3", "DESDOBRO", 900.0, "2025-02-04"),
+        ("VALE3", "DESDOBRO", 100.0, "2025-03-10"),
+    ]
+
+    register_ratio_event("VALE3", {
+        "event_type": "DESDOBRO", "ex_date": "2025-03-10", "ratio_from": 1, "ratio_to": 2
+    })
+    assert [e["ticker"] for e in suggest_corporate_events()["events"]] == ["MGLU3"]
@@ -31,7 +31,7 @@ export function DragAndDropArea({ onFileSelected }: Props) {
       <input
         ref={inputRef}
         type="file"
-        accept=".xlsx,.csv"
+        accept=".xlsx,.csv,.parquet"
         hidden
         onChange={(e) => handleFiles(e.target.files)}
       />
@@ -42,7 +42,7 @@ export function DragAndDropArea({ onFileSelected }: Props) {
           <strong>Arraste o arquivo aqui</strong><br />
           ou clique para selecionar
         </p>
-        <span className="dropzone-hint">Formatos aceitos: .xlsx, .csv</span>
+        <span className="dropzone-hint">Formatos aceitos: .xlsx, .csv, .parquet</span>
       </div>
     </div>
   );